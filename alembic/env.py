@@ -20,8 +20,8 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///simpleisp.db")
 from modules.auth.models import User  # noqa
 from modules.clients.models import Client  # noqa
 from modules.routers.models import Router  # noqa
-from modules.billing.models import Payment  # noqa
-from modules.settings.models import Settings  # noqa
+from modules.billing.models import Payment, ClientUsage, UsageCounter  # noqa
+from modules.settings.models import Settings, SettingsVersion  # noqa
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,59 @@
+"""Add client usage tables
+
+Revision ID: 5b2d8e41c7a3
+Revises: 3fced6a48079
+Create Date: 2026-10-17 10:12:04.218930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2d8e41c7a3'
+down_revision: Union[str, Sequence[str], None] = '3fced6a48079'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # init_db() crea las tablas que faltan al arrancar: solo se crean si no existen
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'clientusage' not in tables:
+        op.create_table(
+            'clientusage',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('client_id', sa.Integer(), nullable=False),
+            sa.Column('cycle_start', sa.Date(), nullable=False),
+            sa.Column('bytes_up', sa.BigInteger(), nullable=False),
+            sa.Column('bytes_down', sa.BigInteger(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['client_id'], ['client.id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('client_id', 'cycle_start'),
+        )
+        op.create_index(op.f('ix_clientusage_client_id'), 'clientusage', ['client_id'], unique=False)
+        op.create_index(op.f('ix_clientusage_cycle_start'), 'clientusage', ['cycle_start'], unique=False)
+    if 'usagecounter' not in tables:
+        op.create_table(
+            'usagecounter',
+            sa.Column('router_id', sa.Integer(), nullable=False),
+            sa.Column('target', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+            sa.Column('queue_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+            sa.Column('bytes_up', sa.BigInteger(), nullable=False),
+            sa.Column('bytes_down', sa.BigInteger(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('router_id', 'target'),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('usagecounter')
+    op.drop_index(op.f('ix_clientusage_cycle_start'), table_name='clientusage')
+    op.drop_index(op.f('ix_clientusage_client_id'), table_name='clientusage')
+    op.drop_table('clientusage')
@@ -0,0 +1,31 @@
+"""Add client name index
+
+Revision ID: 8e4a1f0c9d52
+Revises: 5b2d8e41c7a3
+Create Date: 2026-10-17 10:31:47.602115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4a1f0c9d52'
+down_revision: Union[str, Sequence[str], None] = '5b2d8e41c7a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Búsqueda por prefijo y orden por nombre de GET /api/clients
+    indexes = {ix['name'] for ix in sa.inspect(op.get_bind()).get_indexes('client')}
+    if 'ix_client_name' not in indexes:
+        op.create_index(op.f('ix_client_name'), 'client', ['name'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_client_name'), table_name='client')
@@ -0,0 +1,35 @@
+"""Add settings version
+
+Revision ID: c07f3b9a2e18
+Revises: 8e4a1f0c9d52
+Create Date: 2026-10-17 10:44:09.513720
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c07f3b9a2e18'
+down_revision: Union[str, Sequence[str], None] = '8e4a1f0c9d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Contador que invalida la caché de configuración de los demás workers
+    if 'settingsversion' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'settingsversion',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('settingsversion')
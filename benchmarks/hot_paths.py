@@ -0,0 +1,419 @@
+"""
+Benchmarks for the hot paths, against a seeded database and simulated routers.
+
+For every (clients, routers) scenario the database is recreated and seeded in
+bulk, and a fleet of simulated RouterOS devices (benchmarks/simulator.py)
+is started in a separate process, with one queue per client. Then this script
+measures:
+
+- clients_page:       GET /api/clients (first page, formatted and raw stats)
+- dashboard_summary:  GET /api/dashboard/summary
+- telemetry_poll:     one TelemetryPoller.poll_once over every router
+- suspension_pass:    one run_suspension_pass (about 30% of clients change)
+- client_create:      POST /api/clients, BENCH_CONCURRENCY requests in flight
+- payment_post:       POST /api/payments reactivating suspended clients
+- ws_fanout:          telemetry tick -> frame delivered to every /ws/traffic
+                      subscriber of the TrafficHub
+
+HTTP requests go through the ASGI app in process (httpx.ASGITransport), with
+authentication replaced by a fixed admin user, so the numbers exclude the
+network and uvicorn but include routing, validation, SQL and router I/O.
+
+Usage (from the project root; httpx is only needed for the benchmarks):
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.hot_paths --clients 1000,10000,50000 --routers 10,100 --output bench.json
+
+The JSON output (one document with `meta` and `results`) is meant to be
+diffed between releases. The database is dropped and recreated per scenario,
+so DATABASE_URL is ignored: the benchmark runs on a temporary SQLite file
+unless --database-url is given (e.g. a throwaway Postgres database), together
+with --reset-db to confirm that its tables may be dropped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+BENCH_CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "10"))
+BENCH_BASE_PORT = int(os.getenv("BENCH_BASE_PORT", "28728"))
+BENCH_PAID_RATIO = 0.7
+
+
+def summarize(name: str, samples: List[float], wall: Optional[float] = None, **extra) -> Dict[str, Any]:
+    """Latency percentiles (ms) and throughput of a list of per-operation durations (s)."""
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    wall = wall if wall is not None else sum(samples)
+    return {
+        "path": name,
+        "iterations": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "throughput_per_s": round(len(samples) / wall, 2) if wall else None,
+        **extra,
+    }
+
+
+async def timed(fn: Callable[[], Awaitable[Any]], iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def timed_concurrent(fns: List[Callable[[], Awaitable[Any]]], concurrency: int):
+    """Runs the callables with at most `concurrency` in flight; returns (samples, wall time)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def run(fn):
+        async with semaphore:
+            started = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(fn) for fn in fns))
+    return samples, time.perf_counter() - started
+
+
+class Fleet:
+    """Simulated routers in a child process (so their CPU does not skew the app's)."""
+
+    def __init__(self, routers: int, queues: int, base_port: int):
+        self.routers = routers
+        self.queues = queues
+        self.base_port = base_port
+        self.process: Optional[subprocess.Popen] = None
+
+    async def __aenter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.simulator", "--routers", str(self.routers),
+             "--queues", str(self.queues), "--base-port", str(self.base_port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        # Esperar a que el último puerto acepte conexiones
+        last_port = self.base_port + self.routers - 1
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", last_port)
+                writer.close()
+                return self
+            except OSError:
+                if self.process.poll() is not None:
+                    break
+                await asyncio.sleep(0.2)
+        raise RuntimeError("El simulador de routers no arrancó")
+
+    async def __aexit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+async def reset_database():
+    from sqlmodel import SQLModel
+    from database import engine, init_db
+    await init_db()
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+
+async def seed(clients: int, routers: int, base_port: int, today: date) -> int:
+    """Bulk-inserts routers, clients matching the simulated queues and this month's payments.
+    Returns the number of queues per simulated router."""
+    from sqlalchemy import insert, select
+    from database import async_session_maker
+    from modules.billing.models import Payment
+    from modules.clients.models import Client
+    from modules.routers.models import Router
+    from benchmarks.simulator import SIMULATOR_PASSWORD, SIMULATOR_USERNAME, simulated_ip
+
+    per_router = -(-clients // routers)
+    month = today.strftime("%Y-%m")
+    now = datetime.utcnow()
+    async with async_session_maker() as session:
+        await session.execute(insert(Router), [
+            {"name": f"sim-{i}", "ip_address": "127.0.0.1", "port": base_port + i,
+             "username": SIMULATOR_USERNAME, "password": SIMULATOR_PASSWORD, "is_active": True}
+            for i in range(routers)
+        ])
+        router_ids = (await session.execute(select(Router.id).order_by(Router.port))).scalars().all()
+
+        rows = []
+        for n in range(clients):
+            r, j = n % routers, n // routers
+            rows.append({
+                "name": f"cliente-{r}-{j}", "ip_address": simulated_ip(r, j),
+                "limit_max_upload": "5M", "limit_max_download": "10M",
+                # Días de corte 1..28: con la gracia por defecto parte de los impagos vence hoy
+                "billing_day": 1 + n % 28, "status": "active", "created_at": now,
+                "router_id": router_ids[r],
+            })
+        for i in range(0, len(rows), 5000):
+            await session.execute(insert(Client), rows[i:i + 5000])
+
+        client_ids = (await session.execute(select(Client.id).order_by(Client.id))).scalars().all()
+        paid = client_ids[:int(len(client_ids) * BENCH_PAID_RATIO)]
+        for i in range(0, len(paid), 5000):
+            await session.execute(insert(Payment), [
+                {"client_id": cid, "amount": 20.0, "month_paid": month, "date_paid": now}
+                for cid in paid[i:i + 5000]
+            ])
+        await session.commit()
+    return per_router
+
+
+class BenchWebSocket:
+    """Minimal WebSocket counterpart for the TrafficHub: counts what it is sent."""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.frames = 0
+        self.bytes = 0
+        self.done = asyncio.Event()
+
+    async def send_text(self, data: str):
+        self._received(len(data))
+
+    async def send_bytes(self, data: bytes):
+        self._received(len(data))
+
+    def _received(self, size: int):
+        self.frames += 1
+        self.bytes += size
+        if self.frames >= self.expected:
+            self.done.set()
+
+    async def close(self):
+        pass
+
+
+async def bench_ws_fanout(router_ids: List[int], subscribers: int, ticks: int) -> Dict[str, Any]:
+    """Time from a telemetry tick to the frame reaching every subscriber (one router each, round robin)."""
+    from modules.monitor.hub import traffic_hub
+    from modules.monitor.telemetry import telemetry_poller
+
+    sockets, pumps = [], []
+    for i in range(subscribers):
+        ws = BenchWebSocket(expected=1)
+        subscriber = traffic_hub.subscribe(ws, {router_ids[i % len(router_ids)]})
+        sockets.append(ws)
+        pumps.append(asyncio.create_task(traffic_hub.pump(subscriber)))
+    # El hub se invoca a mano para medir sólo el reparto, no el sondeo
+    telemetry_poller._listeners.remove(traffic_hub.on_tick)
+    try:
+        samples, total_bytes = [], 0
+        for _ in range(ticks):
+            await telemetry_poller.poll_once()
+            for ws in sockets:
+                ws.expected = ws.frames + 1
+                ws.done.clear()
+            before = sum(ws.bytes for ws in sockets)
+            started = time.perf_counter()
+            traffic_hub.on_tick(telemetry_poller.snapshots)
+            await asyncio.gather(*(ws.done.wait() for ws in sockets))
+            samples.append(time.perf_counter() - started)
+            total_bytes += sum(ws.bytes for ws in sockets) - before
+        return summarize("ws_fanout", samples, subscribers=subscribers,
+                         bytes_per_tick=total_bytes // max(1, ticks))
+    finally:
+        telemetry_poller.add_listener(traffic_hub.on_tick)
+        for task in pumps:
+            task.cancel()
+        traffic_hub.subscribers.clear()
+
+
+async def run_scenario(clients: int, routers: int, args) -> List[Dict[str, Any]]:
+    import httpx
+    from sqlalchemy import select, update
+    from database import async_session_maker
+    from main import app
+    from modules.auth.config import current_active_user
+    from modules.auth.models import User
+    from modules.billing.service import run_suspension_pass
+    from modules.clients.models import Client
+    from modules.clients.router_state import router_state
+    from modules.monitor.telemetry import telemetry_poller
+    from modules.routers.connection_manager import manager
+    from modules.routers.models import Router
+    from modules.settings.service import settings_cache
+
+    today = date.today().replace(day=28)
+    await reset_database()
+    settings_cache.invalidate()
+    router_state.invalidate()
+    per_router = await seed(clients, routers, args.base_port, today)
+    scenario = {"clients": clients, "routers": routers}
+    results = []
+
+    def record(result: Dict[str, Any]):
+        result.update(scenario)
+        results.append(result)
+        print(f"  {result['path']:<20} p50={result['p50_ms']:>9}ms p95={result['p95_ms']:>9}ms "
+              f"{result['throughput_per_s']}/s", file=sys.stderr)
+
+    admin = User(id=None, email="bench@example.com", hashed_password="", is_active=True, is_superuser=True, is_verified=True)
+    app.dependency_overrides[current_active_user] = lambda: admin
+    transport = httpx.ASGITransport(app=app)
+
+    async with Fleet(routers, per_router, args.base_port), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        try:
+            # Telemetría (también calienta el pool de conexiones y la caché de snapshots)
+            record(summarize("telemetry_poll", await timed(telemetry_poller.poll_once, args.iterations)))
+
+            async def get_page(params):
+                response = await http.get("/api/clients", params=params)
+                response.raise_for_status()
+
+            record(summarize("clients_page", await timed(lambda: get_page({}), args.iterations * 5), stats="formatted"))
+            record(summarize("clients_page", await timed(lambda: get_page({"stats": "raw"}), args.iterations * 5), stats="raw"))
+            record(summarize("clients_page", await timed(lambda: get_page({"limit": 500, "q": "cliente-1"}), args.iterations * 5),
+                             stats="formatted", filter="q,limit=500"))
+
+            async def get_summary():
+                response = await http.get("/api/dashboard/summary")
+                response.raise_for_status()
+
+            record(summarize("dashboard_summary", await timed(get_summary, args.iterations * 2)))
+
+            # Pasada de suspensiones: se restablece el estado antes de cada una (fuera de la medición)
+            samples, changed = [], 0
+            for _ in range(args.iterations):
+                async with async_session_maker() as session:
+                    await session.execute(update(Client).values(status="active"))
+                    await session.commit()
+                    started = time.perf_counter()
+                    outcome = await run_suspension_pass(session, today)
+                    samples.append(time.perf_counter() - started)
+                    changed = outcome["suspended"] + outcome["reactivated"]
+            record(summarize("suspension_pass", samples, changed=changed))
+
+            async with async_session_maker() as session:
+                router_ids = (await session.execute(select(Router.id))).scalars().all()
+
+            def create(n):
+                async def call():
+                    response = await http.post("/api/clients", json={
+                        "name": f"nuevo-{n}", "ip_address": f"172.{16 + n // 65536}.{n // 256 % 256}.{n % 256}",
+                        "router_id": router_ids[n % len(router_ids)],
+                    })
+                    response.raise_for_status()
+                return call
+
+            samples, wall = await timed_concurrent([create(n) for n in range(args.writes)], args.concurrency)
+            record(summarize("client_create", samples, wall, concurrency=args.concurrency))
+
+            # Pagos de clientes suspendidos en la pasada anterior: cada uno reactiva en el router
+            async with async_session_maker() as session:
+                suspended = (await session.execute(
+                    select(Client.id).where(Client.status == "suspended").limit(args.writes)
+                )).scalars().all()
+            month = today.strftime("%Y-%m")
+
+            def pay(client_id):
+                async def call():
+                    response = await http.post("/api/payments", json={
+                        "client_id": client_id, "amount": 20.0, "month_paid": month,
+                    })
+                    response.raise_for_status()
+                return call
+
+            if suspended:
+                samples, wall = await timed_concurrent([pay(cid) for cid in suspended], args.concurrency)
+                record(summarize("payment_post", samples, wall, concurrency=args.concurrency))
+
+            for subscribers in args.subscribers:
+                record(await bench_ws_fanout(router_ids, subscribers, args.iterations))
+        finally:
+            app.dependency_overrides.pop(current_active_user, None)
+            await manager.disconnect_all()
+            telemetry_poller.snapshots.clear()
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _main(args) -> Dict[str, Any]:
+    results = []
+    for clients in args.clients:
+        for routers in args.routers:
+            print(f"== {clients} clientes, {routers} routers", file=sys.stderr)
+            results.extend(await run_scenario(clients, routers, args))
+    from database import DATABASE_URL
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": DATABASE_URL.split(":", 1)[0],
+            "iterations": args.iterations,
+            "writes": args.writes,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleISP hot path benchmarks")
+    parser.add_argument("--clients", type=_int_list, default=[1000, 10000, 50000])
+    parser.add_argument("--routers", type=_int_list, default=[10, 100])
+    parser.add_argument("--iterations", type=int, default=5, help="base number of repetitions per read path")
+    parser.add_argument("--writes", type=int, default=200, help="client creations and payments per scenario")
+    parser.add_argument("--concurrency", type=int, default=BENCH_CONCURRENCY)
+    parser.add_argument("--subscribers", type=_int_list, default=[10, 100], help="WebSocket subscriber counts")
+    parser.add_argument("--base-port", type=int, default=BENCH_BASE_PORT)
+    parser.add_argument("--output", help="JSON file (default: stdout)")
+    parser.add_argument("--database-url", help="database to benchmark on (default: a temporary SQLite file)")
+    parser.add_argument("--reset-db", action="store_true",
+                        help="confirm that every table of --database-url may be dropped")
+    args = parser.parse_args()
+
+    # La base de datos se recrea en cada escenario: nunca se usa DATABASE_URL del
+    # entorno (podría ser la de producción), sólo un SQLite temporal o una URL
+    # explícita con confirmación
+    if args.database_url and not args.reset_db:
+        parser.error("--database-url borra todas las tablas de esa base: confirma con --reset-db")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench.db"
+    report = asyncio.run(_main(args))
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""
+RouterOS API simulator for load and integration testing.
+
+Runs any number of fake routers in one process, each listening on its own TCP
+port and speaking the binary sentence protocol (tagged commands, replies in
+any order), so RouterConnectionManager and AsyncRouterOsApi talk to them
+unchanged. Emulated menus:
+
+- /system/resource print, /system/identity print|set, /system/reboot
+- /queue/simple print|add|set|remove (with advancing bytes/rate counters)
+- /ip/firewall/address-list print|add|set|remove
+
+Queues get synthetic per-queue rates; `bytes` grows with them since boot, so
+a reboot resets the counters like on a real router while the configuration
+survives. Faults can be injected per fleet: fixed latency plus jitter, extra
+latency per printed row, connection drops with a given probability per
+command, and random reboots (the port refuses connections while rebooting).
+
+Usage:
+
+    python -m benchmarks.simulator --routers 200 --queues 500 --register
+
+starts 200 routers on 127.0.0.1:18728..18927 and, with --register, upserts a
+Router row per fake router (and a Client per queue with --clients) in the
+configured database. Simulated client IPs are 10.<router>.x.y, so a fleet has
+at most SIMULATOR_MAX_ROUTERS routers of SIMULATOR_MAX_QUEUES queues.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from modules.routers.async_api import encode_sentence, read_sentence
+from utils.logging import logger
+
+SIMULATOR_HOST = os.getenv("SIMULATOR_HOST", "127.0.0.1")
+SIMULATOR_BASE_PORT = int(os.getenv("SIMULATOR_BASE_PORT", "18728"))
+SIMULATOR_USERNAME = os.getenv("SIMULATOR_USERNAME", "admin")
+SIMULATOR_PASSWORD = os.getenv("SIMULATOR_PASSWORD", "admin")
+
+QUEUE_PATH = '/queue/simple'
+ADDRESS_LIST_PATH = '/ip/firewall/address-list'
+ADDRESS_LIST_NAME = 'clientes_activos'
+
+# Un octeto para el router y 254 hosts en cada uno de los 256 valores del tercero
+SIMULATOR_MAX_ROUTERS = 256
+SIMULATOR_MAX_QUEUES = 254 * 256
+
+
+def simulated_ip(router_index: int, queue_index: int) -> str:
+    """Deterministic client IP of queue `queue_index` on router `router_index`, unique within the limits."""
+    if not 0 <= router_index < SIMULATOR_MAX_ROUTERS or not 0 <= queue_index < SIMULATOR_MAX_QUEUES:
+        raise ValueError(f"The simulator supports up to {SIMULATOR_MAX_ROUTERS} routers "
+                         f"of {SIMULATOR_MAX_QUEUES} queues")
+    return f"10.{router_index}.{queue_index // 254}.{queue_index % 254 + 1}"
+
+
+def format_uptime(seconds: float) -> str:
+    """RouterOS style uptime: 1w2d3h4m5s."""
+    seconds = int(seconds)
+    parts = []
+    for unit, size in (('w', 604800), ('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            parts.append(f"{seconds // size}{unit}")
+            seconds %= size
+    parts.append(f"{seconds}s")
+    return ''.join(parts)
+
+
+class SimulatorConfig:
+    """Size and fault profile shared by every router of a fleet."""
+
+    def __init__(self, queues: int = 100, address_list: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, row_latency: float = 0.0,
+                 drop_rate: float = 0.0, reboot_interval: float = 0.0, reboot_duration: float = 5.0,
+                 max_rate: int = 20_000_000, username: str = SIMULATOR_USERNAME,
+                 password: str = SIMULATOR_PASSWORD):
+        self.queues = queues
+        self.address_list = address_list
+        self.latency = latency
+        self.jitter = jitter
+        self.row_latency = row_latency
+        self.drop_rate = drop_rate
+        # Tiempo medio entre reinicios por router (0 = nunca)
+        self.reboot_interval = reboot_interval
+        self.reboot_duration = reboot_duration
+        self.max_rate = max_rate
+        self.username = username
+        self.password = password
+
+
+class SimulatedQueue:
+    __slots__ = ('fields', 'rate_up', 'rate_down')
+
+    def __init__(self, fields: Dict[str, str], rate_up: int, rate_down: int):
+        self.fields = fields
+        self.rate_up = rate_up
+        self.rate_down = rate_down
+
+    def render(self, elapsed: float) -> Dict[str, str]:
+        """Fields plus the counters `elapsed` seconds after boot."""
+        if self.fields.get('disabled') == 'true':
+            up = down = 0
+            bytes_up = bytes_down = 0
+        else:
+            # Tasa instantánea con ruido; los bytes crecen con la tasa media
+            up = int(self.rate_up * random.uniform(0.7, 1.3))
+            down = int(self.rate_down * random.uniform(0.7, 1.3))
+            bytes_up = int(self.rate_up * elapsed / 8)
+            bytes_down = int(self.rate_down * elapsed / 8)
+        return {
+            **self.fields,
+            'rate': f"{up}/{down}",
+            'bytes': f"{bytes_up}/{bytes_down}",
+            'packets': f"{bytes_up // 1000}/{bytes_down // 1000}",
+        }
+
+
+class TrapError(Exception):
+    """Reply the current command with !trap."""
+
+
+class SimulatedRouter:
+    """One fake RouterOS device listening on its own port."""
+
+    def __init__(self, index: int, port: int, config: SimulatorConfig, host: str = SIMULATOR_HOST):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.config = config
+        self.identity = f"sim-{index}"
+        self.queues: Dict[str, SimulatedQueue] = {}
+        self.addresses: Dict[str, Dict[str, str]] = {}
+        self._ids = itertools.count(1)
+        self.booted_at = time.time()
+        self.down_until = 0.0
+        self.commands = 0
+        self.reboots = 0
+        self.drops = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._populate()
+
+    def _next_id(self) -> str:
+        return f"*{next(self._ids):X}"
+
+    def _populate(self):
+        rng = random.Random(self.index)
+        for j in range(self.config.queues):
+            ip = simulated_ip(self.index, j)
+            self._add_queue({
+                'name': f"cliente-{self.index}-{j}", 'target': f"{ip}/32", 'max-limit': "5000000/10000000",
+                'comment': f"Cliente: cliente-{self.index}-{j}", 'disabled': 'false',
+            }, rng)
+        for j in range(self.config.address_list):
+            self._add_address({
+                'list': ADDRESS_LIST_NAME, 'address': simulated_ip(self.index, j),
+                'comment': f"cliente-{self.index}-{j}", 'disabled': 'false',
+            })
+
+    def _add_queue(self, fields: Dict[str, str], rng: random.Random = random) -> str:
+        queue_id = self._next_id()
+        # Pocas colas muy activas y muchas casi ociosas
+        rate = int(self.config.max_rate * min(1.0, (rng.paretovariate(1.2) - 1) / 10))
+        self.queues[queue_id] = SimulatedQueue({'.id': queue_id, **fields}, rate // 4, rate)
+        return queue_id
+
+    def _add_address(self, fields: Dict[str, str]) -> str:
+        item_id = self._next_id()
+        self.addresses[item_id] = {'.id': item_id, 'dynamic': 'false', **fields}
+        return item_id
+
+    # --- ciclo de vida ---
+
+    @property
+    def rebooting(self) -> bool:
+        return time.time() < self.down_until
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._drop_all()
+
+    def reboot(self, duration: Optional[float] = None):
+        """Cierra todas las sesiones, reinicia contadores y rechaza conexiones durante `duration`."""
+        self.reboots += 1
+        self._drop_all()
+        now = time.time()
+        self.down_until = now + (self.config.reboot_duration if duration is None else duration)
+        self.booted_at = self.down_until
+
+    def _drop_all(self):
+        for writer in list(self._connections):
+            writer.transport.abort()
+        self._connections.clear()
+
+    # --- protocolo ---
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.rebooting:
+            writer.transport.abort()
+            return
+        self._connections.add(writer)
+        session = {'logged_in': False, 'tasks': set()}
+        try:
+            while True:
+                words = await read_sentence(reader)
+                if not words:
+                    continue
+                task = asyncio.create_task(self._execute(words, writer, session))
+                session['tasks'].add(task)
+                task.add_done_callback(session['tasks'].discard)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            for task in session['tasks']:
+                task.cancel()
+            self._connections.discard(writer)
+            writer.transport.abort()
+
+    async def _execute(self, words: List[str], writer: asyncio.StreamWriter, session: dict):
+        command = words[0]
+        tag = None
+        arguments: Dict[str, str] = {}
+        queries: Dict[str, str] = {}
+        for word in words[1:]:
+            if word.startswith('.tag='):
+                tag = word[5:]
+            elif word.startswith('='):
+                key, _, value = word[1:].partition('=')
+                arguments[key] = value
+            elif word.startswith('?'):
+                key, _, value = word[1:].partition('=')
+                queries[key] = value
+
+        config = self.config
+        delay = config.latency + (random.uniform(0, config.jitter) if config.jitter else 0)
+        self.commands += 1
+
+        try:
+            if command == '/login':
+                replies, done = [], {}
+                if arguments.get('name') != config.username or arguments.get('password') != config.password:
+                    raise TrapError("invalid user name or password (6)")
+                session['logged_in'] = True
+            elif not session['logged_in']:
+                raise TrapError("not logged in")
+            else:
+                replies, done = self._dispatch(command, arguments, queries)
+                delay += config.row_latency * len(replies)
+            if delay:
+                await asyncio.sleep(delay)
+            if config.drop_rate and command != '/login' and random.random() < config.drop_rate:
+                self.drops += 1
+                writer.transport.abort()
+                return
+            sentences = [['!re', *(f"={k}={v}" for k, v in r.items())] for r in replies]
+            sentences.append(['!done', *(f"={k}={v}" for k, v in done.items())])
+        except TrapError as e:
+            if delay:
+                await asyncio.sleep(delay)
+            sentences = [['!trap', f"=message={e}"], ['!done']]
+
+        if tag is not None:
+            for sentence in sentences:
+                sentence.append(f".tag={tag}")
+        if writer.is_closing():
+            return
+        # Una sola escritura por respuesta completa
+        writer.write(b''.join(encode_sentence(s) for s in sentences))
+
+        if command == '/system/reboot':
+            self.reboot()
+
+    def _dispatch(self, command: str, arguments: Dict[str, str],
+                  queries: Dict[str, str]) -> Tuple[List[Dict[str, str]], Dict[str, str]]:
+        path, _, verb = command.rpartition('/')
+        if command == '/system/reboot':
+            return [], {}
+        if command == '/cancel':
+            return [], {}
+        if path == '/system/resource' and verb == 'print':
+            return [self._resource()], {}
+        if path == '/system/identity':
+            if verb == 'print':
+                return [{'name': self.identity}], {}
+            if verb == 'set':
+                self.identity = arguments.get('name', self.identity)
+                return [], {}
+        if path == QUEUE_PATH:
+            return self._menu(verb, arguments, queries, queues=True)
+        if path == ADDRESS_LIST_PATH:
+            return self._menu(verb, arguments, queries, queues=False)
+        raise TrapError("no such command prefix")
+
+    def _resource(self) -> Dict[str, str]:
+        total_memory = 1073741824
+        return {
+            'uptime': format_uptime(time.time() - self.booted_at),
+            'version': '7.12 (stable)',
+            'free-memory': str(total_memory - 80_000_000 - 2_000 * len(self.queues)),
+            'total-memory': str(total_memory),
+            'cpu': 'Simulated', 'cpu-count': '4', 'cpu-frequency': '2000',
+            'cpu-load': str(min(100, 3 + len(self.queues) // 500 + random.randint(0, 10))),
+            'free-hdd-space': '900000000', 'total-hdd-space': '1073741824',
+            'architecture-name': 'x86_64', 'board-name': 'SIM-CHR', 'platform': 'MikroTik',
+        }
+
+    def _menu(self, verb: str, arguments: Dict[str, str], queries: Dict[str, str],
+              queues: bool) -> Tuple[List[Dict[str, str]], Dict[str, str]]:
+        if queues:
+            elapsed = max(0.0, time.time() - self.booted_at)
+            rows = (q.render(elapsed) for q in self.queues.values())
+            table: Dict[str, Any] = self.queues
+        else:
+            rows = iter(self.addresses.values())
+            table = self.addresses
+
+        if verb == 'print':
+            proplist = arguments.get('.proplist')
+            keys = proplist.split(',') if proplist else None
+            result = []
+            for row in rows:
+                if any(row.get(k) != v for k, v in queries.items()):
+                    continue
+                result.append({k: row[k] for k in keys if k in row} if keys else dict(row))
+            return result, {}
+
+        if verb == 'add':
+            fields = {k: v for k, v in arguments.items() if not k.startswith('.')}
+            fields.setdefault('disabled', 'false')
+            fields['disabled'] = _normalize_bool(fields['disabled'])
+            if queues:
+                if any(q.fields.get('name') == fields.get('name') for q in self.queues.values()):
+                    raise TrapError("failure: already have such name")
+                fields.setdefault('comment', '')
+                fields.setdefault('max-limit', '0/0')
+                if '/' not in fields.get('target', '/'):
+                    fields['target'] += '/32'
+                return [], {'ret': self._add_queue(fields)}
+            if any(a['list'] == fields.get('list') and a['address'] == fields.get('address')
+                   for a in self.addresses.values()):
+                raise TrapError("failure: already have such entry")
+            return [], {'ret': self._add_address(fields)}
+
+        if verb in ('set', 'remove'):
+            ids = arguments.get('.id', '').split(',')
+            missing = [i for i in ids if i not in table]
+            if missing:
+                raise TrapError("no such item")
+            for item_id in ids:
+                if verb == 'remove':
+                    del table[item_id]
+                    continue
+                fields = table[item_id].fields if queues else table[item_id]
+                for key, value in arguments.items():
+                    if key.startswith('.'):
+                        continue
+                    if key == 'disabled':
+                        value = _normalize_bool(value)
+                    elif key == 'target' and queues and '/' not in value:
+                        value += '/32'
+                    fields[key] = value
+            return [], {}
+
+        raise TrapError("no such command")
+
+
+def _normalize_bool(value: str) -> str:
+    return 'true' if str(value).lower() in ('yes', 'true') else 'false'
+
+
+class SimulatorFleet:
+    """Many SimulatedRouter on consecutive ports, plus the random reboot scheduler."""
+
+    def __init__(self, count: int, config: SimulatorConfig,
+                 host: str = SIMULATOR_HOST, base_port: int = SIMULATOR_BASE_PORT):
+        if count > SIMULATOR_MAX_ROUTERS or max(config.queues, config.address_list) > SIMULATOR_MAX_QUEUES:
+            raise ValueError(f"The simulator supports up to {SIMULATOR_MAX_ROUTERS} routers "
+                             f"of {SIMULATOR_MAX_QUEUES} queues")
+        self.config = config
+        self.routers = [SimulatedRouter(i, base_port + i, config, host) for i in range(count)]
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await asyncio.gather(*(r.start() for r in self.routers))
+        if self.config.reboot_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._reboot_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.gather(*(r.stop() for r in self.routers))
+
+    async def _reboot_loop(self):
+        # Reinicios como proceso de Poisson: intervalo medio reboot_interval por router
+        while True:
+            await asyncio.sleep(random.expovariate(len(self.routers) / self.config.reboot_interval))
+            router = random.choice(self.routers)
+            if not router.rebooting:
+                logger.info(f"Simulador: reiniciando {router.identity}")
+                router.reboot()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "routers": len(self.routers),
+            "connections": sum(len(r._connections) for r in self.routers),
+            "commands": sum(r.commands for r in self.routers),
+            "drops": sum(r.drops for r in self.routers),
+            "reboots": sum(r.reboots for r in self.routers),
+        }
+
+
+async def register_fleet(fleet: SimulatorFleet, with_clients: bool = False):
+    """Upserts a Router row per fake router (and a Client per queue) in the app database."""
+    from sqlmodel import select
+    from database import async_session_maker, init_db
+    from modules.clients.models import Client
+    from modules.routers.models import Router
+
+    await init_db()
+    async with async_session_maker() as session:
+        existing = {r.name: r for r in (await session.execute(select(Router))).scalars().all()}
+        for sim in fleet.routers:
+            router_db = existing.get(sim.identity) or Router(name=sim.identity, ip_address=sim.host,
+                                                             username='', password='')
+            router_db.ip_address = sim.host
+            router_db.port = sim.port
+            router_db.username = fleet.config.username
+            router_db.password = fleet.config.password
+            router_db.is_active = True
+            session.add(router_db)
+        await session.commit()
+
+        if with_clients:
+            routers = {r.name: r.id for r in (await session.execute(select(Router))).scalars().all()}
+            known = set((await session.execute(select(Client.ip_address))).scalars().all())
+            for sim in fleet.routers:
+                for queue in sim.queues.values():
+                    ip = queue.fields['target'][:-3]
+                    if ip in known:
+                        continue
+                    session.add(Client(name=queue.fields['name'], ip_address=ip,
+                                       router_id=routers[sim.identity], billing_day=1 + sim.index % 28))
+            await session.commit()
+
+
+async def _main(args):
+    config = SimulatorConfig(
+        queues=args.queues, address_list=args.address_list,
+        latency=args.latency, jitter=args.jitter, row_latency=args.row_latency,
+        drop_rate=args.drop_rate, reboot_interval=args.reboot_interval, reboot_duration=args.reboot_duration,
+        username=args.username, password=args.password,
+    )
+    fleet = SimulatorFleet(args.routers, config, args.host, args.base_port)
+    await fleet.start()
+    logger.info(f"Simulador: {args.routers} routers en {args.host}:{args.base_port}-{args.base_port + args.routers - 1}")
+    if args.register:
+        await register_fleet(fleet, args.clients)
+        logger.info("Simulador: routers registrados en la base de datos")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info(f"Simulador: {fleet.stats()}")
+    finally:
+        await fleet.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RouterOS API simulator")
+    parser.add_argument("--routers", type=int, default=1)
+    parser.add_argument("--queues", type=int, default=100, help="simple queues per router")
+    parser.add_argument("--address-list", type=int, default=0, help="address-list entries per router")
+    parser.add_argument("--host", default=SIMULATOR_HOST)
+    parser.add_argument("--base-port", type=int, default=SIMULATOR_BASE_PORT)
+    parser.add_argument("--username", default=SIMULATOR_USERNAME)
+    parser.add_argument("--password", default=SIMULATOR_PASSWORD)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every command")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, seconds")
+    parser.add_argument("--row-latency", type=float, default=0.0, help="seconds per printed row")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of dropping the connection per command")
+    parser.add_argument("--reboot-interval", type=float, default=0.0, help="mean seconds between reboots per router")
+    parser.add_argument("--reboot-duration", type=float, default=5.0)
+    parser.add_argument("--register", action="store_true", help="upsert the fake routers in the database")
+    parser.add_argument("--clients", action="store_true", help="with --register, create a client per queue")
+    args = parser.parse_args()
+    if args.routers > SIMULATOR_MAX_ROUTERS:
+        parser.error(f"--routers must be at most {SIMULATOR_MAX_ROUTERS}")
+    if args.queues > SIMULATOR_MAX_QUEUES or args.address_list > SIMULATOR_MAX_QUEUES:
+        parser.error(f"--queues and --address-list must be at most {SIMULATOR_MAX_QUEUES}")
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import os
 from typing import AsyncGenerator
 from dotenv import load_dotenv
 from sqlmodel import SQLModel
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -15,13 +16,25 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
 
+def upsert_insert(session: AsyncSession, model):
+    """
+    INSERT del dialecto de la sesión con soporte de ON CONFLICT
+    (.on_conflict_do_update / .excluded), para SQLite y PostgreSQL.
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upsert no soportado para la base de datos '{dialect}'")
+
 async def init_db():
     # Import models here so SQLModel creates tables (lazy import to avoid circular dependency)
     from modules.auth.models import User  # noqa: F401
     from modules.clients.models import Client  # noqa: F401
     from modules.routers.models import Router  # noqa: F401
-    from modules.billing.models import Payment  # noqa: F401
-    from modules.settings.models import Settings  # noqa: F401
+    from modules.billing.models import Payment, ClientUsage, UsageCounter  # noqa: F401
+    from modules.settings.models import Settings, SettingsVersion  # noqa: F401
     
     # Create all tables in the database
     async with engine.begin() as conn:
@@ -1,7 +1,7 @@
 import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends, Response, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, EmailStr
@@ -9,7 +9,7 @@ from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Importar Configuración y Base de Datos
-from database import init_db, get_session, async_session_maker
+from database import init_db, get_session, async_session_maker, engine
 # Importar Modelos para que SQLModel los registre antes de crear tablas
 from modules.clients.models import Client
 from modules.routers.models import Router
@@ -19,12 +19,24 @@ from modules.auth.models import User  # Auth model
 
 # Importar Routers y Servicios
 from modules.clients.router import router as clients_router
-from modules.billing.router import router as billing_router
+from modules.billing.router import router as billing_router, usage_router
 from modules.monitor.router import router as monitor_router
 from modules.settings.router import router as settings_router
 from modules.routers.router import router as routers_router
 from modules.auth.router import router as users_custom_router
+from modules.monitor.metrics import router as metrics_router, MetricsMiddleware, instrument_engine
+from modules.monitor.profiling import (
+    router as profiling_router, ProfilingMiddleware, TimedJSONResponse, PROFILING_ENABLED,
+    start_profiling, stop_profiling,
+)
 from modules.billing.service import check_suspensions
+from modules.settings.service import settings_cache
+from modules.monitor.telemetry import telemetry_poller
+from modules.monitor.timeseries import traffic_history
+from modules.billing.usage import usage_accountant
+from modules.routers.reconcile import reconcile_scheduler
+from modules.routers.connection_manager import manager
+from utils.threadpool import install_thread_pool
 
 # Importar Auth
 from modules.auth.config import fastapi_users, auth_backend, current_active_user
@@ -37,13 +49,44 @@ from modules.auth.database import get_user_db
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    install_thread_pool()
+    if PROFILING_ENABLED:
+        start_profiling()
     await init_db()
-    asyncio.create_task(check_suspensions())
+    async with async_session_maker() as session:
+        await settings_cache.load(session)
+    background_tasks = [
+        asyncio.create_task(check_suspensions()),
+        asyncio.create_task(reconcile_scheduler()),
+    ]
+    manager.start()
+    await usage_accountant.start()
+    telemetry_poller.start()
+    traffic_history.start()
     yield
-    # Shutdown (add cleanup code here if needed)
+    # Shutdown
+    # Cancelar antes de cerrar las sesiones: una pasada puede tener el write_lock de un router
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await telemetry_poller.stop()
+    await traffic_history.stop()
+    await usage_accountant.stop()
+    await manager.disconnect_all()
+    if PROFILING_ENABLED:
+        stop_profiling()
 
 # --- APP FASTAPI ---
-app = FastAPI(title="SimpleISP", lifespan=lifespan)
+app = FastAPI(
+    title="SimpleISP",
+    lifespan=lifespan,
+    # Con el profiler activo el render de JSON se cuenta como 'serialize'
+    default_response_class=TimedJSONResponse if PROFILING_ENABLED else JSONResponse,
+)
+app.add_middleware(MetricsMiddleware)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+instrument_engine(engine)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -131,9 +174,12 @@ async def logout(response: Response, user: User = Depends(current_active_user)):
 # --- APP ROUTES ---
 app.include_router(clients_router)
 app.include_router(billing_router)
+app.include_router(usage_router)
 app.include_router(monitor_router)
 app.include_router(settings_router)
 app.include_router(routers_router)
+app.include_router(metrics_router)
+app.include_router(profiling_router)
 
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
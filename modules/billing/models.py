@@ -1,5 +1,6 @@
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
+from sqlalchemy import BigInteger, UniqueConstraint
 from sqlmodel import Field, SQLModel
 
 class Payment(SQLModel, table=True):
@@ -8,3 +9,23 @@ class Payment(SQLModel, table=True):
     amount: float
     month_paid: str
     date_paid: datetime = Field(default_factory=datetime.utcnow)
+
+class ClientUsage(SQLModel, table=True):
+    """Consumo acumulado de un cliente en un ciclo de facturación (desde su día de corte)."""
+    __table_args__ = (UniqueConstraint("client_id", "cycle_start"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    client_id: int = Field(foreign_key="client.id", index=True)
+    cycle_start: date = Field(index=True)
+    # BigInteger: en PostgreSQL un INTEGER se desborda a los 2 GB
+    bytes_up: int = Field(default=0, sa_type=BigInteger)
+    bytes_down: int = Field(default=0, sa_type=BigInteger)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class UsageCounter(SQLModel, table=True):
+    """Última lectura de los contadores de una cola, para contar bien tras un reinicio del servidor."""
+    router_id: int = Field(primary_key=True)
+    target: str = Field(primary_key=True)
+    queue_id: Optional[str] = None
+    bytes_up: int = Field(default=0, sa_type=BigInteger)
+    bytes_down: int = Field(default=0, sa_type=BigInteger)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
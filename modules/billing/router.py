@@ -1,4 +1,6 @@
-import asyncio
+import re
+from datetime import date
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
@@ -8,6 +10,7 @@ from database import get_session
 from modules.auth.config import current_active_user
 from modules.auth.models import User
 from modules.billing.models import Payment
+from modules.billing.usage import get_usage_report, get_client_usage
 from modules.clients.models import Client
 # Importamos la función que SÍ existe
 from modules.clients.service import sync_client_mikrotik
@@ -15,6 +18,7 @@ from modules.clients.service import sync_client_mikrotik
 from modules.settings.service import get_system_settings
 
 router = APIRouter(prefix="/api/payments", tags=["payments"])
+usage_router = APIRouter(prefix="/api/usage", tags=["usage"])
 
 @router.get("/{client_id}")
 async def get_payments(
@@ -81,6 +85,30 @@ async def add_payment(
             settings = await get_system_settings(session)
             
             # Llamamos a la función correcta para reactivar al cliente en Mikrotik
-            await asyncio.to_thread(sync_client_mikrotik, client, False, settings, client.router)
+            await sync_client_mikrotik(client, False, settings, client.router)
         
     return payment
+
+@usage_router.get("")
+async def usage_report(
+    month: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(current_active_user)
+):
+    """Consumo de cada cliente en su ciclo de facturación que empieza en `month` (YYYY-MM, por defecto el actual)"""
+    month = month or date.today().strftime("%Y-%m")
+    if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", month):
+        raise HTTPException(status_code=400, detail="Mes inválido, use el formato YYYY-MM")
+    return await get_usage_report(session, month)
+
+@usage_router.get("/{client_id}")
+async def client_usage(
+    client_id: int,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(current_active_user)
+):
+    """Historial de consumo de un cliente por ciclo de facturación"""
+    client = await session.get(Client, client_id)
+    if not client:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    return {"client_id": client.id, "name": client.name, "cycles": await get_client_usage(session, client)}
@@ -1,67 +1,134 @@
-
 import asyncio
+import os
+import time
+from collections import defaultdict
 from datetime import date
+from typing import Dict, List, Optional, Tuple
 from sqlmodel import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, exists, not_, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from utils.logging import logger
 from database import async_session_maker
 from modules.clients.models import Client
 from modules.billing.models import Payment
-from modules.clients.service import sync_client_mikrotik
+from modules.routers.models import Router
+from modules.routers.fanout import fan_out
+from modules.clients.service import reconcile_router_clients
 from modules.settings.service import get_system_settings
+from utils.metrics import SUSPENSION_CHANGES, SUSPENSION_PASS_SECONDS
+
+# Tamaño de lote para UPDATE ... WHERE id IN (...) (límite de parámetros de SQLite)
+SUSPENSION_CHUNK_SIZE = 500
+# Tiempo máximo para empujar los cambios de un router
+SUSPENSION_SYNC_TIMEOUT = float(os.getenv("SUSPENSION_SYNC_TIMEOUT", "300"))
+
+
+async def compute_suspension_changes(
+    session: AsyncSession, grace_days: int, today: date
+) -> Tuple[List[Client], List[Client]]:
+    """
+    Paso 1: una sola consulta que cruza clientes con los pagos del mes actual
+    y devuelve únicamente los clientes que cambian de estado.
+
+    Regla: si hoy >= dia_corte + dias_de_gracia y no hay pago del mes, se suspende.
+    Returns (to_suspend, to_reactivate).
+    """
+    current_month_str = today.strftime("%Y-%m")
+    paid = exists().where(
+        Payment.client_id == Client.id,
+        Payment.month_paid == current_month_str
+    )
+    overdue = and_(Client.billing_day + grace_days <= today.day, not_(paid))
+
+    result = await session.execute(
+        select(Client, overdue.label("overdue")).where(
+            Client.router_id.is_not(None),
+            or_(
+                and_(Client.status != 'suspended', overdue),
+                and_(Client.status == 'suspended', not_(overdue)),
+            )
+        )
+    )
+    to_suspend, to_reactivate = [], []
+    for client, is_overdue in result.all():
+        (to_suspend if is_overdue else to_reactivate).append(client)
+    return to_suspend, to_reactivate
+
+
+async def apply_status_changes(session: AsyncSession, to_suspend: List[Client], to_reactivate: List[Client]):
+    """Paso 2: aplica todos los cambios de estado en una sola transacción."""
+    for clients, status in ((to_suspend, 'suspended'), (to_reactivate, 'active')):
+        ids = [c.id for c in clients]
+        for i in range(0, len(ids), SUSPENSION_CHUNK_SIZE):
+            await session.execute(
+                update(Client)
+                .where(Client.id.in_(ids[i:i + SUSPENSION_CHUNK_SIZE]))
+                .values(status=status)
+                .execution_options(synchronize_session=False)
+            )
+        for client in clients:
+            client.status = status
+    await session.commit()
+
+
+async def push_router_changes(session: AsyncSession, changes: List[Tuple[Client, bool]], settings: dict):
+    """Paso 3: agrupa los cambios por router y los envía en paralelo entre routers,
+    con una sincronización masiva (un volcado + diff) por router."""
+    by_router: Dict[int, List[Tuple[Client, bool]]] = defaultdict(list)
+    for client, suspend in changes:
+        by_router[client.router_id].append((client, suspend))
+    if not by_router:
+        return
+
+    result = await session.execute(select(Router).where(Router.id.in_(list(by_router))))
+    routers = result.scalars().all()
+
+    results = await fan_out(
+        routers,
+        lambda r: reconcile_router_clients(r, by_router[r.id], settings),
+        timeout=SUSPENSION_SYNC_TIMEOUT,
+        deadline=None,
+    )
+    for router_id, outcome in results.items():
+        if not outcome.ok:
+            logger.error(f"No se pudieron sincronizar {len(by_router[router_id])} clientes en router {outcome.router.name}: {outcome.error}")
+
+
+async def run_suspension_pass(session: AsyncSession, today: Optional[date] = None) -> dict:
+    """Ejecuta una pasada completa de suspensiones/reactivaciones."""
+    today = today or date.today()
+    # Obtener la configuración completa del sistema
+    settings = await get_system_settings(session)
+    grace_days = int(settings.get("grace_days", "3"))
+    current_month_str = today.strftime("%Y-%m")
+
+    to_suspend, to_reactivate = await compute_suspension_changes(session, grace_days, today)
+    if not to_suspend and not to_reactivate:
+        return {"suspended": 0, "reactivated": 0}
+
+    await apply_status_changes(session, to_suspend, to_reactivate)
+
+    for client in to_suspend:
+        logger.info(f"Cliente {client.name} SUSPENDIDO (día {today.day}, corte día {client.billing_day} + {grace_days} días de gracia, sin pago {current_month_str})")
+    for client in to_reactivate:
+        logger.info(f"Cliente {client.name} REACTIVADO (tiene pago {current_month_str} o antes del deadline)")
+
+    changes = [(c, True) for c in to_suspend] + [(c, False) for c in to_reactivate]
+    await push_router_changes(session, changes, settings)
+    return {"suspended": len(to_suspend), "reactivated": len(to_reactivate)}
+
 
 async def check_suspensions():
     """Tarea de fondo: Revisa pagos y suspende/activa."""
     while True:
+        started = time.perf_counter()
         try:
             async with async_session_maker() as session:
-                # Obtener la configuración completa del sistema
-                settings = await get_system_settings(session)
-                grace_days = int(settings.get("grace_days", "3"))
-                
-                # Eager load the 'router' relationship to avoid missing attributes
-                result = await session.execute(select(Client).options(selectinload(Client.router)))
-                clients = result.scalars().all()
-                
-                today = date.today()
-                current_month_str = today.strftime("%Y-%m")
-                
-                for client in clients:
-                    payment_query = select(Payment).where(
-                        Payment.client_id == client.id, 
-                        Payment.month_paid == current_month_str
-                    )
-                    payment_result = await session.execute(payment_query)
-                    payment = payment_result.scalars().first()
-
-                    should_be_suspended = False
-                    # Regla: si hoy >= dia_corte + dias_de_gracia y no hay pago
-                    grace_deadline = client.billing_day + grace_days
-                    if not payment and today.day >= grace_deadline:
-                        should_be_suspended = True
-                        logger.debug(f"Cliente {client.name}: día {today.day} >= deadline {grace_deadline} (corte {client.billing_day} + {grace_days} días de gracia), sin pago de {current_month_str}")
-                    
-                    # Ensure client has a router assigned before attempting sync
-                    if not client.router:
-                         logger.warning(f"Client {client.name} has no router assigned. Skipping sync.")
-                         continue
-
-                    # Cambio de estado: Activo -> Suspendido
-                    if should_be_suspended and client.status != 'suspended':
-                        client.status = 'suspended'
-                        session.add(client)
-                        await session.commit()
-                        await asyncio.to_thread(sync_client_mikrotik, client, True, settings, client.router)
-                        logger.info(f"Cliente {client.name} SUSPENDIDO (día {today.day}, corte día {client.billing_day} + {grace_days} días de gracia, sin pago {current_month_str})")
-
-                    # Cambio de estado: Suspendido -> Activo (Pagó o cambiaron fechas)
-                    elif not should_be_suspended and client.status == 'suspended':
-                        client.status = 'active'
-                        session.add(client)
-                        await session.commit()
-                        await asyncio.to_thread(sync_client_mikrotik, client, False, settings, client.router)
-                        logger.info(f"Cliente {client.name} REACTIVADO (tiene pago {current_month_str} o antes del deadline)")
+                outcome = await run_suspension_pass(session)
+            SUSPENSION_CHANGES.inc("suspended", value=outcome["suspended"])
+            SUSPENSION_CHANGES.inc("reactivated", value=outcome["reactivated"])
         except Exception as e:
             logger.error(f"Error en check_suspensions: {e}")
-        
+        SUSPENSION_PASS_SECONDS.observe(time.perf_counter() - started)
+
         await asyncio.sleep(3600)
@@ -0,0 +1,256 @@
+"""
+Per-client data usage accounting.
+
+The telemetry poller delivers the cumulative `bytes` counters of every simple
+queue. The accountant keeps the latest reading of each queue and every
+USAGE_FLUSH_INTERVAL turns it into a byte increment against the reading stored
+in UsageCounter (handling counter wraps, resets after a reboot and queues
+re-created by sync_client_mikrotik, detected by a new .id). The increment is
+added to the ClientUsage row of the client's billing cycle (which starts on
+Client.billing_day) in the same transaction that stores the new reading, so
+traffic across a server restart is still counted and several uvicorn workers
+polling the same routers do not count it twice.
+
+Reports read the precomputed ClientUsage rows only; the last few seconds not
+yet flushed are not included.
+"""
+import asyncio
+import calendar
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from database import async_session_maker, upsert_insert
+from modules.billing.models import ClientUsage, UsageCounter
+from modules.clients.models import Client
+from modules.monitor.telemetry import RouterSnapshot, TelemetryPoller, telemetry_poller
+from modules.monitor.timeseries import counter_delta
+from utils.logging import logger
+
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "60"))
+
+# (router_id, target)
+QueueKey = Tuple[int, str]
+# (queue .id, bytes_up, bytes_down)
+Reading = Tuple[Optional[str], int, int]
+
+
+def _clamped_day(year: int, month: int, day: int) -> date:
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def cycle_start(day: date, billing_day: int) -> date:
+    """Inicio del ciclo de facturación que contiene `day` (día de corte ajustado a meses cortos)."""
+    start = _clamped_day(day.year, day.month, billing_day)
+    if day >= start:
+        return start
+    year, month = (day.year, day.month - 1) if day.month > 1 else (day.year - 1, 12)
+    return _clamped_day(year, month, billing_day)
+
+
+def cycle_end(start: date, billing_day: int) -> date:
+    """Inicio del ciclo siguiente (fin exclusivo)."""
+    year, month = (start.year, start.month + 1) if start.month < 12 else (start.year + 1, 1)
+    return _clamped_day(year, month, billing_day)
+
+
+def reading_delta(previous: Optional[Reading], current: Reading) -> Tuple[int, int]:
+    """Bytes (up, down) between two readings of the same queue; no baseline counts nothing."""
+    if previous is None:
+        return 0, 0
+    if current[0] != previous[0]:
+        # Cola re-creada: el contador nuevo empezó en 0
+        return current[1], current[2]
+    return counter_delta(previous[1], current[1]), counter_delta(previous[2], current[2])
+
+
+class UsageAccountant:
+    def __init__(self, poller: TelemetryPoller):
+        # Última lectura de cada cola vista por este worker, pendiente de aplicar
+        self.readings: Dict[QueueKey, Tuple[Reading, float]] = {}
+        self._dirty: set = set()
+        self._ingested: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        poller.add_listener(self.on_tick)
+
+    def on_tick(self, snapshots: Dict[int, RouterSnapshot]):
+        """Poller listener: keeps the latest counters of every freshly polled router."""
+        for router_id, snapshot in snapshots.items():
+            if not snapshot.online or snapshot.updated_at <= self._ingested.get(router_id, 0.0):
+                continue
+            self._ingested[router_id] = snapshot.updated_at
+            for target, queue in snapshot.queues.items():
+                self.observe((router_id, target), snapshot.updated_at, queue.get('id'),
+                             queue['bytes_up'], queue['bytes_down'])
+
+    def observe(self, key: QueueKey, taken_at: float, queue_id: Optional[str], bytes_up: int, bytes_down: int):
+        self.readings[key] = ((queue_id, bytes_up, bytes_down), taken_at)
+        self._dirty.add(key)
+
+    async def flush(self):
+        """Aplica las lecturas pendientes al ciclo de cada cliente."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        try:
+            async with async_session_maker() as session:
+                await self._store(session, {key: self.readings[key] for key in dirty})
+        except Exception:
+            # Se reintenta en la próxima pasada (con la lectura más reciente)
+            self._dirty |= dirty
+            raise
+
+    async def _store(self, session: AsyncSession, readings: Dict[QueueKey, Tuple[Reading, float]]):
+        """
+        Adds the increment since the stored reading of each queue and stores
+        the new one, in one transaction. Every uvicorn worker polls the same
+        routers: a reading not newer than the stored one was already counted
+        (by this or another worker) and is skipped, so usage is counted once
+        whatever the number of workers.
+        """
+        router_ids = {router_id for router_id, _ in readings}
+        # Escritura vacía antes de leer: bloquea las filas (PostgreSQL) o la base
+        # (SQLite) hasta el commit, así otro worker que guarde las mismas colas
+        # lee las lecturas que deja esta transacción
+        await session.execute(
+            update(UsageCounter).where(UsageCounter.router_id.in_(router_ids))
+            .values(router_id=UsageCounter.router_id)
+        )
+        result = await session.execute(select(UsageCounter).where(UsageCounter.router_id.in_(router_ids)))
+        stored = {(r.router_id, r.target): r for r in result.scalars().all()}
+        result = await session.execute(
+            select(Client.id, Client.router_id, Client.ip_address, Client.billing_day)
+            .where(Client.router_id.in_(router_ids))
+        )
+        clients = {(r, ip): (cid, billing_day) for cid, r, ip, billing_day in result.all()}
+
+        now = datetime.utcnow()
+        cycles: Dict[Tuple[int, date], List[int]] = defaultdict(lambda: [0, 0])
+        counter_rows = []
+        for key, (reading, taken_at) in readings.items():
+            reading_at = datetime.utcfromtimestamp(taken_at)
+            previous = stored.get(key)
+            if previous is not None and previous.updated_at >= reading_at:
+                continue
+            counter_rows.append({
+                "router_id": key[0], "target": key[1], "queue_id": reading[0],
+                "bytes_up": reading[1], "bytes_down": reading[2], "updated_at": reading_at,
+            })
+            if previous is None:
+                # Primera lectura de esta cola: sólo fija la base
+                continue
+            up, down = reading_delta((previous.queue_id, previous.bytes_up, previous.bytes_down), reading)
+            client = clients.get(key)
+            if client is None or not (up or down):
+                # Cola manual sin cliente asociado
+                continue
+            totals = cycles[(client[0], cycle_start(date.fromtimestamp(taken_at), client[1]))]
+            totals[0] += up
+            totals[1] += down
+
+        usage_rows = [
+            {"client_id": cid, "cycle_start": start, "bytes_up": up, "bytes_down": down, "updated_at": now}
+            for (cid, start), (up, down) in cycles.items()
+        ]
+        if usage_rows:
+            stmt = upsert_insert(session, ClientUsage)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=["client_id", "cycle_start"],
+                set_={
+                    "bytes_up": ClientUsage.bytes_up + stmt.excluded.bytes_up,
+                    "bytes_down": ClientUsage.bytes_down + stmt.excluded.bytes_down,
+                    "updated_at": stmt.excluded.updated_at,
+                },
+            ), usage_rows)
+        if counter_rows:
+            stmt = upsert_insert(session, UsageCounter)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=["router_id", "target"],
+                set_={c: getattr(stmt.excluded, c) for c in ("queue_id", "bytes_up", "bytes_down", "updated_at")},
+                # Dos workers insertando la primera lectura: gana la más reciente
+                where=UsageCounter.updated_at < stmt.excluded.updated_at,
+            ), counter_rows)
+        await session.commit()
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error guardando consumo de clientes: {e}")
+
+
+async def get_usage_report(session: AsyncSession, month: str) -> dict:
+    """
+    Consumo de todos los clientes en el ciclo que empieza en `month` (YYYY-MM),
+    leído de los agregados precalculados (una sola consulta).
+    """
+    year, month_num = (int(part) for part in month.split("-"))
+    first = date(year, month_num, 1)
+    last = date(year, month_num, calendar.monthrange(year, month_num)[1])
+
+    result = await session.execute(
+        select(Client.id, Client.name, Client.ip_address, Client.billing_day,
+               ClientUsage.cycle_start, ClientUsage.bytes_up, ClientUsage.bytes_down)
+        .outerjoin(ClientUsage, and_(
+            ClientUsage.client_id == Client.id,
+            ClientUsage.cycle_start >= first,
+            ClientUsage.cycle_start <= last,
+        ))
+        .order_by(Client.name)
+    )
+    clients = []
+    total_up = total_down = 0
+    for cid, name, ip, billing_day, start, up, down in result.all():
+        start = start or _clamped_day(year, month_num, billing_day)
+        up, down = up or 0, down or 0
+        total_up += up
+        total_down += down
+        clients.append({
+            "client_id": cid, "name": name, "ip_address": ip,
+            "cycle_start": start, "cycle_end": cycle_end(start, billing_day),
+            "bytes_up": up, "bytes_down": down, "bytes_total": up + down,
+        })
+    return {"month": month, "total_up": total_up, "total_down": total_down, "clients": clients}
+
+
+async def get_client_usage(session: AsyncSession, client: Client) -> List[dict]:
+    """Historial de consumo de un cliente por ciclo, del más reciente al más antiguo."""
+    result = await session.execute(
+        select(ClientUsage).where(ClientUsage.client_id == client.id).order_by(ClientUsage.cycle_start.desc())
+    )
+    return [
+        {
+            "cycle_start": row.cycle_start,
+            "cycle_end": cycle_end(row.cycle_start, client.billing_day),
+            "bytes_up": row.bytes_up,
+            "bytes_down": row.bytes_down,
+            "bytes_total": row.bytes_up + row.bytes_down,
+            "updated_at": row.updated_at,
+        }
+        for row in result.scalars().all()
+    ]
+
+
+# Instancia global
+usage_accountant = UsageAccountant(telemetry_poller)
@@ -0,0 +1,367 @@
+"""
+Bulk client import (CSV / NDJSON) and streaming export.
+
+Import runs in three phases so a bad file never leaves half a batch behind:
+
+1. parse + validate: the request body is read as a stream of lines and every
+   row is checked (fields, IP and name uniqueness inside the file and against
+   the database, router) without writing anything; errors are reported per row
+2. insert: valid rows go in with multi-row INSERTs of CLIENTS_IMPORT_CHUNK
+   rows, all inside a single transaction
+3. sync: one reconcile_router_clients() per router (one dump, one diff, only
+   the missing writes), run concurrently with fan_out()
+
+Export streams the clients ordered by id in the same columns the import
+accepts, so an export can be re-imported on another install: routers are
+matched by the `router` name column, `router_id` is only used when there is
+no name.
+"""
+import csv
+import io
+import ipaddress
+import json
+import os
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from modules.clients.models import Client
+from modules.clients.service import reconcile_router_clients
+from modules.routers.fanout import fan_out
+from modules.routers.models import Router
+
+CLIENTS_IMPORT_CHUNK = int(os.getenv("CLIENTS_IMPORT_CHUNK", "500"))
+CLIENTS_IMPORT_MAX_ROWS = int(os.getenv("CLIENTS_IMPORT_MAX_ROWS", "50000"))
+# Errores devueltos como máximo (el total siempre se informa)
+CLIENTS_IMPORT_MAX_ERRORS = int(os.getenv("CLIENTS_IMPORT_MAX_ERRORS", "1000"))
+# Un router nuevo puede necesitar cientos de colas: más margen que un probe
+CLIENTS_IMPORT_SYNC_TIMEOUT = float(os.getenv("CLIENTS_IMPORT_SYNC_TIMEOUT", "300"))
+CLIENTS_EXPORT_CHUNK = int(os.getenv("CLIENTS_EXPORT_CHUNK", "1000"))
+
+FORMAT_CSV = "csv"
+FORMAT_NDJSON = "ndjson"
+FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+
+# Columnas de exportación (y aceptadas por la importación, salvo created_at)
+EXPORT_FIELDS = ("name", "ip_address", "limit_max_upload", "limit_max_download",
+                 "billing_day", "status", "router_id", "router", "created_at")
+
+CLIENT_STATUSES = ("active", "suspended")
+_LIMIT_RE = re.compile(r"^\d+(\.\d+)?[kMG]?$")
+_DEFAULTS = {"limit_max_upload": "5M", "limit_max_download": "10M", "billing_day": 1, "status": "active"}
+
+
+class BulkImportError(Exception):
+    """The body cannot be read as a whole (bad encoding, missing header, too many rows)."""
+
+
+class ImportReport:
+    """Outcome of a bulk import; rows are numbered from 1 (the CSV header is not a row)."""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.routers: Dict[int, Dict[str, Any]] = {}
+
+    def error(self, row: int, message: str, field: Optional[str] = None):
+        self.error_count += 1
+        if len(self.errors) < CLIENTS_IMPORT_MAX_ERRORS:
+            entry = {"row": row, "error": message}
+            if field:
+                entry["field"] = field
+            self.errors.append(entry)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "error_count": self.error_count,
+            "errors": sorted(self.errors, key=lambda e: e["row"]),
+            "routers": self.routers,
+        }
+
+
+def detect_format(content_type: str, requested: Optional[str] = None) -> str:
+    if requested:
+        return requested
+    if "json" in (content_type or ""):
+        return FORMAT_NDJSON
+    return FORMAT_CSV
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Splits a byte stream into text lines without holding the whole body."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield _decode(line)
+    if pending:
+        yield _decode(pending)
+
+
+def _decode(line: bytes) -> str:
+    try:
+        return line.decode("utf-8-sig").rstrip("\r")
+    except UnicodeDecodeError:
+        raise BulkImportError("El archivo debe estar codificado en UTF-8")
+
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    (row number, dict) per CSV record. A quoted field may span lines: lines
+    are joined until the quotes are balanced, as RFC 4180 escapes a quote by
+    doubling it.
+    """
+    header = None
+    record = ""
+    row = 0
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader(io.StringIO(text)))
+        if header is None:
+            header = [h.strip().lower() for h in values]
+            if "name" not in header or "ip_address" not in header:
+                raise BulkImportError("La cabecera CSV debe incluir al menos name e ip_address")
+            continue
+        row += 1
+        if len(values) > len(header):
+            yield row, "Más columnas que en la cabecera"
+            continue
+        yield row, {k: v.strip() for k, v in zip(header, values) if v.strip() != ""}
+    if record:
+        row += 1
+        yield row, "Comillas sin cerrar"
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    """(row number, dict) per non-empty NDJSON line."""
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            value = json.loads(line)
+        except ValueError:
+            yield row, "JSON inválido"
+            continue
+        if not isinstance(value, dict):
+            yield row, "Cada línea debe ser un objeto JSON"
+            continue
+        yield row, {k: v for k, v in value.items() if v is not None and v != ""}
+
+
+class RowValidator:
+    """Per-row checks; duplicates against the database are checked later, in bulk."""
+
+    def __init__(self, routers: List[Router]):
+        self.routers_by_id = {r.id: r for r in routers}
+        self.routers_by_name = {r.name: r for r in routers}
+        # Igual que POST /api/clients: sin router explícito se usa el primero
+        self.default_router = routers[0] if routers else None
+        self.ips: Dict[str, int] = {}
+        self.names: Dict[str, int] = {}
+
+    def validate(self, row: int, data: Dict[str, Any], report: ImportReport) -> Optional[Dict[str, Any]]:
+        errors_before = report.error_count
+        values = {**_DEFAULTS}
+
+        name = str(data.get("name", "")).strip()
+        if not name:
+            report.error(row, "El nombre es obligatorio", "name")
+        elif name in self.names:
+            report.error(row, f"Nombre repetido (fila {self.names[name]})", "name")
+        else:
+            self.names[name] = row
+        values["name"] = name
+
+        ip = str(data.get("ip_address", "")).strip()
+        try:
+            ip = str(ipaddress.IPv4Address(ip))
+        except ValueError:
+            report.error(row, "Dirección IP inválida", "ip_address")
+        else:
+            if ip in self.ips:
+                report.error(row, f"IP repetida (fila {self.ips[ip]})", "ip_address")
+            else:
+                self.ips[ip] = row
+        values["ip_address"] = ip
+
+        for field in ("limit_max_upload", "limit_max_download"):
+            if field in data:
+                value = str(data[field]).strip()
+                if not _LIMIT_RE.match(value):
+                    report.error(row, "Límite inválido (ej: 512k, 5M, 1G)", field)
+                values[field] = value
+
+        if "billing_day" in data:
+            try:
+                values["billing_day"] = int(data["billing_day"])
+                if not 1 <= values["billing_day"] <= 31:
+                    raise ValueError
+            except (TypeError, ValueError):
+                report.error(row, "El día de cobro debe estar entre 1 y 31", "billing_day")
+
+        if "status" in data:
+            values["status"] = str(data["status"]).strip()
+            if values["status"] not in CLIENT_STATUSES:
+                report.error(row, f"Estado inválido, use: {', '.join(CLIENT_STATUSES)}", "status")
+
+        # El nombre manda sobre router_id: los ids no se conservan entre instalaciones
+        # y una exportación lleva ambas columnas
+        router = self.default_router
+        if "router" in data:
+            router = self.routers_by_name.get(str(data["router"]).strip())
+            if router is None:
+                report.error(row, "Router inexistente", "router")
+        elif "router_id" in data:
+            try:
+                router = self.routers_by_id.get(int(data["router_id"]))
+            except (TypeError, ValueError):
+                router = None
+            if router is None:
+                report.error(row, "Router inexistente", "router_id")
+        values["router_id"] = router.id if router else None
+
+        return values if report.error_count == errors_before else None
+
+
+async def _find_existing(session: AsyncSession, column, values: List[str]) -> set:
+    found = set()
+    for i in range(0, len(values), CLIENTS_IMPORT_CHUNK):
+        chunk = values[i:i + CLIENTS_IMPORT_CHUNK]
+        result = await session.execute(select(column).where(column.in_(chunk)))
+        found.update(result.scalars().all())
+    return found
+
+
+async def import_clients(
+    session: AsyncSession,
+    chunks: AsyncIterator[bytes],
+    fmt: str,
+    settings: dict,
+    skip_invalid: bool = False,
+    dry_run: bool = False,
+) -> ImportReport:
+    """
+    Validates every row, then inserts the valid ones in one transaction and
+    syncs each affected router once. Unless `skip_invalid` is set, any error
+    aborts the whole import before anything is written.
+    """
+    report = ImportReport()
+    routers = (await session.execute(select(Router).order_by(Router.id))).scalars().all()
+    validator = RowValidator(routers)
+
+    rows: List[Tuple[int, Dict[str, Any]]] = []
+    parse = iter_csv_rows if fmt == FORMAT_CSV else iter_ndjson_rows
+    async for row, data in parse(iter_lines(chunks)):
+        report.rows = row
+        if row > CLIENTS_IMPORT_MAX_ROWS:
+            raise BulkImportError(f"Máximo {CLIENTS_IMPORT_MAX_ROWS} filas por importación")
+        if isinstance(data, str):
+            report.error(row, data)
+            continue
+        values = validator.validate(row, data, report)
+        if values is not None:
+            rows.append((row, values))
+
+    # Duplicados contra la base de datos, en consultas IN por bloques
+    existing_ips = await _find_existing(session, Client.ip_address, [v["ip_address"] for _, v in rows])
+    existing_names = await _find_existing(session, Client.name, [v["name"] for _, v in rows])
+    valid = []
+    for row, values in rows:
+        if values["ip_address"] in existing_ips:
+            report.error(row, "La dirección IP ya está registrada", "ip_address")
+        elif values["name"] in existing_names:
+            report.error(row, "El nombre ya está registrado", "name")
+        else:
+            valid.append(values)
+
+    if dry_run or not valid or (report.error_count and not skip_invalid):
+        return report
+
+    clients = [Client(**values) for values in valid]
+    records = [client.model_dump(exclude={"id"}) for client in clients]
+    for i in range(0, len(records), CLIENTS_IMPORT_CHUNK):
+        await session.execute(insert(Client), records[i:i + CLIENTS_IMPORT_CHUNK])
+    await session.commit()
+    report.imported = len(clients)
+
+    # Una reconciliación por router con todos sus clientes nuevos
+    by_router: Dict[int, List[Tuple[Client, bool]]] = {}
+    for client in clients:
+        if client.router_id is not None:
+            by_router.setdefault(client.router_id, []).append((client, client.status == "suspended"))
+    results = await fan_out(
+        [validator.routers_by_id[router_id] for router_id in by_router],
+        lambda router_db: reconcile_router_clients(router_db, by_router[router_db.id], settings),
+        timeout=CLIENTS_IMPORT_SYNC_TIMEOUT,
+        deadline=None,
+    )
+    for router_id, result in results.items():
+        report.routers[router_id] = {
+            "clients": len(by_router[router_id]),
+            "status": result.status,
+            "operations": result.value if result.ok else 0,
+            "error": result.error,
+        }
+    return report
+
+
+# --- EXPORTACIÓN ---
+
+def _export_record(client: Client, router_names: Dict[int, str]) -> Dict[str, Any]:
+    return {
+        "name": client.name,
+        "ip_address": client.ip_address,
+        "limit_max_upload": client.limit_max_upload,
+        "limit_max_download": client.limit_max_download,
+        "billing_day": client.billing_day,
+        "status": client.status,
+        "router_id": client.router_id,
+        "router": router_names.get(client.router_id),
+        "created_at": client.created_at.isoformat() if client.created_at else None,
+    }
+
+
+async def export_clients(session: AsyncSession, fmt: str) -> AsyncIterator[str]:
+    """Yields the export in pieces, reading the clients by id in keyset chunks."""
+    routers = (await session.execute(select(Router.id, Router.name))).all()
+    router_names = dict(routers)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+    if fmt == FORMAT_CSV:
+        writer.writeheader()
+
+    last_id = 0
+    while True:
+        result = await session.execute(
+            select(Client).where(Client.id > last_id).order_by(Client.id).limit(CLIENTS_EXPORT_CHUNK)
+        )
+        clients = result.scalars().all()
+        if not clients:
+            break
+        last_id = clients[-1].id
+        for client in clients:
+            record = _export_record(client, router_names)
+            if fmt == FORMAT_CSV:
+                writer.writerow(record)
+            else:
+                buffer.write(json.dumps(record, ensure_ascii=False) + "\n")
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -7,7 +7,7 @@ if TYPE_CHECKING:
 
 class Client(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
+    name: str = Field(index=True)
     ip_address: str = Field(unique=True, index=True)
     limit_max_upload: str = "5M"
     limit_max_download: str = "10M"
@@ -1,20 +1,24 @@
-import asyncio
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Union
 from collections import defaultdict
 
-from database import get_session
+from database import get_session, async_session_maker
 from modules.auth.config import current_active_user
 from modules.auth.models import User
 from utils.logging import logger
 from modules.clients.models import Client
-from modules.clients.schemas import ClientWithStats
+from modules.clients.schemas import ClientWithStats, ClientWithRawStats
 from modules.routers.models import Router
-from modules.clients.service import sync_client_mikrotik, remove_client_mikrotik, get_router_queue_stats
+from modules.routers.fanout import fan_out, ROUTER_STATS_TIMEOUT
+from modules.clients.service import sync_client_mikrotik, remove_client_mikrotik, fetch_router_queues, format_queue
+from modules.clients.service import CLIENT_SORT_FIELDS, encode_cursor, keyset_after, keyset_order, prefix_filter
+from modules.clients.bulk import FORMATS, FORMAT_CSV, BulkImportError, detect_format, export_clients, import_clients
+from modules.monitor.telemetry import telemetry_poller
 from modules.settings.service import get_system_settings
 
 router = APIRouter(prefix="/api/clients", tags=["clients"])
@@ -25,45 +29,118 @@ async def get_client_router(session: AsyncSession, client: Client):
     res = await session.execute(select(Router))
     return res.scalars().first()
 
-@router.get("", response_model=List[ClientWithStats])
-async def get_clients(
-    session: AsyncSession = Depends(get_session),
-    user: User = Depends(current_active_user)
-):
-    # Fetch all clients with their routers eager-loaded
-    result = await session.execute(
-        select(Client).options(selectinload(Client.router))
-    )
-    clients = result.scalars().all()
-    
-    # Group clients by router_id
-    clients_by_router: Dict[int, List[Client]] = defaultdict(list)
+# Tamaño de página por defecto y máximo de GET /api/clients
+CLIENTS_PAGE_SIZE = 100
+CLIENTS_PAGE_MAX = 500
+
+# Formatos de estadísticas de GET /api/clients
+STATS_FORMATTED = "formatted"
+STATS_RAW = "raw"
+
+async def get_page_stats(clients: List[Client]) -> Tuple[Dict[int, Dict[str, Any]], set]:
+    """
+    Parsed queue counters for the clients of one page only: router_id -> {ip: counters}
+    plus the set of routers whose stats are stale or missing.
+    """
+    ips_by_router: Dict[int, List[str]] = defaultdict(list)
     routers_map: Dict[int, Router] = {}
-    
     for client in clients:
         if client.router_id:
-            clients_by_router[client.router_id].append(client)
-            if client.router and client.router_id not in routers_map:
+            ips_by_router[client.router_id].append(client.ip_address)
+            if client.router:
                 routers_map[client.router_id] = client.router
-    
-    # Fetch stats from each router
+
+    # Stats come from the telemetry cache; stale snapshots flag their clients
     router_stats: Dict[int, Dict[str, Any]] = {}
+    stale_routers = set()
+    uncached = []
     for router_id, router_db in routers_map.items():
-        stats = await asyncio.to_thread(get_router_queue_stats, router_db)
-        router_stats[router_id] = stats
-    
+        snapshot = telemetry_poller.get(router_id)
+        if snapshot is None or not snapshot.updated_at:
+            uncached.append(router_db)
+            continue
+        router_stats[router_id] = snapshot.queues
+        if snapshot.stale:
+            stale_routers.add(router_id)
+
+    # Routers the poller has not reached yet are queried directly and concurrently
+    results = await fan_out(
+        uncached,
+        fetch_router_queues,
+        timeout=ROUTER_STATS_TIMEOUT,
+        deadline=ROUTER_STATS_TIMEOUT,
+    )
+    for router_id, result in results.items():
+        if result.ok:
+            router_stats[router_id] = result.value
+        else:
+            stale_routers.add(router_id)
+    return router_stats, stale_routers
+
+@router.get("", response_model=Union[List[ClientWithStats], List[ClientWithRawStats]])
+async def get_clients(
+    response: Response,
+    stats: str = STATS_FORMATTED,
+    status: Optional[str] = None,
+    router_id: Optional[int] = None,
+    q: Optional[str] = None,
+    sort: str = "name",
+    order: str = "asc",
+    limit: int = CLIENTS_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(current_active_user)
+):
+    """
+    One page of clients with their queue stats.
+
+    Filters: `status`, `router_id` and `q` (prefix of name or IP). Sorting:
+    `sort` (name, ip_address, created_at, billing_day, status, id) and `order`
+    (asc/desc). Keyset pagination: pass the `X-Next-Cursor` response header as
+    `cursor` to get the next page; the header is absent on the last page.
+
+    `stats=raw` returns integer counters (bytes_up/down, rate_up/down in bps)
+    instead of the formatted strings of the default `stats=formatted`.
+    """
+    if stats not in (STATS_FORMATTED, STATS_RAW):
+        raise HTTPException(status_code=400, detail="El formato de estadísticas debe ser formatted o raw")
+    if sort not in CLIENT_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Orden inválido, use: {', '.join(CLIENT_SORT_FIELDS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="El sentido debe ser asc o desc")
+    limit = max(1, min(limit, CLIENTS_PAGE_MAX))
+
+    query = select(Client).options(selectinload(Client.router))
+    if status:
+        query = query.where(Client.status == status)
+    if router_id is not None:
+        query = query.where(Client.router_id == router_id)
+    if q:
+        query = query.where(prefix_filter(q))
+    if cursor:
+        try:
+            query = query.where(keyset_after(sort, order, cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    query = query.order_by(*keyset_order(sort, order)).limit(limit + 1)
+
+    clients = (await session.execute(query)).scalars().all()
+    if len(clients) > limit:
+        clients = clients[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(clients[-1], sort)
+
+    router_stats, stale_routers = await get_page_stats(clients)
+
     # Build response with stats
     clients_with_stats = []
     for client in clients:
-        stats = {}
-        router_name = None
-        
-        if client.router_id and client.router_id in router_stats:
-            stats = router_stats[client.router_id].get(client.ip_address, {})
-            if client.router:
-                router_name = client.router.name
-        
-        clients_with_stats.append(ClientWithStats(
+        queue = {}
+        stats_stale = False
+        if client.router_id:
+            queue = router_stats.get(client.router_id, {}).get(client.ip_address, {})
+            stats_stale = client.router_id in stale_routers
+
+        fields = dict(
             id=client.id,
             name=client.name,
             ip_address=client.ip_address,
@@ -73,13 +150,27 @@ async def get_clients(
             status=client.status,
             created_at=client.created_at,
             router_id=client.router_id,
-            router_name=router_name,
-            total_upload=stats.get('total_upload', '0 B'),
-            total_download=stats.get('total_download', '0 B'),
-            current_upload_speed=stats.get('current_upload_speed', '0 bps'),
-            current_download_speed=stats.get('current_download_speed', '0 bps'),
-        ))
-    
+            router_name=client.router.name if client.router else None,
+            stats_stale=stats_stale,
+        )
+        if stats == STATS_RAW:
+            clients_with_stats.append(ClientWithRawStats(
+                **fields,
+                bytes_up=queue.get('bytes_up', 0),
+                bytes_down=queue.get('bytes_down', 0),
+                rate_up=queue.get('rate_up', 0),
+                rate_down=queue.get('rate_down', 0),
+            ))
+        else:
+            formatted = format_queue(queue) if queue else {}
+            clients_with_stats.append(ClientWithStats(
+                **fields,
+                total_upload=formatted.get('total_upload', '0 B'),
+                total_download=formatted.get('total_download', '0 B'),
+                current_upload_speed=formatted.get('current_upload_speed', '0 bps'),
+                current_download_speed=formatted.get('current_download_speed', '0 bps'),
+            ))
+
     return clients_with_stats
 
 @router.post("")
@@ -109,7 +200,7 @@ async def create_client(
                  session.add(client)
                  await session.commit()
             
-            await asyncio.to_thread(sync_client_mikrotik, client, False, settings, router_db)
+            await sync_client_mikrotik(client, False, settings, router_db)
         
         return client
     except IntegrityError as e:
@@ -121,6 +212,66 @@ async def create_client(
         logger.error(f"Error creando cliente: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/import")
+async def import_clients_bulk(
+    request: Request,
+    format: Optional[str] = None,
+    skip_invalid: bool = False,
+    dry_run: bool = False,
+    session: AsyncSession = Depends(get_session),
+    user: User = Depends(current_active_user)
+):
+    """
+    Bulk import from a CSV (with header) or NDJSON body, read as a stream.
+
+    Columns: name, ip_address (required), limit_max_upload, limit_max_download,
+    billing_day, status, router (name) or router_id; the name wins when both
+    are present. The format comes from
+    `format` (csv/ndjson) or the Content-Type. Every row is validated before
+    anything is written; with errors nothing is imported unless
+    `skip_invalid=true`. `dry_run=true` only validates. Valid rows are
+    inserted in one transaction and each router is synced once.
+    """
+    if format is not None and format not in FORMATS:
+        raise HTTPException(status_code=400, detail="El formato debe ser csv o ndjson")
+    fmt = detect_format(request.headers.get("content-type", ""), format)
+
+    try:
+        settings = await get_system_settings(session)
+        report = await import_clients(session, request.stream(), fmt, settings, skip_invalid, dry_run)
+    except BulkImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        # Otro alta concurrente ocupó una IP entre la validación y el INSERT
+        await session.rollback()
+        raise HTTPException(status_code=409, detail="Error de integridad: IP o nombre registrado durante la importación, reintente.")
+
+    logger.info(f"Importación masiva: {report.imported}/{report.rows} clientes, {report.error_count} errores")
+    if report.error_count and not report.imported and not dry_run:
+        # Nada importado por errores de validación: el informe va en el cuerpo
+        return JSONResponse(status_code=422, content=report.to_dict())
+    return report.to_dict()
+
+@router.get("/export")
+async def export_clients_bulk(
+    format: str = FORMAT_CSV,
+    user: User = Depends(current_active_user)
+):
+    """Streams every client as CSV or NDJSON (same columns the import accepts)."""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="El formato debe ser csv o ndjson")
+
+    async def body():
+        # Sesión propia: la respuesta se sigue enviando después de salir del endpoint
+        async with async_session_maker() as session:
+            async for piece in export_clients(session, format):
+                yield piece
+
+    media_type = "text/csv; charset=utf-8" if format == FORMAT_CSV else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="clientes.{format}"',
+    })
+
 @router.delete("/{client_id}")
 async def delete_client(
     client_id: int,
@@ -134,7 +285,7 @@ async def delete_client(
         router_db = await get_client_router(session, client)
         
         if router_db:
-            await asyncio.to_thread(remove_client_mikrotik, client.name, client.ip_address, settings, router_db)
+            await remove_client_mikrotik(client.name, client.ip_address, settings, router_db)
             
         await session.delete(client)
         await session.commit()
@@ -170,7 +321,7 @@ async def update_client(
         router_db = await get_client_router(session, client)
         
         if router_db:
-            await asyncio.to_thread(sync_client_mikrotik, client, client.status == 'suspended', settings, router_db)
+            await sync_client_mikrotik(client, client.status == 'suspended', settings, router_db)
         
         return client
     except Exception as e:
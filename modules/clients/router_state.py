@@ -0,0 +1,162 @@
+"""
+In-memory index of the simple queues and address-list entries of each router.
+
+Built from one bulk dump (dump_router_state) and kept current by applying our
+own writes to it, so syncing or removing a single client needs no filtered
+`print` on the router: the plan is computed against the index and costs at
+most one write per resource.
+
+The index is dropped (and rebuilt on next use) when:
+- it is older than ROUTER_STATE_TTL, bounding how long manual edits on the
+  router go unnoticed;
+- the router's address or port changed;
+- a write fails (e.g. a trap for an .id deleted behind our back).
+Bulk reconciliations refresh it for free since they dump the router anyway.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from modules.routers.models import Router
+
+ROUTER_STATE_TTL = float(os.getenv("ROUTER_STATE_TTL", "600"))
+
+QUEUE_PATH = '/queue/simple'
+ADDRESS_LIST_PATH = '/ip/firewall/address-list'
+
+
+def _strip_mask(target: str) -> str:
+    return target[:-3] if target.endswith('/32') else target
+
+
+def _router_key(router_db: Router) -> Tuple[str, int]:
+    return router_db.ip_address, router_db.port
+
+
+class RouterState:
+    """Queues by .id/name/target and address-list entries by .id/(list, address)."""
+
+    def __init__(self, queues: List[Dict[str, Any]], address_list: List[Dict[str, Any]]):
+        self.queues: Dict[str, Dict[str, Any]] = {}
+        self.queues_by_name: Dict[str, str] = {}
+        self.queues_by_target: Dict[str, str] = {}
+        self.addresses: Dict[str, Dict[str, Any]] = {}
+        self.addresses_by_key: Dict[Tuple[str, str], str] = {}
+        self.loaded_at = time.monotonic()
+        self.valid = True
+        for q in queues:
+            self._add_queue(dict(q))
+        for item in address_list:
+            self._add_address(dict(item))
+
+    def __len__(self):
+        return len(self.queues)
+
+    # --- consultas ---
+
+    def find_queue(self, name: str, ip_address: str) -> Optional[Dict[str, Any]]:
+        """Cola del cliente por nombre o, si no, por target."""
+        queue_id = self.queues_by_name.get(name) or self.queues_by_target.get(ip_address)
+        return self.queues.get(queue_id) if queue_id else None
+
+    def find_address(self, list_name: str, ip_address: str) -> Optional[Dict[str, Any]]:
+        item_id = self.addresses_by_key.get((list_name, ip_address))
+        return self.addresses.get(item_id) if item_id else None
+
+    # --- mantenimiento con nuestras propias escrituras ---
+
+    def apply(self, path: str, action: str, params: Dict[str, Any], result: Any = None):
+        """Refleja en el índice una operación ya aplicada en el router (`result` es el .id de un add)."""
+        fields = {key.replace('_', '-'): value for key, value in params.items()}
+        if action == 'add':
+            if not result:
+                # Sin .id no podemos indexar la entrada nueva
+                self.valid = False
+                return
+            fields['id'] = result
+            fields.setdefault('disabled', 'false')
+            if path == QUEUE_PATH:
+                self._add_queue(fields)
+            else:
+                self._add_address(fields)
+        elif action == 'set':
+            if path == QUEUE_PATH:
+                entry = self._remove_queue(fields['id'])
+                if entry is not None:
+                    self._add_queue({**entry, **fields})
+            else:
+                entry = self._remove_address(fields['id'])
+                if entry is not None:
+                    self._add_address({**entry, **fields})
+        elif action == 'remove':
+            if path == QUEUE_PATH:
+                self._remove_queue(fields['id'])
+            else:
+                self._remove_address(fields['id'])
+
+    def _add_queue(self, q: Dict[str, Any]):
+        self.queues[q['id']] = q
+        # Igual que un volcado: el último nombre gana, el primer target se conserva
+        self.queues_by_name[q.get('name')] = q['id']
+        self.queues_by_target.setdefault(_strip_mask(q.get('target', '')), q['id'])
+
+    def _remove_queue(self, queue_id: str) -> Optional[Dict[str, Any]]:
+        q = self.queues.pop(queue_id, None)
+        if q is None:
+            return None
+        name, target = q.get('name'), _strip_mask(q.get('target', ''))
+        if self.queues_by_name.get(name) == queue_id:
+            del self.queues_by_name[name]
+        if self.queues_by_target.get(target) == queue_id:
+            del self.queues_by_target[target]
+            # Otra cola manual con el mismo target pasa a ser la indexada
+            for other in self.queues.values():
+                if _strip_mask(other.get('target', '')) == target:
+                    self.queues_by_target[target] = other['id']
+                    break
+        return q
+
+    def _add_address(self, item: Dict[str, Any]):
+        self.addresses[item['id']] = item
+        self.addresses_by_key[(item.get('list'), item.get('address'))] = item['id']
+
+    def _remove_address(self, item_id: str) -> Optional[Dict[str, Any]]:
+        item = self.addresses.pop(item_id, None)
+        if item is not None:
+            key = (item.get('list'), item.get('address'))
+            if self.addresses_by_key.get(key) == item_id:
+                del self.addresses_by_key[key]
+        return item
+
+
+class RouterStateCache:
+    """RouterState per router_id, with expiry and explicit invalidation."""
+
+    def __init__(self, ttl: float = ROUTER_STATE_TTL):
+        self.ttl = ttl
+        self._states: Dict[int, Tuple[Tuple[str, int], RouterState]] = {}
+
+    def get(self, router_db: Router) -> Optional[RouterState]:
+        cached = self._states.get(router_db.id)
+        if cached is None:
+            return None
+        key, state = cached
+        if not state.valid or key != _router_key(router_db) or time.monotonic() - state.loaded_at > self.ttl:
+            del self._states[router_db.id]
+            return None
+        return state
+
+    def store(self, router_db: Router, queues: List[Dict[str, Any]], address_list: List[Dict[str, Any]]) -> RouterState:
+        state = RouterState(queues, address_list)
+        self._states[router_db.id] = (_router_key(router_db), state)
+        return state
+
+    def invalidate(self, router_id: Optional[int] = None):
+        if router_id is None:
+            self._states.clear()
+        else:
+            self._states.pop(router_id, None)
+
+
+# Instancia global
+router_state = RouterStateCache()
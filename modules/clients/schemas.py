@@ -2,8 +2,8 @@ from typing import Optional
 from pydantic import BaseModel
 from datetime import datetime
 
-class ClientWithStats(BaseModel):
-    """Client model with queue statistics from MikroTik."""
+class ClientBase(BaseModel):
+    """Client fields shared by the listing variants."""
     id: int
     name: str
     ip_address: str
@@ -15,10 +15,22 @@ class ClientWithStats(BaseModel):
     router_id: Optional[int] = None
     # Additional stats
     router_name: Optional[str] = None
+    # True when the router could not be queried and stats are missing/outdated
+    stats_stale: bool = False
+
+    class Config:
+        from_attributes = True
+
+class ClientWithStats(ClientBase):
+    """Client model with human readable queue statistics from MikroTik."""
     total_upload: str = "0 B"
     total_download: str = "0 B"
     current_upload_speed: str = "0 bps"
     current_download_speed: str = "0 bps"
 
-    class Config:
-        from_attributes = True
+class ClientWithRawStats(ClientBase):
+    """Client model with raw queue counters (bytes and bits per second); formatting is left to the client."""
+    bytes_up: int = 0
+    bytes_down: int = 0
+    rate_up: int = 0
+    rate_down: int = 0
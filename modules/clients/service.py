@@ -1,8 +1,18 @@
-from typing import Dict, Any
+import base64
+import json
+from datetime import datetime
+from typing import Dict, Any, List, Iterable, Optional, Tuple
+from sqlalchemy import and_, or_
 from utils.logging import logger
 from modules.clients.models import Client
 from modules.routers.models import Router
 from modules.routers.connection_manager import manager
+from modules.routers.async_api import RouterOsApiError, RouterOsConnectionError
+from modules.clients.router_state import RouterState, router_state
+
+def is_connection_error(error: Exception) -> bool:
+    """True si el error se debe a una sesión caída (vale la pena reintentar con otra del pool)."""
+    return isinstance(error, (RouterOsConnectionError, ConnectionError))
 
 def format_bytes(bytes_str: str) -> str:
     """Converts bytes string to human readable format."""
@@ -30,116 +40,331 @@ def format_rate(rate_str: str) -> str:
         rate_val /= 1000
     return f"{rate_val:.1f} Tbps"
 
-def get_router_queue_stats(router_db: Router) -> Dict[str, Dict[str, Any]]:
+def _split_pair(value: str) -> tuple:
+    """Splits a RouterOS 'upload/download' pair into two ints."""
+    up, _, down = (value or '0/0').partition('/')
+    try:
+        return int(up), int(down or up)
+    except ValueError:
+        return 0, 0
+
+def parse_queue(q: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Fetches queue statistics from MikroTik router.
-    Returns a dict mapping target IP -> stats dict.
+    Parses a raw /queue/simple entry into numeric counters.
+    Each 'upload/download' field is split only once.
     """
-    stats = {}
-    try:
-        with manager.get_locked_connection(router_db) as api:
-            queue_res = api.get_resource('/queue/simple')
-            queues = queue_res.get()
-            
-            for q in queues:
-                target = q.get('target', '')
-                # Remove /32 suffix if present
-                if target.endswith('/32'):
-                    target = target[:-3]
-                
-                stats[target] = {
-                    'total_upload': format_bytes(q.get('bytes', '0/0').split('/')[0]),
-                    'total_download': format_bytes(q.get('bytes', '0/0').split('/')[-1]),
-                    'current_upload_speed': format_rate(q.get('rate', '0/0').split('/')[0]),
-                    'current_download_speed': format_rate(q.get('rate', '0/0').split('/')[-1]),
-                }
-    except Exception as e:
-        logger.warning(f"Error fetching queue stats from router {router_db.name}: {e}")
+    target = q.get('target', '')
+    # Remove /32 suffix if present
+    if target.endswith('/32'):
+        target = target[:-3]
     
-    return stats
+    bytes_up, bytes_down = _split_pair(q.get('bytes'))
+    rate_up, rate_down = _split_pair(q.get('rate'))
+    return {
+        'id': q.get('id'),
+        'name': q.get('name', ''),
+        'target': target,
+        'bytes_up': bytes_up,
+        'bytes_down': bytes_down,
+        'rate_up': rate_up,
+        'rate_down': rate_down,
+    }
+
+def format_queue(q: Dict[str, Any]) -> Dict[str, str]:
+    """Converts the counters of one parsed queue into human readable stats."""
+    return {
+        'total_upload': format_bytes(q['bytes_up']),
+        'total_download': format_bytes(q['bytes_down']),
+        'current_upload_speed': format_rate(q['rate_up']),
+        'current_download_speed': format_rate(q['rate_down']),
+    }
+
+def format_queue_stats(queues: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Converts parsed queues (target IP -> counters) into human readable stats."""
+    return {target: format_queue(q) for target, q in queues.items()}
 
-def sync_client_mikrotik(client: Client, suspend: bool, settings: dict, router_db: Router):
+def index_queues(queues: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Parses a raw /queue/simple dump into a dict mapping target IP -> counters."""
+    parsed = {}
+    for q in queues:
+        entry = parse_queue(q)
+        parsed[entry['target']] = entry
+    return parsed
+
+async def fetch_router_queues(router_db: Router) -> Dict[str, Dict[str, Any]]:
     """
-    Sincroniza el estado del cliente en Mikrotik (Cola y Address List)
-    según la configuración elegida.
-    Incluye lógica de reintento en caso de desconexión.
+    Dumps /queue/simple once and returns a dict mapping target IP -> parsed counters.
+    Connection errors are propagated.
     """
-    # Configuraciones generales
-    method = settings.get("suspension_method", "queue")
-    susp_speed = settings.get("suspension_speed", "1k/1k")
-    list_name = settings.get("address_list_name", "clientes_activos")
+    api = await manager.get_connection(router_db)
+    queues = await api.get_resource('/queue/simple').get()
+    return index_queues(queues)
 
-    # Definir parámetros según estado
+async def get_router_queue_stats(router_db: Router) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetches queue statistics from MikroTik router.
+    Returns a dict mapping target IP -> stats dict.
+    Connection errors are propagated so callers can flag the stats as stale.
+    """
+    return format_queue_stats(await fetch_router_queues(router_db))
+
+def client_queue_params(client: Client, suspend: bool, settings: dict) -> Tuple[str, str]:
+    """Devuelve (max_limit, comment) de la cola del cliente según su estado."""
+    method = settings.get("suspension_method", "queue")
     if suspend and method in ["queue", "both"]:
-        max_limit = susp_speed
-        comment = f"SUSPENDIDO - {client.name}"
-    else:
-        max_limit = f"{client.limit_max_upload}/{client.limit_max_download}"
-        comment = f"Cliente: {client.name}"
+        return settings.get("suspension_speed", "1k/1k"), f"SUSPENDIDO - {client.name}"
+    return f"{client.limit_max_upload}/{client.limit_max_download}", f"Cliente: {client.name}"
+
+async def load_router_state(api, router_db: Router, refresh: bool = False) -> RouterState:
+    """Índice de colas/address-list del router; se construye con un volcado si no hay uno vigente."""
+    state = None if refresh else router_state.get(router_db)
+    if state is None:
+        queues, address_list = await dump_router_state(api)
+        state = router_state.store(router_db, queues, address_list)
+    return state
 
+async def sync_client_mikrotik(client: Client, suspend: bool, settings: dict, router_db: Router):
+    """
+    Sincroniza el estado del cliente en Mikrotik (Cola y Address List)
+    según la configuración elegida.
+    Las entradas existentes se buscan en el índice en memoria del router, así
+    que solo se envían las escrituras necesarias. Si una escritura falla el
+    índice se descarta y se reintenta una vez con un volcado nuevo.
+    """
     for attempt in range(2):
         try:
-            # Usar conexión con bloqueo thread-safe
-            with manager.get_locked_connection(router_db) as api:
-                # --- 1. GESTIONAR COLA (SIMPLE QUEUE) ---
-                queue_res = api.get_resource('/queue/simple')
-                existing_queue = queue_res.get(name=client.name)
-                if not existing_queue:
-                    existing_queue = queue_res.get(target=f"{client.ip_address}/32")
-
-                if existing_queue:
-                    queue_res.set(id=existing_queue[0]['id'], max_limit=max_limit, target=client.ip_address, comment=comment)
-                else:
-                    queue_res.add(name=client.name, target=client.ip_address, max_limit=max_limit, comment=comment)
-
-                # --- 2. GESTIONAR ADDRESS LIST ---
-                if method in ["address_list", "both"]:
-                    addr_list_res = api.get_resource('/ip/firewall/address-list')
-                    existing_item = addr_list_res.get(address=client.ip_address, list=list_name)
-                    should_disable = 'yes' if suspend else 'no'
-                    
-                    if existing_item:
-                        if existing_item[0]['disabled'] != should_disable:
-                            addr_list_res.set(id=existing_item[0]['id'], disabled=should_disable, comment=client.name)
-                    else:
-                        addr_list_res.add(list=list_name, address=client.ip_address, comment=client.name, disabled=should_disable)
+            # Usar conexión con bloqueo por router
+            async with manager.get_locked_connection(router_db) as api:
+                state = await load_router_state(api, router_db, refresh=attempt > 0)
+                plan = plan_router_sync(state, [(client, suspend)], settings)
+                await apply_router_plan(api, plan, state)
             
             # Si llegamos aquí, todo funcionó bien
             break
 
         except Exception as e:
-            logger.warning(f"Error sincronizando Mikrotik para {client.name} (intento {attempt+1}/2): {e}")
-            # Forzamos desconexión para renovar socket en el próximo intento
-            manager.disconnect(router_db.id)
-            if attempt == 1:
+            router_state.invalidate(router_db.id)
+            # Un !trap suele ser un .id que ya no existe: se reintenta con el índice recargado
+            if attempt == 1 or not (is_connection_error(e) or isinstance(e, RouterOsApiError)):
                 logger.error(f"Fallo definitivo sincronizando {client.name}: {e}")
+                break
+            logger.warning(f"Error sincronizando Mikrotik para {client.name} (intento {attempt+1}/2): {e}")
 
-def remove_client_mikrotik(name: str, ip_address: str, settings: dict, router_db: Router):
-    """Elimina cola y entrada de address list del cliente con reintento."""
-    list_name = settings.get("address_list_name", "clientes_activos")
-
+async def remove_client_mikrotik(name: str, ip_address: str, settings: dict, router_db: Router):
+    """Elimina cola y entrada de address list del cliente (reintenta con el índice recargado si falla)."""
     for attempt in range(2):
         try:
-            # Usar conexión con bloqueo thread-safe
-            with manager.get_locked_connection(router_db) as api:
-                # 1. Borrar Cola
-                q_res = api.get_resource('/queue/simple')
-                q = q_res.get(name=name) or q_res.get(target=f"{ip_address}/32")
-                if q:
-                    q_res.remove(id=q[0]['id'])
-                    logger.info(f"Cola eliminada: {name}")
-
-                # 2. Borrar de Address List
-                al_res = api.get_resource('/ip/firewall/address-list')
-                al = al_res.get(address=ip_address, list=list_name)
-                if al:
-                    al_res.remove(id=al[0]['id'])
-                    logger.info(f"Address List eliminada: {name}")
-            
+            # Usar conexión con bloqueo por router
+            async with manager.get_locked_connection(router_db) as api:
+                state = await load_router_state(api, router_db, refresh=attempt > 0)
+                plan = plan_router_sync(state, [], settings, removals=[(name, ip_address)])
+                await apply_router_plan(api, plan, state)
+            if plan:
+                logger.info(f"Recursos eliminados de {name}: {len(plan)}")
             break
 
         except Exception as e:
-            logger.warning(f"Error eliminando recursos de {name} (intento {attempt+1}/2): {e}")
-            manager.disconnect(router_db.id)
-            if attempt == 1:
+            router_state.invalidate(router_db.id)
+            if attempt == 1 or not (is_connection_error(e) or isinstance(e, RouterOsApiError)):
                 logger.error(f"Fallo definitivo eliminando {name}: {e}")
+                break
+            logger.warning(f"Error eliminando recursos de {name} (intento {attempt+1}/2): {e}")
+
+
+# --- SINCRONIZACIÓN MASIVA (una lectura por router, luego diff) ---
+
+_RATE_UNITS = {'k': 1000, 'M': 1000000, 'G': 1000000000}
+
+def _parse_rate(value: str) -> int:
+    """'5M' -> 5000000, '512k' -> 512000, '1000' -> 1000."""
+    value = (value or '0').strip()
+    multiplier = _RATE_UNITS.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        return 0
+
+def normalize_limit(max_limit: str) -> Tuple[int, int]:
+    """Normaliza un max-limit 'up/down' a enteros para compararlo con lo que devuelve RouterOS."""
+    up, _, down = (max_limit or '0/0').partition('/')
+    return _parse_rate(up), _parse_rate(down or up)
+
+def is_disabled(value) -> bool:
+    return str(value).lower() in ('yes', 'true')
+
+class RouterSyncPlan:
+    """Operaciones mínimas (add/set/remove) para dejar un router en el estado deseado."""
+
+    def __init__(self):
+        # Lista de (path, acción, parámetros) en orden de ejecución
+        self.operations: List[Tuple[str, str, Dict[str, str]]] = []
+
+    def add(self, path: str, action: str, **params):
+        self.operations.append((path, action, params))
+
+    def __len__(self):
+        return len(self.operations)
+
+def plan_router_sync(
+    state: RouterState,
+    changes: Iterable[Tuple[Client, bool]],
+    settings: dict,
+    removals: Iterable[Tuple[str, str]] = (),
+) -> RouterSyncPlan:
+    """
+    Calcula, sin tocar el router, las operaciones necesarias a partir del
+    índice de /queue/simple y /ip/firewall/address-list del router.
+
+    Args:
+        state: Índice del router (volcado reciente o caché de router_state).
+        changes: Pares (cliente, suspender) con el estado deseado.
+        settings: Configuración del sistema.
+        removals: Pares (nombre, ip) de clientes a eliminar del router.
+    """
+    method = settings.get("suspension_method", "queue")
+    list_name = settings.get("address_list_name", "clientes_activos")
+    use_address_list = method in ["address_list", "both"]
+
+    plan = RouterSyncPlan()
+    for client, suspend in changes:
+        max_limit, comment = client_queue_params(client, suspend, settings)
+
+        # --- 1. COLA ---
+        existing = state.find_queue(client.name, client.ip_address)
+        if existing:
+            params = {}
+            if normalize_limit(existing.get('max-limit')) != normalize_limit(max_limit):
+                params['max_limit'] = max_limit
+            existing_target = existing.get('target', '')
+            if existing_target not in (client.ip_address, f"{client.ip_address}/32"):
+                params['target'] = client.ip_address
+            if existing.get('comment', '') != comment:
+                params['comment'] = comment
+            if is_disabled(existing.get('disabled')):
+                params['disabled'] = 'no'
+            if params:
+                plan.add('/queue/simple', 'set', id=existing['id'], **params)
+        else:
+            plan.add('/queue/simple', 'add', name=client.name, target=client.ip_address, max_limit=max_limit, comment=comment)
+
+        # --- 2. ADDRESS LIST ---
+        if use_address_list:
+            should_disable = 'yes' if suspend else 'no'
+            item = state.find_address(list_name, client.ip_address)
+            if item:
+                if is_disabled(item.get('disabled')) != suspend:
+                    plan.add('/ip/firewall/address-list', 'set', id=item['id'], disabled=should_disable, comment=client.name)
+            else:
+                plan.add('/ip/firewall/address-list', 'add', list=list_name, address=client.ip_address, comment=client.name, disabled=should_disable)
+
+    for name, ip_address in removals:
+        existing = state.find_queue(name, ip_address)
+        if existing:
+            plan.add('/queue/simple', 'remove', id=existing['id'])
+        item = state.find_address(list_name, ip_address)
+        if item:
+            plan.add('/ip/firewall/address-list', 'remove', id=item['id'])
+
+    return plan
+
+async def apply_router_plan(api, plan: RouterSyncPlan, state: Optional[RouterState] = None):
+    """Ejecuta las operaciones de un plan sobre una conexión abierta y las refleja en el índice."""
+    resources = {}
+    try:
+        for path, action, params in plan.operations:
+            if path not in resources:
+                resources[path] = api.get_resource(path)
+            result = await getattr(resources[path], action)(**params)
+            if state is not None:
+                state.apply(path, action, params, result)
+    except BaseException:
+        # Un error o una cancelación (p. ej. un timeout del fan-out) a mitad del
+        # plan deja escrituras ya enviadas que el índice no refleja
+        if state is not None:
+            state.valid = False
+        raise
+
+async def dump_router_state(api) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Lee /queue/simple y /ip/firewall/address-list una sola vez cada uno."""
+    queues = await api.get_resource('/queue/simple').call(
+        'print', {'proplist': '.id,name,target,max-limit,comment,disabled'})
+    address_list = await api.get_resource('/ip/firewall/address-list').call(
+        'print', {'proplist': '.id,list,address,comment,disabled'})
+    return list(queues), list(address_list)
+
+async def reconcile_router_clients(
+    router_db: Router,
+    changes: List[Tuple[Client, bool]],
+    settings: dict,
+    removals: Iterable[Tuple[str, str]] = (),
+) -> int:
+    """
+    Sincroniza muchos clientes de un mismo router en bloque: vuelca colas y
+    address-list una vez, calcula el diff en memoria y aplica solo los cambios.
+    Reintenta una vez si la sesión se cae. Devuelve el número de operaciones aplicadas.
+    """
+    removals = list(removals)
+    for attempt in range(2):
+        try:
+            async with manager.get_locked_connection(router_db) as api:
+                # El volcado completo también renueva el índice del router
+                state = await load_router_state(api, router_db, refresh=True)
+                plan = plan_router_sync(state, changes, settings, removals)
+                await apply_router_plan(api, plan, state)
+            logger.info(f"Router {router_db.name}: {len(changes)} clientes sincronizados con {len(plan)} operaciones")
+            return len(plan)
+
+        except Exception as e:
+            router_state.invalidate(router_db.id)
+            if attempt == 1 or not is_connection_error(e):
+                raise
+            logger.warning(f"Error en sincronización masiva de {router_db.name} (intento {attempt+1}/2): {e}")
+
+
+# --- PAGINACIÓN DE CLIENTES (keyset) ---
+
+CLIENT_SORT_FIELDS = {
+    "name": Client.name,
+    "ip_address": Client.ip_address,
+    "created_at": Client.created_at,
+    "billing_day": Client.billing_day,
+    "status": Client.status,
+    "id": Client.id,
+}
+
+def keyset_order(sort: str, order: str) -> tuple:
+    """ORDER BY de la columna elegida con el id como desempate (orden total y estable)."""
+    column = CLIENT_SORT_FIELDS[sort]
+    if order == "desc":
+        return column.desc(), Client.id.desc()
+    return column.asc(), Client.id.asc()
+
+def encode_cursor(client: Client, sort: str) -> str:
+    """Cursor opaco con el valor de orden y el id de la última fila de la página."""
+    value = getattr(client, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, client.id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def keyset_after(sort: str, order: str, cursor: str):
+    """Condición WHERE de las filas posteriores al cursor. ValueError si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, last_id = json.loads(raw)
+        if sort == "created_at":
+            value = datetime.fromisoformat(value)
+        last_id = int(last_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {e}") from e
+    column = CLIENT_SORT_FIELDS[sort]
+    if order == "desc":
+        return or_(column < value, and_(column == value, Client.id < last_id))
+    return or_(column > value, and_(column == value, Client.id > last_id))
+
+def prefix_filter(prefix: str):
+    """Clientes cuyo nombre o IP empieza por el prefijo (LIKE con comodines escapados)."""
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return or_(Client.name.like(escaped, escape='\\'), Client.ip_address.like(escaped, escape='\\'))
@@ -1,31 +1,31 @@
 """
 Dashboard service for aggregated statistics.
 """
-import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select, func
 
 from modules.clients.models import Client
 from modules.routers.models import Router
 from modules.routers.connection_manager import manager
+from modules.routers.fanout import fan_out
 from utils.logging import logger
 
 
-def check_router_online(router_obj) -> dict:
+async def check_router_online(router_obj) -> dict:
     """
     Checks if a router is reachable by attempting a quick API call.
     Returns router info with online status.
     """
     try:
-        with manager.get_locked_connection(router_obj) as api:
-            # Quick identity check
-            api.get_resource('/system/identity').get()
-            return {
-                "id": router_obj.id,
-                "name": router_obj.name,
-                "ip_address": router_obj.ip_address,
-                "online": True
-            }
+        api = await manager.get_connection(router_obj)
+        # Quick identity check (does not wait behind long queue dumps)
+        await api.get_resource('/system/identity').get()
+        return {
+            "id": router_obj.id,
+            "name": router_obj.name,
+            "ip_address": router_obj.ip_address,
+            "online": True
+        }
     except Exception as e:
         logger.warning(f"Router {router_obj.name} offline: {e}")
         return {
@@ -40,7 +40,8 @@ def check_router_online(router_obj) -> dict:
 async def get_dashboard_summary(session: AsyncSession) -> dict:
     """
     Returns aggregated dashboard statistics:
-    - Routers: online count, offline count, list of offline routers
+    - Routers: online, offline and unknown (probe timed out) counts and lists,
+      plus each router's circuit-breaker state (open circuits fail fast)
     - Clients: active count, suspended count
     """
     # Get client counts by status
@@ -55,22 +56,44 @@ async def get_dashboard_summary(session: AsyncSession) -> dict:
     routers_result = await session.execute(select(Router).where(Router.is_active == True))
     routers = routers_result.scalars().all()
     
-    # Check each router's connectivity (run in thread pool)
+    # Check every router's connectivity concurrently
+    results = await fan_out(routers, check_router_online)
+
     router_statuses = []
     for router_obj in routers:
-        status = await asyncio.to_thread(check_router_online, router_obj)
+        result = results[router_obj.id]
+        if result.ok:
+            status = result.value
+            status["status"] = "online" if status["online"] else "offline"
+            status["breaker"] = manager.breaker_status(router_obj.id)["state"]
+        else:
+            # Sin respuesta dentro del plazo: no bloquea el resumen
+            status = {
+                "id": router_obj.id,
+                "name": router_obj.name,
+                "ip_address": router_obj.ip_address,
+                "online": None,
+                "status": "unknown",
+                "breaker": manager.breaker_status(router_obj.id)["state"],
+                "error": result.error
+            }
         router_statuses.append(status)
     
     # Aggregate router stats
-    online_routers = [r for r in router_statuses if r["online"]]
-    offline_routers = [r for r in router_statuses if not r["online"]]
+    online_routers = [r for r in router_statuses if r["status"] == "online"]
+    offline_routers = [r for r in router_statuses if r["status"] == "offline"]
+    unknown_routers = [r for r in router_statuses if r["status"] == "unknown"]
+    circuit_open = [r for r in router_statuses if r["breaker"] != "closed"]
     
     return {
         "routers": {
             "total": len(router_statuses),
             "online": len(online_routers),
             "offline": len(offline_routers),
-            "offline_list": offline_routers
+            "unknown": len(unknown_routers),
+            "circuit_open": len(circuit_open),
+            "offline_list": offline_routers,
+            "unknown_list": unknown_routers
         },
         "clients": {
             "total": clients_active + clients_suspended,
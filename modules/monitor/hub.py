@@ -0,0 +1,346 @@
+"""
+Pub/sub hub for the traffic WebSocket.
+
+The telemetry poller queries each router once per tick; the hub turns every
+snapshot into one frame and fans it out to all subscribers of that router.
+Each subscriber has a small bounded buffer: when a browser falls behind, its
+oldest frames are dropped (downsampling), and if a single send stalls for too
+long the subscriber is disconnected. The poll loop never waits on a WebSocket.
+
+Wire protocol
+-------------
+Frames are delta-encoded. A subscriber first receives a full ``snapshot`` of
+a router and then ``delta`` frames containing only the queues whose counters
+changed, plus the ones that disappeared. Every queue entry carries cumulative
+bytes and rates in bits per second (bps, the unit of the router, of
+`stats=raw` in /api/clients and of the traffic history) computed from
+consecutive polls::
+
+    {"type": "snapshot" | "delta", "router_id": 1, "seq": 42,
+     "queues": {"10.0.0.5": {"upload": 123, "download": 456,
+                             "up_rate": 10, "down_rate": 20}},
+     "removed": ["10.0.0.9"], "system": {...}, "online": true,
+     "updated_at": 1700000000.0}
+
+If a subscriber misses a delta (dropped frame) it is resynchronized with a
+new snapshot automatically.
+
+A delta carries every queue whose counters moved since the previous tick, so
+it is only much smaller than a snapshot when most queues are idle; with most
+clients active a delta is close to a snapshot in size, and the packed encoding
+is what keeps the frames small.
+
+With ``?encoding=packed`` snapshots are still JSON but include ``index``, the
+list of target IPs by stable position, and deltas are binary frames::
+
+    header  <BII    version (2), router_id, seq
+            <I      record count
+    record  <IQQQQ  index, upload (bytes), download (bytes), up_rate (bps), down_rate (bps)
+    trailer         UTF-8 JSON {"system": ..., "online": ..., "updated_at": ...}
+
+Deltas that add or remove queues are sent as a JSON snapshot instead, so
+indices never change under a packed subscriber.
+"""
+import asyncio
+import json
+import os
+import struct
+from typing import Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from modules.monitor.telemetry import RouterSnapshot, TelemetryPoller, telemetry_poller
+from utils.metrics import WS_BYTES_SENT, WS_FRAMES_SENT
+from utils.logging import logger
+
+TRAFFIC_SUBSCRIBER_BUFFER = int(os.getenv("TRAFFIC_SUBSCRIBER_BUFFER", "4"))
+TRAFFIC_SEND_TIMEOUT = float(os.getenv("TRAFFIC_SEND_TIMEOUT", "10"))
+
+ENCODING_JSON = "json"
+ENCODING_PACKED = "packed"
+ENCODINGS = (ENCODING_JSON, ENCODING_PACKED)
+
+# 2: tasas en bps (uint64); la versión 1 las enviaba en bytes/s (uint32)
+PACKED_VERSION = 2
+_PACKED_HEADER = struct.Struct("<BIII")
+_PACKED_RECORD = struct.Struct("<IQQQQ")
+
+
+class TrafficFrame:
+    """Changes of one router between two poll ticks; encodings are built lazily and cached."""
+
+    def __init__(self, stream: "RouterStream", seq: int, changed: Dict[str, dict], removed: List[str], structural: bool):
+        self.stream = stream
+        self.router_id = stream.router_id
+        self.seq = seq
+        self.changed = changed
+        self.removed = removed
+        # True when queues were added or removed (packed indices changed)
+        self.structural = structural
+        self.system = stream.system
+        self.online = stream.online
+        self.updated_at = stream.updated_at
+        # Positions only grow between compactions, which replace the dict
+        self.position = stream.position
+        self._encoded: Dict[str, object] = {}
+
+    def encode(self, encoding: str):
+        if encoding not in self._encoded:
+            if encoding == ENCODING_PACKED:
+                self._encoded[encoding] = self._encode_packed()
+            else:
+                self._encoded[encoding] = json.dumps({
+                    "type": "delta",
+                    "router_id": self.router_id,
+                    "seq": self.seq,
+                    "queues": self.changed,
+                    "removed": self.removed,
+                    "system": self.system,
+                    "online": self.online,
+                    "updated_at": self.updated_at,
+                })
+        return self._encoded[encoding]
+
+    def _encode_packed(self) -> bytes:
+        position = self.position
+        parts = [_PACKED_HEADER.pack(PACKED_VERSION, self.router_id, self.seq, len(self.changed))]
+        for ip, q in self.changed.items():
+            parts.append(_PACKED_RECORD.pack(
+                position[ip], q["upload"], q["download"], q["up_rate"], q["down_rate"],
+            ))
+        parts.append(json.dumps({
+            "system": self.system, "online": self.online, "updated_at": self.updated_at
+        }).encode())
+        return b"".join(parts)
+
+
+class RouterStream:
+    """Per-router delta state shared by all subscribers."""
+
+    def __init__(self, router_id: int):
+        self.router_id = router_id
+        self.seq = 0
+        self.queues: Dict[str, dict] = {}
+        self.system: dict = {}
+        self.online = False
+        self.updated_at = 0.0
+        # Stable queue positions used by the packed encoding
+        self.index: List[str] = []
+        self.position: Dict[str, int] = {}
+        self.last_frame: Optional[TrafficFrame] = None
+        self._snapshots: Dict[str, object] = {}
+
+    def ingest(self, snapshot: RouterSnapshot) -> TrafficFrame:
+        """Advances the stream with a new poller snapshot and returns the delta frame."""
+        dt = snapshot.updated_at - self.updated_at if self.updated_at else 0.0
+        changed: Dict[str, dict] = {}
+        current: Dict[str, dict] = {}
+
+        for ip, q in snapshot.queues.items():
+            upload, download = q["bytes_up"], q["bytes_down"]
+            previous = self.queues.get(ip)
+            if previous is not None and previous["upload"] == upload and previous["download"] == download:
+                if dt > 0 and (previous["up_rate"] or previous["down_rate"]):
+                    # Sin tráfico desde el último tick: la tasa cae a cero
+                    entry = {**previous, "up_rate": 0, "down_rate": 0}
+                    changed[ip] = entry
+                else:
+                    entry = previous
+            else:
+                up_rate = down_rate = 0
+                if previous is not None and dt > 0:
+                    # Un contador que retrocede indica reinicio de la cola: no hay tasa válida
+                    up_rate = max(0, int((upload - previous["upload"]) * 8 / dt))
+                    down_rate = max(0, int((download - previous["download"]) * 8 / dt))
+                entry = {"upload": upload, "download": download, "up_rate": up_rate, "down_rate": down_rate}
+                changed[ip] = entry
+            current[ip] = entry
+
+        removed = [ip for ip in self.queues if ip not in current]
+
+        structural = bool(removed)
+        if removed and len(self.index) - len(current) > len(self.index) // 2:
+            # Demasiadas posiciones vacías: se compacta el índice
+            self.index = [ip for ip in self.index if ip in current]
+            self.position = {ip: i for i, ip in enumerate(self.index)}
+        for ip in changed:
+            if ip not in self.position:
+                self.position[ip] = len(self.index)
+                self.index.append(ip)
+                structural = True
+
+        self.queues = current
+        self.system = snapshot.system if snapshot.online else {}
+        self.online = snapshot.online
+        if snapshot.updated_at:
+            self.updated_at = snapshot.updated_at
+        self.seq += 1
+        self._snapshots = {}
+        self.last_frame = TrafficFrame(self, self.seq, changed, removed, structural)
+        return self.last_frame
+
+    def encode_snapshot(self, encoding: str) -> str:
+        """Full state of the router at the current seq (cached per seq)."""
+        if encoding not in self._snapshots:
+            frame = {
+                "type": "snapshot",
+                "router_id": self.router_id,
+                "seq": self.seq,
+                "queues": self.queues,
+                "system": self.system,
+                "online": self.online,
+                "updated_at": self.updated_at,
+            }
+            if encoding == ENCODING_PACKED:
+                frame["encoding"] = ENCODING_PACKED
+                frame["index"] = self.index
+            self._snapshots[encoding] = json.dumps(frame)
+        return self._snapshots[encoding]
+
+
+class Subscriber:
+    """One connected WebSocket and the routers it listens to."""
+
+    def __init__(self, websocket: WebSocket, router_ids: Iterable[int], encoding: str = ENCODING_JSON):
+        self.websocket = websocket
+        self.router_ids: Set[int] = set(router_ids)
+        self.encoding = encoding
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=TRAFFIC_SUBSCRIBER_BUFFER)
+        # router_id -> last seq delivered to this socket
+        self.last_seq: Dict[int, int] = {}
+        self.dropped = 0
+
+    def offer(self, frame: TrafficFrame):
+        """Enqueues a frame without blocking; drops the oldest one when full.
+        The gap left by a dropped delta is repaired with a snapshot on send."""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(frame)
+
+    def payload_for(self, frame: TrafficFrame):
+        """Returns (payload, seq) to send for a queued frame, or None to skip it."""
+        last = self.last_seq.get(frame.router_id)
+        if last is not None and frame.seq <= last:
+            return None
+        stream = frame.stream
+        needs_snapshot = last != frame.seq - 1 or (
+            self.encoding == ENCODING_PACKED and frame.structural
+        )
+        if needs_snapshot:
+            return stream.encode_snapshot(self.encoding), stream.seq
+        return frame.encode(self.encoding), frame.seq
+
+
+class TrafficHub:
+    def __init__(self, poller: TelemetryPoller):
+        self.poller = poller
+        self.subscribers: Set[Subscriber] = set()
+        self.streams: Dict[int, RouterStream] = {}
+        poller.add_listener(self.on_tick)
+
+    def subscribe(self, websocket: WebSocket, router_ids: Iterable[int], encoding: str = ENCODING_JSON) -> Subscriber:
+        subscriber = Subscriber(websocket, router_ids, encoding)
+        self.subscribers.add(subscriber)
+        self.send_current(subscriber, subscriber.router_ids)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def update(self, subscriber: Subscriber, add: Iterable[int] = (), remove: Iterable[int] = ()):
+        """Changes the routers a subscriber listens to."""
+        added = set(add) - subscriber.router_ids
+        removed = set(remove)
+        subscriber.router_ids |= added
+        subscriber.router_ids -= removed
+        for router_id in removed:
+            subscriber.last_seq.pop(router_id, None)
+        self.send_current(subscriber, added)
+
+    def send_current(self, subscriber: Subscriber, router_ids: Iterable[int]):
+        """Queues the current state right away so new subscribers don't wait a tick."""
+        for router_id in router_ids:
+            stream = self._stream_for(router_id)
+            if stream and stream.last_frame:
+                subscriber.offer(stream.last_frame)
+
+    def _stream_for(self, router_id: int) -> Optional[RouterStream]:
+        """Returns the router's stream, catching it up with the poller if needed."""
+        snapshot = self.poller.get(router_id)
+        if snapshot is None:
+            return self.streams.get(router_id)
+        stream = self.streams.get(router_id)
+        if stream is None:
+            stream = self.streams[router_id] = RouterStream(router_id)
+        if stream.last_frame is None or snapshot.updated_at > stream.updated_at:
+            stream.ingest(snapshot)
+        return stream
+
+    def on_tick(self, snapshots: Dict[int, RouterSnapshot]):
+        """Poller listener: computes one delta per router and broadcasts it."""
+        # Streams de routers eliminados
+        for router_id in list(self.streams):
+            if router_id not in snapshots:
+                del self.streams[router_id]
+        if not self.subscribers:
+            return
+
+        wanted = set()
+        for subscriber in self.subscribers:
+            wanted |= subscriber.router_ids
+
+        for router_id in wanted:
+            snapshot = snapshots.get(router_id)
+            if snapshot is None:
+                continue
+            stream = self.streams.get(router_id)
+            if stream is None:
+                stream = self.streams[router_id] = RouterStream(router_id)
+            frame = stream.ingest(snapshot)
+            for subscriber in self.subscribers:
+                if router_id in subscriber.router_ids:
+                    subscriber.offer(frame)
+
+    async def pump(self, subscriber: Subscriber):
+        """Sends queued frames to the socket; closes it if a send stalls."""
+        while True:
+            frame = await subscriber.queue.get()
+            if frame.router_id not in subscriber.router_ids:
+                continue
+            prepared = subscriber.payload_for(frame)
+            if prepared is None:
+                continue
+            payload, seq = prepared
+            try:
+                if isinstance(payload, bytes):
+                    send = subscriber.websocket.send_bytes(payload)
+                else:
+                    send = subscriber.websocket.send_text(payload)
+                await asyncio.wait_for(send, TRAFFIC_SEND_TIMEOUT)
+                subscriber.last_seq[frame.router_id] = seq
+                WS_FRAMES_SENT.inc()
+                WS_BYTES_SENT.inc(value=len(payload))
+            except asyncio.TimeoutError:
+                logger.warning(f"WebSocket lento desconectado ({subscriber.dropped} frames descartados)")
+                self.unsubscribe(subscriber)
+                await subscriber.websocket.close()
+                return
+            except Exception:
+                # Socket cerrado: el handler del endpoint hace la limpieza
+                self.unsubscribe(subscriber)
+                return
+
+
+def parse_router_ids(value: Optional[str]) -> Set[int]:
+    """Parses a comma separated list of router IDs ("1,2,3")."""
+    if not value:
+        return set()
+    return {int(part) for part in value.split(",") if part.strip().isdigit()}
+
+
+# Instancia global
+traffic_hub = TrafficHub(telemetry_poller)
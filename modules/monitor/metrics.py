@@ -0,0 +1,177 @@
+"""
+/metrics endpoint (Prometheus text format) and request/SQL instrumentation.
+
+- MetricsMiddleware times every HTTP request by route template (bounded
+  label set) and counts the SQL statements and SQL time spent inside it.
+- instrument_engine() hooks SQLAlchemy cursor events to time statements.
+- Collectors expose, at scrape time, the router pool state
+  (manager.stats()), WebSocket subscribers, and the queued/running jobs of
+  the default thread pool used by asyncio.to_thread (utils/threadpool.py).
+
+/metrics requires either `Authorization: Bearer <METRICS_TOKEN>` (for
+scrapers) or a logged-in admin session. Set METRICS_PUBLIC=true to serve it
+without authentication, e.g. when only reachable from a private network.
+"""
+import contextvars
+import hmac
+import os
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from modules.auth.config import fastapi_users
+from modules.auth.models import User
+from modules.monitor.hub import traffic_hub
+from modules.routers.connection_manager import BREAKER_CLOSED, manager
+from utils.metrics import (
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUEST_SQL_QUERIES,
+    HTTP_REQUEST_SQL_SECONDS,
+    HTTP_REQUESTS,
+    SQL_QUERY_SECONDS,
+    registry,
+)
+from utils.profiling import TIMING_DB, record
+from utils.threadpool import thread_pool_stats
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Opt-out explícito de la autenticación de /metrics
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"
+
+router = APIRouter(tags=["monitor"])
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+# Estadísticas SQL de la petición HTTP en curso
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    SQL_QUERY_SECONDS.observe(duration)
+    record(TIMING_DB, duration)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += duration
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: duration, status and SQL usage per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            # Plantilla de la ruta (p. ej. /api/clients/{client_id}): etiquetas acotadas
+            route = scope.get("route")
+            path = getattr(route, "path", None) or ("/static" if scope["path"].startswith("/static/") else "unmatched")
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method, path)
+            HTTP_REQUESTS.inc(method, path, f"{status[0] // 100}xx")
+            HTTP_REQUEST_SQL_QUERIES.observe(stats.queries, path)
+            HTTP_REQUEST_SQL_SECONDS.observe(stats.sql_seconds, path)
+
+
+# --- Collectors (se calculan al hacer scrape) ---
+
+def collect_router_pools():
+    stats = manager.stats()
+    yield ("simpleisp_router_sessions", "gauge", "Open API sessions per router",
+           [({"router": str(rid)}, s["sessions"]) for rid, s in stats.items()])
+    yield ("simpleisp_router_in_flight", "gauge", "RouterOS commands awaiting reply per router",
+           [({"router": str(rid)}, s["in_flight"]) for rid, s in stats.items()])
+    yield ("simpleisp_router_reconnects_total", "counter", "Sessions re-established after being lost, per router",
+           [({"router": str(rid)}, s["reconnects"]) for rid, s in stats.items()])
+    yield ("simpleisp_router_breaker_open", "gauge", "1 when the router's circuit breaker is not closed",
+           [({"router": str(rid)}, int(s["breaker"] != BREAKER_CLOSED)) for rid, s in stats.items()])
+
+
+def collect_websockets():
+    subscribers = list(traffic_hub.subscribers)
+    yield ("simpleisp_ws_subscribers", "gauge", "Connected /ws/traffic subscribers",
+           [({}, len(subscribers))])
+    yield ("simpleisp_ws_frames_dropped", "gauge", "Frames dropped by the buffers of connected subscribers",
+           [({}, sum(s.dropped for s in subscribers))])
+
+
+def collect_thread_pool():
+    stats = thread_pool_stats()
+    yield ("simpleisp_threadpool_queue_depth", "gauge", "Jobs waiting in the default thread pool (asyncio.to_thread)",
+           [({}, stats["queued"])])
+    yield ("simpleisp_threadpool_running", "gauge", "Jobs running in the default thread pool",
+           [({}, stats["running"])])
+    yield ("simpleisp_threadpool_max_threads", "gauge", "Size of the default thread pool",
+           [({}, stats["max_workers"])])
+
+
+registry.add_collector(collect_router_pools)
+registry.add_collector(collect_websockets)
+registry.add_collector(collect_thread_pool)
+
+
+optional_active_user = fastapi_users.current_user(active=True, optional=True)
+
+
+async def require_metrics_access(request: Request, user: Optional[User] = Depends(optional_active_user)):
+    """Bearer METRICS_TOKEN or an admin session, unless METRICS_PUBLIC is set."""
+    if METRICS_PUBLIC:
+        return
+    authorization = request.headers.get("authorization", "")
+    if METRICS_TOKEN and hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return
+    if user is None:
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    if not user.is_superuser:
+        raise HTTPException(status_code=403, detail="No tienes permisos de administrador")
+
+
+@router.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_access)])
+async def metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,304 @@
+"""
+Opt-in request profiler (PROFILING_ENABLED=true).
+
+- ProfilingMiddleware breaks every HTTP request down into time spent in SQL,
+  RouterOS API calls, response serialization and waiting for the thread pool
+  (see utils/profiling.py) and returns it in a `Server-Timing` header.
+- A sampler thread takes the event loop's stack every
+  PROFILING_SAMPLE_INTERVAL seconds and attributes it to the request whose
+  task (or a task it created) is running at that moment.
+- The PROFILING_SLOWEST slowest requests are kept with their breakdown and
+  their most frequent stacks, readable by admins at GET /api/profiling/slow.
+
+start_profiling() (called from the app lifespan) installs the sampler's task
+factory, chained to the loop's previous one, and wraps FastAPI's
+serialize_response; stop_profiling() puts both back. JSONResponse.render is
+timed by TimedJSONResponse, the app's default response class while profiling.
+When disabled none of this is installed: the only cost left is the ContextVar
+lookup in utils.profiling.record().
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import fastapi.routing
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from modules.auth.dependencies import get_current_admin_user
+from utils.logging import logger
+from utils.profiling import TIMING_SERIALIZE, TIMINGS, RequestProfile, current_profile, record
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SLOWEST = int(os.getenv("PROFILING_SLOWEST", "20"))
+PROFILING_SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.005"))
+PROFILING_MAX_STACKS = int(os.getenv("PROFILING_MAX_STACKS", "20"))
+PROFILING_STACK_DEPTH = int(os.getenv("PROFILING_STACK_DEPTH", "48"))
+
+# Pilas distintas que se guardan por petición mientras está en curso
+_MAX_STACKS_IN_FLIGHT = 500
+_OTHER_STACK = "other"
+
+router = APIRouter(
+    prefix="/api/profiling",
+    tags=["monitor"],
+    dependencies=[Depends(get_current_admin_user)],
+)
+
+
+def _fold(frame, depth: int) -> str:
+    """Stack as 'outer;...;inner' (the 'folded' format of flame graph tools)."""
+    names = []
+    while frame is not None and len(names) < depth:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    Samples the event loop thread and charges each stack to the profile of
+    the running task. Tasks created while a request is in progress are
+    tracked through a task factory, so work fanned out with gather() or
+    create_task() is charged to the request too, until the request ends.
+    """
+
+    def __init__(self, interval: float = PROFILING_SAMPLE_INTERVAL, depth: int = PROFILING_STACK_DEPTH):
+        self.interval = interval
+        self.depth = depth
+        self.tasks: Dict[asyncio.Task, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._previous_factory = None
+
+    def start(self):
+        """Installs the task factory on the running loop and starts the sampler thread."""
+        if self._thread is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        self._previous_factory = loop.get_task_factory()
+        loop.set_task_factory(self._task_factory)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Restores the previous task factory (unless someone replaced ours since) and stops the thread."""
+        if self._thread is None:
+            return
+        if self._loop.get_task_factory() == self._task_factory:
+            self._loop.set_task_factory(self._previous_factory)
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self._loop = None
+        self._previous_factory = None
+        with self._lock:
+            self.tasks.clear()
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        # La factoría corre en el contexto de quien crea la tarea; las tareas de
+        # fondo (lector de la API, handshakes del pool) se crean con un contexto
+        # propio y no se atribuyen a la petición
+        profile = current_profile.get()
+        if profile is not None and kwargs.get("context") is None:
+            self.attach(task, profile)
+            task.add_done_callback(self.detach)
+        return task
+
+    def attach(self, task: asyncio.Task, profile: RequestProfile):
+        with self._lock:
+            self.tasks[task] = profile
+
+    def detach(self, task: asyncio.Task):
+        with self._lock:
+            self.tasks.pop(task, None)
+
+    def detach_profile(self, profile: RequestProfile):
+        """Stops charging samples to a finished request, including tasks it created that are still running."""
+        with self._lock:
+            for task in [t for t, p in self.tasks.items() if p is profile]:
+                del self.tasks[task]
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if not self.tasks:
+                continue
+            try:
+                frame = sys._current_frames().get(self._thread_id)
+                task = asyncio.current_task(self._loop)
+                if frame is None or task is None:
+                    continue
+                with self._lock:
+                    profile = self.tasks.get(task)
+                    if profile is None:
+                        continue
+                    stack = _fold(frame, self.depth)
+                    samples = profile.samples
+                    if stack not in samples and len(samples) >= _MAX_STACKS_IN_FLIGHT:
+                        stack = _OTHER_STACK
+                    samples[stack] += 1
+            except Exception as e:  # El muestreador nunca debe morir
+                logger.warning(f"Profiling sampler error: {e}")
+            finally:
+                frame = None
+
+
+class SlowRequests:
+    """The N slowest requests seen since startup (or the last clear)."""
+
+    def __init__(self, size: int = PROFILING_SLOWEST, max_stacks: int = PROFILING_MAX_STACKS):
+        self.size = size
+        self.max_stacks = max_stacks
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+
+    def add(self, profile: RequestProfile):
+        if self.size <= 0:
+            return
+        if len(self._heap) >= self.size and profile.duration <= self._heap[0][0]:
+            return
+        item = (profile.duration, next(self._seq), self._summarize(profile))
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, item)
+        else:
+            heapq.heapreplace(self._heap, item)
+
+    def _summarize(self, profile: RequestProfile) -> dict:
+        sampled = sum(profile.samples.values())
+        return {
+            "method": profile.method,
+            "path": profile.path,
+            "status": profile.status,
+            "started": datetime.fromtimestamp(profile.started, timezone.utc).isoformat(),
+            "duration_ms": round(profile.duration * 1000, 2),
+            "timings_ms": {k: round(v * 1000, 2) for k, v in profile.timings.items()},
+            "counts": dict(profile.counts),
+            "samples": sampled,
+            "stacks": [{"stack": stack, "samples": n} for stack, n in profile.samples.most_common(self.max_stacks)],
+        }
+
+    def entries(self) -> List[dict]:
+        return [entry for _, _, entry in sorted(self._heap, reverse=True)]
+
+    def clear(self):
+        self._heap.clear()
+
+
+# Instancia global
+sampler = StackSampler()
+slow_requests = SlowRequests()
+
+_original_serialize_response = None
+
+
+async def _timed_serialize_response(*args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return await _original_serialize_response(*args, **kwargs)
+    finally:
+        record(TIMING_SERIALIZE, time.perf_counter() - started)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse whose render() is charged to 'serialize'."""
+
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        try:
+            return super().render(content)
+        finally:
+            record(TIMING_SERIALIZE, time.perf_counter() - started)
+
+
+def start_profiling():
+    """Starts the sampler and charges FastAPI's response validation/encoding to 'serialize'."""
+    global _original_serialize_response
+    sampler.start()
+    # FastAPI no ofrece un punto de extensión para serialize_response: se
+    # envuelve la función del módulo y stop_profiling() deja la original
+    if _original_serialize_response is None:
+        _original_serialize_response = fastapi.routing.serialize_response
+        fastapi.routing.serialize_response = _timed_serialize_response
+
+
+def stop_profiling():
+    global _original_serialize_response
+    sampler.stop()
+    if _original_serialize_response is not None:
+        if fastapi.routing.serialize_response is _timed_serialize_response:
+            fastapi.routing.serialize_response = _original_serialize_response
+        _original_serialize_response = None
+
+
+def server_timing(profile: RequestProfile, total: float) -> str:
+    parts = [
+        f'{kind};desc="{profile.counts[kind]} calls";dur={profile.timings[kind] * 1000:.2f}'
+        for kind in TIMINGS if profile.counts[kind]
+    ]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: per-request timing breakdown, Server-Timing header and stack samples."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/static/"):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = current_profile.set(profile)
+        task = asyncio.current_task()
+        sampler.attach(task, profile)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                header = server_timing(profile, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.duration = time.perf_counter() - started
+            sampler.detach_profile(profile)
+            current_profile.reset(token)
+            slow_requests.add(profile)
+
+
+@router.get("/slow")
+async def get_slow_requests():
+    return {
+        "enabled": PROFILING_ENABLED,
+        "sample_interval": PROFILING_SAMPLE_INTERVAL,
+        "requests": slow_requests.entries(),
+    }
+
+
+@router.delete("/slow")
+async def clear_slow_requests():
+    slow_requests.clear()
+    return {"detail": "Perfiles borrados"}
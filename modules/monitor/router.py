@@ -1,89 +1,65 @@
 import asyncio
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+import time
+from typing import Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from utils.logging import logger
-from modules.routers.connection_manager import manager
 from modules.routers.models import Router
+from modules.clients.models import Client
 from database import async_session_maker, get_session
 from sqlmodel import select
 from modules.auth.config import current_active_user
 from modules.monitor.dashboard_service import get_dashboard_summary
+from modules.monitor.hub import traffic_hub, parse_router_ids, ENCODINGS, ENCODING_JSON
+from modules.monitor.timeseries import traffic_history, RESOLUTIONS
+from modules.monitor.top import top_talkers, TOP_BY_RATE, TOP_BY_BYTES, TOP_CAPACITY
 
 router = APIRouter(tags=["monitor"])
 
 @router.websocket("/ws/traffic")
-async def websocket_traffic(websocket: WebSocket):
+async def websocket_traffic(websocket: WebSocket, routers: Optional[str] = None, encoding: str = ENCODING_JSON):
+    """
+    Streams delta-encoded traffic frames from the shared telemetry poller
+    (protocol described in modules/monitor/hub.py).
+
+    Routers are selected with `?routers=1,2` (default: first router) and can be
+    changed at runtime by sending {"subscribe": [ids]} or {"unsubscribe": [ids]}.
+    `?encoding=packed` switches deltas to the compact binary layout.
+    """
     await websocket.accept()
+    if encoding not in ENCODINGS:
+        encoding = ENCODING_JSON
     
-    # Fetch default router (or make this dynamic via query param later)
-    async with async_session_maker() as session:
-        res = await session.execute(select(Router))
-        router_db = res.scalars().first()
-
-    if not router_db:
-        logger.error("No router found for monitor.")
-        await websocket.close()
-        return
-
-    # Función para obtener datos en un hilo separado para no bloquear
-    def fetch_mikrotik_data(router_obj):
-        try:
-            # Usar conexión con bloqueo thread-safe
-            with manager.get_locked_connection(router_obj) as api:
-                # 1. Obtener Tráfico de Colas
-                queues = api.get_resource('/queue/simple').get()
-                traffic_map = {}
-                
-                for q in queues:
-                    rx_bytes = 0
-                    tx_bytes = 0
-                    if 'bytes' in q:
-                        parts = q['bytes'].split('/')
-                        if len(parts) == 2:
-                            tx_bytes = int(parts[0]) 
-                            rx_bytes = int(parts[1])
-                    
-                    target_ip = q.get('target', '').split('/')[0]
-                    traffic_map[target_ip] = {
-                        "upload": tx_bytes,
-                        "download": rx_bytes
-                    }
-
-                # 2. Obtener Recursos
-                resource = api.get_resource('/system/resource').get()
-                system_stats = {}
-                if resource:
-                    res = resource[0]
-                    total_mem = int(res.get('total-memory', 1))
-                    free_mem = int(res.get('free-memory', 0))
-                    used_mem_perc = ((total_mem - free_mem) / total_mem) * 100
-                    
-                    system_stats = {
-                        "cpu_load": res.get('cpu-load', '0'),
-                        "uptime": res.get('uptime', ''),
-                        "version": res.get('version', ''),
-                        "board": res.get('board-name', ''),
-                        "ram_usage": round(used_mem_perc, 1)
-                    }
-
-            return {
-                "queues": traffic_map,
-                "system": system_stats
-            }
-
-        except Exception as e:
-            logger.error(f"Error leyendo Mikrotik: {e}")
-            return {"queues": {}, "system": {}}
+    router_ids = parse_router_ids(routers)
+    if not router_ids:
+        # Default router, as before
+        async with async_session_maker() as session:
+            res = await session.execute(select(Router))
+            router_db = res.scalars().first()
 
+        if not router_db:
+            logger.error("No router found for monitor.")
+            await websocket.close()
+            return
+        router_ids = {router_db.id}
+
+    subscriber = traffic_hub.subscribe(websocket, router_ids, encoding)
+    sender = asyncio.create_task(traffic_hub.pump(subscriber))
     try:
         while True:
-            data = await asyncio.to_thread(fetch_mikrotik_data, router_db)
-            await websocket.send_json(data)
-            await asyncio.sleep(2)
+            message = await websocket.receive_json()
+            traffic_hub.update(
+                subscriber,
+                add=[int(i) for i in message.get("subscribe", [])],
+                remove=[int(i) for i in message.get("unsubscribe", [])],
+            )
     except WebSocketDisconnect:
         logger.info("Cliente WebSocket desconectado") 
     except Exception as e:
         logger.error(f"WS Error: {e}")
+    finally:
+        traffic_hub.unsubscribe(subscriber)
+        sender.cancel()
 
 
 @router.get("/api/dashboard/summary", dependencies=[Depends(current_active_user)])
@@ -93,4 +69,74 @@ async def dashboard_summary(session: AsyncSession = Depends(get_session)):
     - Routers: online/offline counts and list of offline routers
     - Clients: active/suspended counts
     """
-    return await get_dashboard_summary(session)
\ No newline at end of file
+    return await get_dashboard_summary(session)
+
+
+@router.get("/api/monitor/usage/clients/{client_id}", dependencies=[Depends(current_active_user)])
+async def client_usage(
+    client_id: int,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    resolution: Optional[str] = None,
+    step: Optional[int] = None,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Traffic history of a client's queue between `start` and `end` (epoch ms,
+    default: last 24 h). `resolution` is raw, 1m or 1h (default: picked from
+    the range); `step` (ms) regroups the points for charts.
+    """
+    client = await session.get(Client, client_id)
+    if not client:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    if client.router_id is None:
+        raise HTTPException(status_code=400, detail="El cliente no tiene router asignado")
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Resolución inválida, use: {', '.join(RESOLUTIONS)}")
+
+    end = end or int(time.time() * 1000)
+    start = start if start is not None else end - 86_400_000
+    if start >= end:
+        raise HTTPException(status_code=400, detail="El inicio debe ser anterior al fin")
+
+    usage = await traffic_history.query(
+        (client.router_id, client.ip_address), start, end, resolution, step if step and step > 0 else None
+    )
+    return {"client_id": client.id, "name": client.name, **usage}
+
+
+async def _top_talkers(session: AsyncSession, router_id: Optional[int], by: str, window: str, limit: int) -> dict:
+    if by not in (TOP_BY_RATE, TOP_BY_BYTES):
+        raise HTTPException(status_code=400, detail=f"Criterio inválido, use: {TOP_BY_RATE}, {TOP_BY_BYTES}")
+    limit = max(1, min(limit, TOP_CAPACITY))
+    if by == TOP_BY_RATE:
+        entries = top_talkers.top_by_rate(limit, router_id)
+    else:
+        if window not in top_talkers.windows:
+            raise HTTPException(status_code=400, detail=f"Ventana inválida, use: {', '.join(top_talkers.windows)}")
+        entries = top_talkers.top_by_bytes(limit, window, router_id)
+
+    # Resolver nombres de cliente sólo para las filas devueltas
+    if entries:
+        result = await session.execute(
+            select(Client.id, Client.name, Client.router_id, Client.ip_address)
+            .where(Client.ip_address.in_({e["target"] for e in entries}))
+        )
+        clients = {(r, ip): (cid, name) for cid, name, r, ip in result.all()}
+        for entry in entries:
+            client_id, name = clients.get((entry["router_id"], entry["target"]), (None, None))
+            entry["client_id"] = client_id
+            entry["client_name"] = name
+    return {"by": by, "window": window if by == TOP_BY_BYTES else None, "router_id": router_id, "top": entries}
+
+
+@router.get("/api/monitor/top", dependencies=[Depends(current_active_user)])
+async def top_fleet(by: str = TOP_BY_RATE, window: str = "1h", limit: int = 10, session: AsyncSession = Depends(get_session)):
+    """Top-N clients of all routers by current rate (`by=rate`) or bytes in a window (`by=bytes&window=1h`)."""
+    return await _top_talkers(session, None, by, window, limit)
+
+
+@router.get("/api/monitor/top/{router_id}", dependencies=[Depends(current_active_user)])
+async def top_router(router_id: int, by: str = TOP_BY_RATE, window: str = "1h", limit: int = 10, session: AsyncSession = Depends(get_session)):
+    """Top-N clients of one router by current rate or bytes in a window."""
+    return await _top_talkers(session, router_id, by, window, limit)
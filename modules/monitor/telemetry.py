@@ -0,0 +1,149 @@
+"""
+Background telemetry poller with an in-memory snapshot cache.
+
+A single task polls /system/resource and /queue/simple on every active router
+at a fixed cadence and keeps the latest snapshot per router. The traffic
+WebSocket, router stats and client list read from this cache, so router API
+load does not grow with the number of open dashboards.
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlmodel import select
+
+from database import async_session_maker
+from modules.clients.service import index_queues
+from modules.routers.connection_manager import manager
+from modules.routers.fanout import fan_out, ROUTER_STATS_TIMEOUT
+from modules.routers.models import Router
+from modules.routers.utils import parse_system_resource
+from utils.logging import logger
+
+TELEMETRY_POLL_INTERVAL = float(os.getenv("TELEMETRY_POLL_INTERVAL", "2"))
+# Un snapshot más viejo que esto se considera desactualizado
+TELEMETRY_STALE_AFTER = float(os.getenv("TELEMETRY_STALE_AFTER", str(TELEMETRY_POLL_INTERVAL * 5)))
+
+
+@dataclass
+class RouterSnapshot:
+    """Latest telemetry known for one router."""
+    router_id: int
+    router_name: str
+    system: Dict[str, Any] = field(default_factory=dict)
+    # target IP -> parsed queue counters (see clients.service.index_queues)
+    queues: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    online: bool = False
+    error: Optional[str] = None
+    updated_at: float = 0.0  # time.time() of the last successful poll
+
+    @property
+    def stale(self) -> bool:
+        return not self.online or time.time() - self.updated_at > TELEMETRY_STALE_AFTER
+
+
+async def poll_router(router_obj: Router) -> dict:
+    """Reads system resources and simple queues, pipelined on the shared session."""
+    api = await manager.get_connection(router_obj)
+    resource, queues = await asyncio.gather(
+        api.get_resource('/system/resource').get(),
+        api.get_resource('/queue/simple').get(),
+    )
+
+    return {
+        "system": parse_system_resource(resource[0]) if resource else {},
+        "queues": index_queues(queues),
+    }
+
+
+class TelemetryPoller:
+    def __init__(self, interval: float = TELEMETRY_POLL_INTERVAL):
+        self.interval = interval
+        self.snapshots: Dict[int, RouterSnapshot] = {}
+        self._listeners: List[Callable[[Dict[int, RouterSnapshot]], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def add_listener(self, callback: Callable[[Dict[int, RouterSnapshot]], None]):
+        """Registers a callback invoked with all snapshots after every poll tick.
+        Callbacks run inside the poll loop and must not block."""
+        self._listeners.append(callback)
+
+    def get(self, router_id: int) -> Optional[RouterSnapshot]:
+        """Returns the cached snapshot for a router, or None if never polled."""
+        return self.snapshots.get(router_id)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def poll_once(self):
+        """Polls every active router concurrently and refreshes the cache."""
+        async with async_session_maker() as session:
+            result = await session.execute(select(Router).where(Router.is_active == True))
+            routers = result.scalars().all()
+
+        results = await fan_out(
+            routers,
+            poll_router,
+            timeout=ROUTER_STATS_TIMEOUT,
+            deadline=ROUTER_STATS_TIMEOUT,
+        )
+
+        for router_obj in routers:
+            outcome = results[router_obj.id]
+            snapshot = self.snapshots.get(router_obj.id)
+            if snapshot is None:
+                snapshot = RouterSnapshot(router_id=router_obj.id, router_name=router_obj.name)
+                self.snapshots[router_obj.id] = snapshot
+            snapshot.router_name = router_obj.name
+
+            if outcome.ok:
+                snapshot.system = outcome.value["system"]
+                snapshot.queues = outcome.value["queues"]
+                snapshot.online = True
+                snapshot.error = None
+                snapshot.updated_at = time.time()
+            else:
+                # Se conservan los últimos datos conocidos, marcados como caídos
+                snapshot.online = False
+                snapshot.error = outcome.error
+
+        # Olvidar routers eliminados o desactivados
+        active_ids = {r.id for r in routers}
+        for router_id in list(self.snapshots):
+            if router_id not in active_ids:
+                del self.snapshots[router_id]
+
+        for callback in self._listeners:
+            try:
+                callback(self.snapshots)
+            except Exception as e:
+                logger.error(f"Error en listener de telemetría: {e}")
+
+    async def _run(self):
+        logger.info(f"Telemetry poller iniciado (intervalo {self.interval}s)")
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en telemetry poller: {e}")
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(0.0, self.interval - elapsed))
+
+
+# Instancia global
+telemetry_poller = TelemetryPoller()
@@ -0,0 +1,404 @@
+"""
+Per-queue traffic history fed by the telemetry poller.
+
+Three resolutions are kept for every (router, queue target):
+
+- raw: every poll sample (cumulative byte counters), in memory only, for
+  TIMESERIES_RAW_RETENTION seconds and at most TIMESERIES_RAW_MAX_SAMPLES
+  samples across all queues (24 bytes each); with many queues each one
+  keeps a shorter window and older queries fall back to 1m. The raw tier
+  is not persisted: after a restart history starts at the 1m tier
+- 1m: usage and peak rate per minute, on disk, TIMESERIES_1M_RETENTION
+- 1h: usage and peak rate per hour, on disk, TIMESERIES_1H_RETENTION
+
+On disk each (resolution, router, target) is one append-only array file of
+fixed-width little-endian records sorted by time:
+
+    ts_ms int64 | bytes_up uint64 | bytes_down uint64 | peak_up uint64 | peak_down uint64
+
+bytes_* is the traffic inside the bucket and peak_* the highest rate (bits/s)
+seen between two samples. Range queries binary-search the file by timestamp
+and read only the records they return. Closed buckets are buffered in memory
+and appended every TIMESERIES_FLUSH_INTERVAL; retention trims file heads.
+Records sharing a timestamp (a partial bucket written at shutdown) are merged
+when read.
+"""
+import asyncio
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from modules.monitor.telemetry import RouterSnapshot, TelemetryPoller, telemetry_poller
+from utils.logging import logger
+from utils.profiling import to_thread
+
+TIMESERIES_DIR = os.getenv("TIMESERIES_DIR", "data/timeseries")
+TIMESERIES_RAW_RETENTION = float(os.getenv("TIMESERIES_RAW_RETENTION", "900"))
+# Presupuesto de muestras raw entre todas las colas (~24 MB con el valor por defecto)
+TIMESERIES_RAW_MAX_SAMPLES = int(os.getenv("TIMESERIES_RAW_MAX_SAMPLES", "1000000"))
+# Mínimo por cola aunque haya muchas (para poder calcular tasas recientes)
+TIMESERIES_RAW_MIN_SAMPLES = int(os.getenv("TIMESERIES_RAW_MIN_SAMPLES", "16"))
+TIMESERIES_1M_RETENTION = float(os.getenv("TIMESERIES_1M_RETENTION", str(2 * 86400)))
+TIMESERIES_1H_RETENTION = float(os.getenv("TIMESERIES_1H_RETENTION", str(400 * 86400)))
+TIMESERIES_FLUSH_INTERVAL = float(os.getenv("TIMESERIES_FLUSH_INTERVAL", "300"))
+
+RESOLUTION_RAW = "raw"
+# Resolución agregada -> ancho del bucket en ms
+ROLLUPS = {"1m": 60_000, "1h": 3_600_000}
+RESOLUTIONS = (RESOLUTION_RAW,) + tuple(ROLLUPS)
+RETENTION = {
+    RESOLUTION_RAW: TIMESERIES_RAW_RETENTION,
+    "1m": TIMESERIES_1M_RETENTION,
+    "1h": TIMESERIES_1H_RETENTION,
+}
+
+RECORD = struct.Struct('<qQQQQ')
+
+SeriesKey = Tuple[int, str]
+
+
+# Anchos de contador de RouterOS (versiones antiguas usan 32 bits)
+COUNTER_WIDTHS = (2 ** 32, 2 ** 64)
+
+
+def counter_delta(previous: int, current: int) -> int:
+    """
+    Bytes between two readings of a cumulative counter.
+    A lower reading is a wrap when the previous one was near the counter's
+    width, otherwise a reset (queue re-added or router rebooted) that
+    restarted the counter at 0.
+    """
+    if current >= previous:
+        return current - previous
+    for width in COUNTER_WIDTHS:
+        if width * 0.9 <= previous < width and current < width * 0.1:
+            return current + width - previous
+    return current
+
+
+def _series_path(directory: str, resolution: str, key: SeriesKey) -> str:
+    router_id, target = key
+    return os.path.join(directory, resolution, str(router_id), target.replace('/', '_') + '.bin')
+
+
+class Bucket:
+    """Open rollup bucket of one series."""
+    __slots__ = ('start', 'up', 'down', 'peak_up', 'peak_down')
+
+    def __init__(self, start: int):
+        self.start = start
+        self.up = self.down = self.peak_up = self.peak_down = 0
+
+    def add(self, up: int, down: int, rate_up: int, rate_down: int):
+        self.up += up
+        self.down += down
+        self.peak_up = max(self.peak_up, rate_up)
+        self.peak_down = max(self.peak_down, rate_down)
+
+    def pack(self) -> bytes:
+        return RECORD.pack(self.start, self.up, self.down, self.peak_up, self.peak_down)
+
+
+class Series:
+    """In-memory state of one queue: raw ring plus open and unflushed rollup buckets."""
+    __slots__ = ('ts', 'up', 'down', 'buckets', 'pending', 'floor_ms')
+
+    def __init__(self):
+        self.ts = array('q')
+        self.up = array('Q')
+        self.down = array('Q')
+        self.buckets: Dict[str, Bucket] = {}
+        self.pending: Dict[str, bytearray] = {resolution: bytearray() for resolution in ROLLUPS}
+        # Primera muestra conservada tras recortar por capacidad (0: sin recortes)
+        self.floor_ms = 0
+
+    def append(self, ts_ms: int, bytes_up: int, bytes_down: int):
+        if self.ts:
+            dt = ts_ms - self.ts[-1]
+            if dt <= 0:
+                return
+            up = counter_delta(self.up[-1], bytes_up)
+            down = counter_delta(self.down[-1], bytes_down)
+            rate_up, rate_down = up * 8000 // dt, down * 8000 // dt
+            for resolution, width in ROLLUPS.items():
+                start = ts_ms - ts_ms % width
+                bucket = self.buckets.get(resolution)
+                if bucket is not None and bucket.start != start:
+                    self.pending[resolution] += bucket.pack()
+                    bucket = None
+                if bucket is None:
+                    bucket = self.buckets[resolution] = Bucket(start)
+                bucket.add(up, down, rate_up, rate_down)
+
+        self.ts.append(ts_ms)
+        self.up.append(bytes_up)
+        self.down.append(bytes_down)
+
+    def trim(self, cutoff_ms: int, capacity: int):
+        """
+        Drops raw samples older than the cutoff or beyond `capacity` (in
+        batches, arrays shift on delete).
+        """
+        index = bisect_left(self.ts, cutoff_ms)
+        # Con holgura de 1/8 sobre la capacidad para no desplazar los arrays en cada muestra
+        excess = len(self.ts) - capacity
+        if excess > capacity // 8 and excess > index:
+            del self.ts[:excess], self.up[:excess], self.down[:excess]
+            self.floor_ms = self.ts[0]
+        elif index > 64 or index == len(self.ts):
+            del self.ts[:index], self.up[:index], self.down[:index]
+
+    def raw_points(self, start_ms: int, end_ms: int) -> List[dict]:
+        lo = max(bisect_left(self.ts, start_ms), 1)
+        hi = bisect_left(self.ts, end_ms)
+        points = []
+        for i in range(lo, hi):
+            dt = self.ts[i] - self.ts[i - 1]
+            up = counter_delta(self.up[i - 1], self.up[i])
+            down = counter_delta(self.down[i - 1], self.down[i])
+            points.append({
+                "t": self.ts[i], "up": up, "down": down,
+                "rate_up": up * 8000 // dt, "rate_down": down * 8000 // dt,
+            })
+        return points
+
+
+def _read_range(path: str, start_ms: int, end_ms: int) -> bytes:
+    """Reads the records of [start_ms, end_ms) from a series file by binary search."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return b''
+    with f:
+        count = os.fstat(f.fileno()).st_size // RECORD.size
+
+        def first_at_or_after(ts_ms: int) -> int:
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                f.seek(mid * RECORD.size)
+                if struct.unpack('<q', f.read(8))[0] < ts_ms:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        lo, hi = first_at_or_after(start_ms), first_at_or_after(end_ms)
+        f.seek(lo * RECORD.size)
+        return f.read((hi - lo) * RECORD.size)
+
+
+def _merge_records(data: bytes) -> List[list]:
+    """Unpacks records merging consecutive ones with the same timestamp."""
+    rows: List[list] = []
+    for ts, up, down, peak_up, peak_down in RECORD.iter_unpack(data):
+        if rows and rows[-1][0] == ts:
+            row = rows[-1]
+            row[1] += up
+            row[2] += down
+            row[3] = max(row[3], peak_up)
+            row[4] = max(row[4], peak_down)
+        else:
+            rows.append([ts, up, down, peak_up, peak_down])
+    return rows
+
+
+def _trim_file(path: str, cutoff_ms: int):
+    """Removes records older than the cutoff from the head of a series file."""
+    data = _read_range(path, cutoff_ms, 2 ** 63 - 1)
+    size = os.path.getsize(path)
+    if len(data) == size:
+        return
+    if not data:
+        os.remove(path)
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class TrafficHistory:
+    def __init__(self, poller: TelemetryPoller, directory: str = TIMESERIES_DIR):
+        self.directory = directory
+        self.series: Dict[SeriesKey, Series] = {}
+        self._ingested: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        poller.add_listener(self.on_tick)
+
+    def on_tick(self, snapshots: Dict[int, RouterSnapshot]):
+        """Poller listener: appends one sample per queue of every freshly polled router."""
+        for router_id, snapshot in snapshots.items():
+            if not snapshot.online or snapshot.updated_at <= self._ingested.get(router_id, 0.0):
+                continue
+            self._ingested[router_id] = snapshot.updated_at
+            ts_ms = int(snapshot.updated_at * 1000)
+            for target, queue in snapshot.queues.items():
+                self.record((router_id, target), ts_ms, queue['bytes_up'], queue['bytes_down'])
+
+    def record(self, key: SeriesKey, ts_ms: int, bytes_up: int, bytes_down: int):
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series()
+        series.append(ts_ms, bytes_up, bytes_down)
+        series.trim(ts_ms - int(TIMESERIES_RAW_RETENTION * 1000), self.raw_capacity())
+
+    def raw_capacity(self) -> int:
+        """Raw samples each series may keep: the global budget split among the live series."""
+        return max(TIMESERIES_RAW_MIN_SAMPLES, TIMESERIES_RAW_MAX_SAMPLES // max(len(self.series), 1))
+
+    # --- Persistencia ---
+
+    async def flush(self, close_buckets: bool = False):
+        """Appends closed buckets to disk; with close_buckets also the open (partial) ones."""
+        now_ms = int(time.time() * 1000)
+        idle_cutoff = now_ms - int(TIMESERIES_RAW_RETENTION * 1000)
+        batch: List[Tuple[str, bytes]] = []
+        for key, series in list(self.series.items()):
+            idle = not series.ts or series.ts[-1] < idle_cutoff
+            for resolution in ROLLUPS:
+                bucket = series.buckets.get(resolution)
+                if bucket is not None and (close_buckets or idle):
+                    series.pending[resolution] += bucket.pack()
+                    bucket.up = bucket.down = bucket.peak_up = bucket.peak_down = 0
+                if series.pending[resolution]:
+                    batch.append((_series_path(self.directory, resolution, key), bytes(series.pending[resolution])))
+                    series.pending[resolution] = bytearray()
+            if idle:
+                # Cola sin muestras recientes (eliminada o router caído)
+                del self.series[key]
+        if batch:
+            await to_thread(self._write, batch)
+
+    @staticmethod
+    def _write(batch: List[Tuple[str, bytes]]):
+        for path, data in batch:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(data)
+
+    async def enforce_retention(self):
+        await to_thread(self._enforce_retention, int(time.time() * 1000))
+
+    def _enforce_retention(self, now_ms: int):
+        for resolution in ROLLUPS:
+            cutoff = now_ms - int(RETENTION[resolution] * 1000)
+            root = os.path.join(self.directory, resolution)
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    if name.endswith('.bin'):
+                        _trim_file(os.path.join(dirpath, name), cutoff)
+
+    # --- Consultas ---
+
+    def pick_resolution(self, start_ms: int, end_ms: int) -> str:
+        """Finest resolution that still covers the range with a reasonable number of points."""
+        now_ms = int(time.time() * 1000)
+        span = end_ms - start_ms
+        if start_ms >= now_ms - TIMESERIES_RAW_RETENTION * 1000 and span <= 2 * 3_600_000:
+            return RESOLUTION_RAW
+        if start_ms >= now_ms - TIMESERIES_1M_RETENTION * 1000 and span <= 2 * 86_400_000:
+            return "1m"
+        return "1h"
+
+    async def query(self, key: SeriesKey, start_ms: int, end_ms: int,
+                    resolution: Optional[str] = None, step_ms: Optional[int] = None) -> dict:
+        """Usage of one queue in [start_ms, end_ms): points plus totals."""
+        series = self.series.get(key)
+        if resolution is None:
+            resolution = self.pick_resolution(start_ms, end_ms)
+            # La cola ya no tiene raw desde start_ms (recortada por capacidad)
+            if resolution == RESOLUTION_RAW and series and series.floor_ms > start_ms:
+                resolution = "1m"
+
+        if resolution == RESOLUTION_RAW:
+            points = series.raw_points(start_ms, end_ms) if series else []
+        else:
+            width = ROLLUPS[resolution]
+            # Incluye el bucket que empieza antes de start_ms pero lo solapa
+            first_bucket = start_ms - start_ms % width
+            data = await to_thread(
+                _read_range, _series_path(self.directory, resolution, key), first_bucket, end_ms
+            )
+            if series:
+                # Buckets aún no escritos en disco (siempre posteriores a los del archivo)
+                data += bytes(series.pending[resolution])
+                bucket = series.buckets.get(resolution)
+                if bucket is not None:
+                    data += bucket.pack()
+            points = [
+                {
+                    "t": ts, "up": up, "down": down,
+                    "rate_up": up * 8000 // width, "rate_down": down * 8000 // width,
+                    "peak_up": peak_up, "peak_down": peak_down,
+                }
+                for ts, up, down, peak_up, peak_down in _merge_records(data)
+                if first_bucket <= ts < end_ms
+            ]
+
+        if step_ms:
+            points = _downsample(points, step_ms)
+
+        return {
+            "router_id": key[0],
+            "target": key[1],
+            "resolution": resolution,
+            "start": start_ms,
+            "end": end_ms,
+            "total_up": sum(p["up"] for p in points),
+            "total_down": sum(p["down"] for p in points),
+            "points": points,
+        }
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(close_buckets=True)
+
+    async def _run(self):
+        last_retention = 0.0
+        while True:
+            await asyncio.sleep(TIMESERIES_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time.time() - last_retention > 3600:
+                    await self.enforce_retention()
+                    last_retention = time.time()
+            except Exception as e:
+                logger.error(f"Error guardando historial de tráfico: {e}")
+
+
+def _downsample(points: List[dict], step_ms: int) -> List[dict]:
+    """Groups points into step_ms buckets: bytes are summed, rates averaged over the step, peaks maxed."""
+    merged: Dict[int, dict] = {}
+    for p in points:
+        start = p["t"] - p["t"] % step_ms
+        m = merged.get(start)
+        if m is None:
+            m = merged[start] = {"t": start, "up": 0, "down": 0, "peak_up": 0, "peak_down": 0}
+        m["up"] += p["up"]
+        m["down"] += p["down"]
+        m["peak_up"] = max(m["peak_up"], p.get("peak_up", p["rate_up"]))
+        m["peak_down"] = max(m["peak_down"], p.get("peak_down", p["rate_down"]))
+    for m in merged.values():
+        m["rate_up"] = m["up"] * 8000 // step_ms
+        m["rate_down"] = m["down"] * 8000 // step_ms
+    return list(merged.values())
+
+
+# Instancia global
+traffic_history = TrafficHistory(telemetry_poller)
@@ -0,0 +1,270 @@
+"""
+Top-N talkers maintained incrementally from the telemetry stream.
+
+- By current rate: on every poll tick each router keeps only its
+  TOP_CAPACITY busiest queues (heapq.nlargest); the fleet ranking merges
+  those short lists.
+- By bytes over a window (TOP_WINDOWS, e.g. 5m/1h/24h): every window is a
+  ring of TOP_WINDOW_SLOTS count-min sketches plus a running-sum sketch, so
+  memory is fixed whatever the number of queues. Each router keeps a bounded
+  set of TOP_CAPACITY candidate keys whose estimates are the highest seen;
+  expired slots are subtracted from the running sum when the ring advances.
+  Per-tick byte increments are summed exactly and folded into the sketches
+  once per slot of the shortest window, so a tick costs one dict update per
+  queue; queries add the not-yet-folded bytes to the candidates' estimates.
+
+Count-min estimates never under-count; with TOP_SKETCH_WIDTH columns the
+over-count is at most e/width of the window's total traffic (per row, with
+high probability), which is negligible for the heavy hitters this ranks.
+"""
+import heapq
+import os
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from modules.monitor.telemetry import RouterSnapshot, TelemetryPoller, telemetry_poller
+from modules.monitor.timeseries import counter_delta
+
+TOP_CAPACITY = int(os.getenv("TOP_CAPACITY", "100"))
+TOP_WINDOWS = os.getenv("TOP_WINDOWS", "5m,1h,24h")
+TOP_WINDOW_SLOTS = int(os.getenv("TOP_WINDOW_SLOTS", "12"))
+TOP_SKETCH_WIDTH = int(os.getenv("TOP_SKETCH_WIDTH", "4096"))
+TOP_SKETCH_DEPTH = int(os.getenv("TOP_SKETCH_DEPTH", "4"))
+
+TOP_BY_RATE = "rate"
+TOP_BY_BYTES = "bytes"
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# (router_id, target)
+QueueKey = Tuple[int, str]
+
+
+def parse_window(value: str) -> int:
+    """'5m' -> 300, '24h' -> 86400."""
+    value = value.strip()
+    return int(value[:-1]) * _UNITS[value[-1]]
+
+
+class CountMinSketch:
+    """Count-min sketch stored as one flat array (depth rows x width columns)."""
+    __slots__ = ('width', 'depth', 'counts')
+
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.counts = array('Q', bytes(8 * width * depth))
+
+    def indexes(self, key: QueueKey) -> List[int]:
+        # Doble hashing: h1 + i*h2 por fila
+        h1, h2 = hash(key), hash((key, 1)) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, indexes: List[int], value: int):
+        counts = self.counts
+        for i in indexes:
+            counts[i] += value
+
+    def estimate(self, indexes: List[int]) -> int:
+        counts = self.counts
+        return min(counts[i] for i in indexes)
+
+    def subtract(self, other: "CountMinSketch"):
+        counts, old = self.counts, other.counts
+        for i in range(len(counts)):
+            if old[i]:
+                counts[i] -= old[i]
+
+    def clear(self):
+        self.counts = array('Q', bytes(8 * self.width * self.depth))
+
+
+class WindowTopK:
+    """Heavy hitters by bytes in one sliding window."""
+
+    def __init__(self, window: int, slots: int = TOP_WINDOW_SLOTS,
+                 width: int = TOP_SKETCH_WIDTH, depth: int = TOP_SKETCH_DEPTH,
+                 capacity: int = TOP_CAPACITY):
+        self.window = window
+        self.slot_length = window / slots
+        self.slots = [CountMinSketch(width, depth) for _ in range(slots)]
+        self.total = CountMinSketch(width, depth)
+        self.capacity = capacity
+        self.epoch: Optional[int] = None
+        # router_id -> {key: última estimación}
+        self.candidates: Dict[int, Dict[QueueKey, int]] = {}
+
+    def _advance(self, now: float):
+        epoch = int(now // self.slot_length)
+        if self.epoch is None:
+            self.epoch = epoch
+            return
+        if epoch <= self.epoch:
+            return
+        # Vaciar los slots que salen de la ventana (como mucho una vuelta completa)
+        for e in range(self.epoch + 1, min(epoch, self.epoch + len(self.slots)) + 1):
+            slot = self.slots[e % len(self.slots)]
+            self.total.subtract(slot)
+            slot.clear()
+        self.epoch = epoch
+        self._refresh_candidates()
+
+    def _refresh_candidates(self):
+        for router_id, candidates in self.candidates.items():
+            for key in candidates:
+                candidates[key] = self.total.estimate(self.total.indexes(key))
+            for key in [k for k, v in candidates.items() if v == 0]:
+                del candidates[key]
+
+    def add_batch(self, router_id: int, items: List[Tuple[QueueKey, List[int], int]], now: float):
+        """Adds one tick of (key, sketch indexes, bytes) of a router and refreshes its candidates."""
+        self._advance(now)
+        slot = self.slots[self.epoch % len(self.slots)].counts
+        total = self.total.counts
+        scored = []
+        for key, indexes, value in items:
+            estimate = None
+            for i in indexes:
+                slot[i] += value
+                total[i] += value
+                if estimate is None or total[i] < estimate:
+                    estimate = total[i]
+            scored.append((estimate, key))
+
+        # Candidatos: los de mayor estimación entre los actuales y los de este tick
+        candidates = self.candidates.setdefault(router_id, {})
+        updated = {key for _, key in scored}
+        scored.extend(
+            (self.total.estimate(self.total.indexes(key)), key) for key in candidates if key not in updated
+        )
+        self.candidates[router_id] = {key: estimate for estimate, key in heapq.nlargest(self.capacity, scored)}
+
+    def top(self, n: int, router_id: Optional[int] = None, now: Optional[float] = None) -> List[Tuple[QueueKey, int]]:
+        self._advance(now or time.time())
+        if router_id is None:
+            keys = [k for candidates in self.candidates.values() for k in candidates]
+        else:
+            keys = list(self.candidates.get(router_id, ()))
+        scored = ((k, self.total.estimate(self.total.indexes(k))) for k in keys)
+        return [(k, v) for k, v in heapq.nlargest(n, scored, key=lambda item: item[1]) if v > 0]
+
+    def forget_router(self, router_id: int):
+        self.candidates.pop(router_id, None)
+
+
+class TopTalkers:
+    def __init__(self, poller: TelemetryPoller, windows: str = TOP_WINDOWS):
+        self.windows: Dict[str, WindowTopK] = {
+            w.strip(): WindowTopK(parse_window(w)) for w in windows.split(",") if w.strip()
+        }
+        # router_id -> las TOP_CAPACITY colas con más tráfico en el último tick
+        self.by_rate: Dict[int, List[Tuple[QueueKey, dict]]] = {}
+        # router_id -> {target: (queue .id, bytes totales)} de la lectura anterior
+        self._last_bytes: Dict[int, Dict[str, Tuple[Optional[str], int]]] = {}
+        self._ingested: Dict[int, float] = {}
+        # Bytes exactos desde el último volcado a los sketches: router_id -> {key: bytes}
+        self._pending: Dict[int, Dict[QueueKey, int]] = {}
+        self._pending_since: Optional[float] = None
+        self._pending_until = 0.0
+        # Se vuelca a los sketches una vez por slot de la ventana más corta
+        self.fold_interval = min((w.slot_length for w in self.windows.values()), default=60.0)
+        poller.add_listener(self.on_tick)
+
+    def on_tick(self, snapshots: Dict[int, RouterSnapshot]):
+        """Poller listener: refreshes the rate ranking and feeds the window sketches."""
+        for router_id in list(self.by_rate):
+            if router_id not in snapshots:
+                del self.by_rate[router_id]
+                self._last_bytes.pop(router_id, None)
+                self._ingested.pop(router_id, None)
+                self._pending.pop(router_id, None)
+                for window in self.windows.values():
+                    window.forget_router(router_id)
+
+        for router_id, snapshot in snapshots.items():
+            if not snapshot.online or snapshot.updated_at <= self._ingested.get(router_id, 0.0):
+                continue
+            self._ingested[router_id] = snapshot.updated_at
+            queues = snapshot.queues
+
+            self.by_rate[router_id] = [
+                ((router_id, target), q) for target, q in heapq.nlargest(
+                    TOP_CAPACITY, queues.items(), key=lambda item: item[1]['rate_up'] + item[1]['rate_down']
+                )
+            ]
+
+            previous = self._last_bytes.get(router_id, {})
+            current = {}
+            pending = self._pending.setdefault(router_id, {})
+            for target, q in queues.items():
+                total = q['bytes_up'] + q['bytes_down']
+                current[target] = (q.get('id'), total)
+                last = previous.get(target)
+                if last is None:
+                    continue
+                delta = total if last[0] != q.get('id') else counter_delta(last[1], total)
+                if delta:
+                    key = (router_id, target)
+                    pending[key] = pending.get(key, 0) + delta
+            self._last_bytes[router_id] = current
+            self._pending_until = max(self._pending_until, snapshot.updated_at)
+            if self._pending_since is None:
+                self._pending_since = snapshot.updated_at
+
+        if self._pending_since is not None and self._pending_until - self._pending_since >= self.fold_interval:
+            self.fold()
+
+    def fold(self):
+        """Vuelca los bytes acumulados a los sketches de todas las ventanas."""
+        pending, self._pending = self._pending, {}
+        self._pending_since = None
+        if not self.windows:
+            return
+        sketch = next(iter(self.windows.values())).total
+        for router_id, totals in pending.items():
+            # Todas las ventanas comparten ancho y hash: se calcula una vez por cola
+            items = [(key, sketch.indexes(key), value) for key, value in totals.items()]
+            for window in self.windows.values():
+                window.add_batch(router_id, items, self._pending_until)
+
+    def top_by_rate(self, n: int, router_id: Optional[int] = None) -> List[dict]:
+        if router_id is None:
+            entries = heapq.merge(*self.by_rate.values(), key=lambda e: -(e[1]['rate_up'] + e[1]['rate_down']))
+        else:
+            entries = self.by_rate.get(router_id, [])
+        result = []
+        for (rid, target), q in entries:
+            rate = q['rate_up'] + q['rate_down']
+            if not rate or len(result) >= n:
+                break
+            result.append({
+                "router_id": rid, "target": target, "queue": q['name'],
+                "rate_up": q['rate_up'], "rate_down": q['rate_down'], "rate_total": rate,
+            })
+        return result
+
+    def top_by_bytes(self, n: int, window: str, router_id: Optional[int] = None) -> List[dict]:
+        """
+        Candidates ranked by sketch estimate plus the exact bytes not yet
+        folded. Queues with pending bytes join the ranking even if they are
+        not candidates yet, so a new heavy hitter shows up before the next fold.
+        """
+        topk = self.windows[window]
+        scores = dict(topk.top(TOP_CAPACITY, router_id))
+        pending = self._pending.values() if router_id is None else [self._pending.get(router_id, {})]
+        for totals in pending:
+            for key, value in totals.items():
+                if key not in scores:
+                    scores[key] = topk.total.estimate(topk.total.indexes(key))
+                scores[key] += value
+        ranked = scores.items()
+        return [
+            {"router_id": rid, "target": target, "bytes": estimate}
+            for (rid, target), estimate in heapq.nlargest(n, ranked, key=lambda item: item[1])
+        ]
+
+
+# Instancia global
+top_talkers = TopTalkers(telemetry_poller)
@@ -0,0 +1,330 @@
+"""
+Asyncio client for the MikroTik RouterOS API.
+
+Implements the binary sentence protocol (length-prefixed words), login
+(plain-text for RouterOS >= 6.43 and the legacy MD5 challenge), and tagged
+commands: every command carries a unique `.tag` and a single reader task
+dispatches replies to the waiting caller, so many commands can be in flight
+on one socket. A command that times out or whose caller is cancelled is
+stopped on the router with `/cancel`.
+
+The resource API mirrors the `routeros_api` library used before:
+
+    api = AsyncRouterOsApi(host, username, password, port)
+    await api.connect()
+    queues = await api.get_resource('/queue/simple').get(name='juan')
+    await api.get_resource('/queue/simple').set(id=queues[0]['id'], max_limit='5M/10M')
+
+Keyword arguments are converted like in `routeros_api`: underscores become
+dashes and `id` / `proplist` become `.id` / `.proplist`; replies return
+`.id` as `id`. All values are strings.
+"""
+import asyncio
+import binascii
+import contextvars
+import hashlib
+import itertools
+import time
+from typing import Any, Dict, List, Optional
+
+from utils.logging import logger
+from utils.metrics import ROUTER_CALL_ERRORS, ROUTER_CALL_SECONDS, ROUTER_CALL_TIME, ROUTER_CALLS
+from utils.profiling import TIMING_ROUTER, record
+
+DEFAULT_TIMEOUT = 15.0
+
+
+class RouterOsApiError(Exception):
+    """The router answered a command with !trap."""
+
+
+class RouterOsConnectionError(Exception):
+    """The connection is closed, failed, or the router sent !fatal."""
+
+
+class RouterOsTimeoutError(RouterOsConnectionError, asyncio.TimeoutError):
+    """
+    A command got no reply in time. It was cancelled on the router, but a
+    write may already have been applied: callers must re-read the router
+    state (it is a RouterOsConnectionError, so syncs retry with a fresh dump).
+    """
+
+
+# --- Codificación del protocolo ---
+
+def encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_word(word: str) -> bytes:
+    data = word.encode('utf-8', errors='backslashreplace')
+    return encode_length(len(data)) + data
+
+
+def encode_sentence(words: List[str]) -> bytes:
+    return b''.join(encode_word(w) for w in words) + b'\x00'
+
+
+async def read_length(reader: asyncio.StreamReader) -> int:
+    first = (await reader.readexactly(1))[0]
+    if first & 0x80 == 0x00:
+        return first
+    if first & 0xC0 == 0x80:
+        return ((first & 0x3F) << 8) + (await reader.readexactly(1))[0]
+    if first & 0xE0 == 0xC0:
+        return ((first & 0x1F) << 16) + int.from_bytes(await reader.readexactly(2), 'big')
+    if first & 0xF0 == 0xE0:
+        return ((first & 0x0F) << 24) + int.from_bytes(await reader.readexactly(3), 'big')
+    if first == 0xF0:
+        return int.from_bytes(await reader.readexactly(4), 'big')
+    raise RouterOsConnectionError(f"Invalid word length prefix: {first:#x}")
+
+
+async def read_sentence(reader: asyncio.StreamReader) -> List[str]:
+    words = []
+    while True:
+        length = await read_length(reader)
+        if length == 0:
+            return words
+        words.append((await reader.readexactly(length)).decode('utf-8', errors='backslashreplace'))
+
+
+def parse_reply(words: List[str]) -> tuple:
+    """Splits a reply sentence into (reply type, tag, attributes)."""
+    reply_type = words[0] if words else ''
+    tag = None
+    attributes: Dict[str, str] = {}
+    for word in words[1:]:
+        if word.startswith('.tag='):
+            tag = word[5:]
+        elif word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attributes[key] = value
+    return reply_type, tag, attributes
+
+
+def encode_key(key: str) -> str:
+    key = key.replace('_', '-')
+    return '.' + key if key in ('id', 'proplist') else key
+
+
+def decode_reply(attributes: Dict[str, str]) -> Dict[str, str]:
+    return {(key[1:] if key in ('.id', '.proplist') else key): value for key, value in attributes.items()}
+
+
+class _PendingCommand:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.future = loop.create_future()
+        self.replies: List[Dict[str, str]] = []
+        self.trap: Optional[str] = None
+        self.done_attributes: Dict[str, str] = {}
+
+
+class AsyncResource:
+    """Async equivalent of routeros_api's RouterOsResource for one menu path."""
+
+    def __init__(self, api: "AsyncRouterOsApi", path: str):
+        self.api = api
+        self.path = '/' + path.strip('/') + '/'
+
+    async def get(self, **queries) -> List[Dict[str, str]]:
+        return await self.call('print', {}, queries)
+
+    async def add(self, **arguments) -> Optional[str]:
+        """Adds an item and returns its new .id."""
+        _, done = await self._command('add', arguments)
+        return done.get('ret')
+
+    async def set(self, **arguments):
+        return await self.call('set', arguments)
+
+    async def remove(self, **arguments):
+        return await self.call('remove', arguments)
+
+    async def call(self, command: str, arguments: Optional[Dict[str, Any]] = None,
+                   queries: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
+        replies, _ = await self._command(command, arguments, queries)
+        return replies
+
+    async def _command(self, command: str, arguments: Optional[Dict[str, Any]] = None,
+                       queries: Optional[Dict[str, Any]] = None) -> tuple:
+        words = [self.path + command]
+        words += [f"={encode_key(k)}={v}" for k, v in (arguments or {}).items()]
+        words += [f"?{encode_key(k)}={v}" for k, v in (queries or {}).items()]
+        replies, done = await self.api.talk(words)
+        return [decode_reply(r) for r in replies], done
+
+
+class AsyncRouterOsApi:
+    """One API session (TCP socket) to a router."""
+
+    def __init__(self, host: str, username: str = 'admin', password: str = '',
+                 port: int = 8728, timeout: float = DEFAULT_TIMEOUT, label: Optional[str] = None):
+        self.host = host
+        # Etiqueta "router" de las métricas (el manager usa el id del router)
+        self.label = label or f"{host}:{port}"
+        self.username = username
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, _PendingCommand] = {}
+        self._tags = itertools.count(1)
+        self._closed = True
+
+    @property
+    def connected(self) -> bool:
+        return not self._closed
+
+    @property
+    def in_flight(self) -> int:
+        """Commands sent and still waiting for their !done."""
+        return len(self._pending)
+
+    async def connect(self):
+        """Opens the socket and logs in."""
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        self._closed = False
+        # El lector vive lo que la sesión: no hereda el contexto de quien conecta
+        self._reader_task = asyncio.create_task(self._read_loop(), context=contextvars.Context())
+        try:
+            await self.login()
+        except BaseException:
+            await self.close()
+            raise
+
+    async def login(self):
+        _, done = await self.talk(['/login', f'=name={self.username}', f'=password={self.password}'])
+        if 'ret' in done:
+            # RouterOS < 6.43: login por desafío MD5
+            challenge = binascii.unhexlify(done['ret'])
+            digest = hashlib.md5(b'\x00' + self.password.encode() + challenge).hexdigest()
+            await self.talk(['/login', f'=name={self.username}', f'=response=00{digest}'])
+
+    def get_resource(self, path: str) -> AsyncResource:
+        return AsyncResource(self, path)
+
+    async def talk(self, words: List[str], timeout: Optional[float] = None) -> tuple:
+        """
+        Sends one command and waits for its !done.
+        Returns (list of !re attribute dicts, !done attribute dict).
+        Raises RouterOsApiError on !trap and RouterOsConnectionError if the socket dies.
+        """
+        if self._closed:
+            raise RouterOsConnectionError(f"Not connected to {self.host}")
+
+        tag = str(next(self._tags))
+        pending = _PendingCommand(asyncio.get_running_loop())
+        self._pending[tag] = pending
+        started = time.perf_counter()
+        error_kind = None
+        try:
+            # Una sola escritura por sentencia: las sentencias nunca se entrelazan
+            self._writer.write(encode_sentence(words + [f'.tag={tag}']))
+            await self._writer.drain()
+            await asyncio.wait_for(pending.future, timeout or self.timeout)
+        except asyncio.TimeoutError as e:
+            error_kind = 'timeout'
+            self._cancel(tag)
+            raise RouterOsTimeoutError(
+                f"{words[0]}: no reply from {self.host} in {timeout or self.timeout}s") from e
+        except asyncio.CancelledError:
+            self._cancel(tag)
+            raise
+        except RouterOsConnectionError:
+            error_kind = 'connection'
+            raise
+        except (ConnectionError, OSError) as e:
+            error_kind = 'connection'
+            await self.close()
+            raise RouterOsConnectionError(str(e)) from e
+        finally:
+            # Las respuestas tardías de un comando cancelado se descartan
+            self._pending.pop(tag, None)
+            if error_kind is None and pending.trap is not None:
+                error_kind = 'trap'
+            self._observe(words[0], time.perf_counter() - started, error_kind)
+
+        if pending.trap is not None:
+            raise RouterOsApiError(pending.trap)
+        return pending.replies, pending.done_attributes
+
+    def _cancel(self, tag: str):
+        """Asks the router to stop the command `tag`; its late replies are discarded."""
+        if self._closed:
+            return
+        try:
+            self._writer.write(encode_sentence(['/cancel', f'=tag={tag}', f'.tag={next(self._tags)}']))
+        except (ConnectionError, OSError, RuntimeError):
+            pass
+
+    def _observe(self, path: str, duration: float, error_kind: Optional[str]):
+        ROUTER_CALL_SECONDS.observe(duration, path)
+        ROUTER_CALLS.inc(self.label)
+        ROUTER_CALL_TIME.inc(self.label, value=duration)
+        record(TIMING_ROUTER, duration)
+        if error_kind:
+            ROUTER_CALL_ERRORS.inc(self.label, error_kind)
+
+    async def _read_loop(self):
+        error: Exception = RouterOsConnectionError(f"Connection to {self.host} closed")
+        try:
+            while True:
+                words = await read_sentence(self._reader)
+                reply_type, tag, attributes = parse_reply(words)
+                if reply_type == '!fatal':
+                    error = RouterOsConnectionError(f"Fatal: {' '.join(words[1:])}")
+                    break
+                pending = self._pending.get(tag)
+                if pending is None:
+                    continue
+                if reply_type == '!re':
+                    pending.replies.append(attributes)
+                elif reply_type == '!trap':
+                    pending.trap = attributes.get('message', 'unknown error')
+                elif reply_type == '!done':
+                    pending.done_attributes = attributes
+                    if not pending.future.done():
+                        pending.future.set_result(None)
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            error = RouterOsConnectionError(f"Connection to {self.host} lost: {e}")
+        except Exception as e:
+            logger.error(f"RouterOS API {self.host}: error de protocolo: {e}")
+            error = RouterOsConnectionError(str(e))
+        finally:
+            self._fail_pending(error)
+            self._closed = True
+            if self._writer:
+                self._writer.close()
+
+    def _fail_pending(self, error: Exception):
+        for pending in self._pending.values():
+            if not pending.future.done():
+                pending.future.set_exception(error)
+        self._pending.clear()
+
+    async def close(self):
+        self._closed = True
+        if self._reader_task and not self._reader_task.done() and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._writer:
+            self._writer.close()
+        self._fail_pending(RouterOsConnectionError(f"Connection to {self.host} closed"))
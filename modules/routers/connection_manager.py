@@ -1,97 +1,381 @@
-import routeros_api
-import threading
-from typing import Dict, Tuple
-from contextlib import contextmanager
+import asyncio
+import contextvars
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
 from modules.routers.models import Router
+from modules.routers.async_api import AsyncRouterOsApi, RouterOsConnectionError
+from utils.logging import logger
+from utils.metrics import ROUTER_LOCK_WAIT
+
+# Sesiones API abiertas como máximo por router
+ROUTER_POOL_SIZE = int(os.getenv("ROUTER_POOL_SIZE", "2"))
+# Cada cuánto se hace ping a las sesiones ociosas
+ROUTER_KEEPALIVE_INTERVAL = float(os.getenv("ROUTER_KEEPALIVE_INTERVAL", "30"))
+ROUTER_PING_TIMEOUT = float(os.getenv("ROUTER_PING_TIMEOUT", "5"))
+# Sesiones sin uso durante este tiempo se cierran
+ROUTER_IDLE_TIMEOUT = float(os.getenv("ROUTER_IDLE_TIMEOUT", "300"))
+# Sesiones más antiguas que esto se reciclan cuando quedan libres
+ROUTER_MAX_LIFETIME = float(os.getenv("ROUTER_MAX_LIFETIME", "3600"))
+# Reintentos de conexión ante rechazo/reset (no ante timeout) con backoff exponencial
+ROUTER_CONNECT_ATTEMPTS = int(os.getenv("ROUTER_CONNECT_ATTEMPTS", "3"))
+ROUTER_RECONNECT_BACKOFF = float(os.getenv("ROUTER_RECONNECT_BACKOFF", "0.5"))
+ROUTER_RECONNECT_BACKOFF_MAX = float(os.getenv("ROUTER_RECONNECT_BACKOFF_MAX", "8"))
+# Circuit breaker: fallos de conexión seguidos para abrir el circuito y espera hasta el sondeo
+ROUTER_BREAKER_THRESHOLD = int(os.getenv("ROUTER_BREAKER_THRESHOLD", "2"))
+ROUTER_BREAKER_BACKOFF = float(os.getenv("ROUTER_BREAKER_BACKOFF", "5"))
+ROUTER_BREAKER_BACKOFF_MAX = float(os.getenv("ROUTER_BREAKER_BACKOFF_MAX", "300"))
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class RouterUnavailableError(RouterOsConnectionError):
+    """The router's circuit is open: the call fails without touching the network."""
+
+
+def _fingerprint(router_db: Router) -> Tuple:
+    return (router_db.ip_address, router_db.port, router_db.username, router_db.password)
+
+
+class PooledSession:
+    """Una sesión API del pool con sus marcas de tiempo."""
+
+    def __init__(self, api: AsyncRouterOsApi):
+        self.api = api
+        self.created_at = self.last_used = self.last_checked = time.monotonic()
+
+    @property
+    def in_flight(self) -> int:
+        return self.api.in_flight
+
+    def expired(self, now: float) -> bool:
+        return now - self.created_at > ROUTER_MAX_LIFETIME
+
+
+class CircuitBreaker:
+    """Estado del circuito de un router (closed/open/half_open).
+
+    Tras ROUTER_BREAKER_THRESHOLD fallos de conexión seguidos el circuito se
+    abre y los llamadores fallan al instante. Pasado el backoff, un único
+    sondeo en segundo plano (half_open) decide: si conecta se cierra, si no
+    vuelve a abrirse con el backoff duplicado.
+    """
+
+    def __init__(self):
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.backoff = ROUTER_BREAKER_BACKOFF
+        self.retry_at = 0.0
+        self.opened_at: Optional[float] = None
+        self.probe_task: Optional[asyncio.Task] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.state == BREAKER_CLOSED
+
+    def record_success(self):
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.backoff = ROUTER_BREAKER_BACKOFF
+        self.opened_at = None
+
+    def record_failure(self) -> bool:
+        """Registra un fallo de conexión; devuelve True si el circuito pasa a open."""
+        self.failures += 1
+        if self.state == BREAKER_HALF_OPEN:
+            self.backoff = min(self.backoff * 2, ROUTER_BREAKER_BACKOFF_MAX)
+        elif self.state == BREAKER_OPEN or self.failures < ROUTER_BREAKER_THRESHOLD:
+            return False
+        self.state = BREAKER_OPEN
+        self.retry_at = time.monotonic() + self.backoff
+        self.opened_at = self.opened_at or time.time()
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened_at": self.opened_at,
+            "retry_in": round(max(0.0, self.retry_at - time.monotonic()), 1) if self.state == BREAKER_OPEN else None,
+        }
+
+
+class RouterPool:
+    """Sesiones abiertas hacia un router más su lock de escritura."""
+
+    def __init__(self, router_id: int, fingerprint: Tuple):
+        self.router_id = router_id
+        self.fingerprint = fingerprint
+        self.sessions: List[PooledSession] = []
+        self.write_lock = asyncio.Lock()
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        # Se perdió una sesión (socket caído o keepalive fallido) y aún no se repuso
+        self.lost = False
+        self.breaker = CircuitBreaker()
+        # Handshake en curso (TCP + login), compartido por los llamadores concurrentes
+        self.connecting: Optional[asyncio.Future] = None
+
+    def prune(self, now: float) -> List[PooledSession]:
+        """Quita sesiones cerradas y las caducadas sin comandos en curso; devuelve las que hay que cerrar."""
+        stale = [s for s in self.sessions if not s.api.connected or (s.expired(now) and not s.in_flight)]
+        if any(not s.api.connected for s in stale):
+            self.lost = True
+        self.sessions = [s for s in self.sessions if s not in stale]
+        return stale
+
 
 class RouterConnectionManager:
     _instance = None
-    _init_lock = threading.Lock()
-    # Store tuple (connection_pool, api_instance, per_router_lock)
-    _connections: Dict[int, Tuple[routeros_api.RouterOsApiPool, routeros_api.api.RouterOsApi, threading.RLock]] = {} 
+    _pools: Dict[int, RouterPool] = {}
+    _maintenance_task: Optional[asyncio.Task] = None
 
     def __new__(cls):
         if cls._instance is None:
-            with cls._init_lock:
-                if cls._instance is None:
-                    cls._instance = super(RouterConnectionManager, cls).__new__(cls)
+            cls._instance = super(RouterConnectionManager, cls).__new__(cls)
         return cls._instance
 
-    def get_connection(self, router_db: Router) -> routeros_api.api.RouterOsApi:
-        """Devuelve una conexión existente o crea una nueva si no existe.
-        NOTA: Para operaciones thread-safe, use get_locked_connection() en su lugar.
+    def _pool_for(self, router_db: Router) -> RouterPool:
+        pool = self._pools.get(router_db.id)
+        if pool is None:
+            pool = self._pools[router_db.id] = RouterPool(router_db.id, _fingerprint(router_db))
+        elif pool.fingerprint != _fingerprint(router_db):
+            # Cambiaron IP/puerto/credenciales: las sesiones existentes ya no sirven
+            pool.fingerprint = _fingerprint(router_db)
+            for session in pool.sessions:
+                asyncio.create_task(session.api.close())
+            pool.sessions = []
+            if pool.breaker.probe_task:
+                pool.breaker.probe_task.cancel()
+            pool.breaker = CircuitBreaker()
+        return pool
+
+    async def _open_session(self, router_id: int, pool: RouterPool) -> PooledSession:
+        """Abre una sesión nueva o se une al handshake ya en curso para este router.
+
+        Cada router tiene su propio futuro de establecimiento: los handshakes de
+        routers distintos van en paralelo y un router lento o caído no bloquea a
+        los demás. El shield evita que cancelar a un llamador aborte el handshake
+        que esperan otros.
         """
-        with self._init_lock:
-            if router_db.id in self._connections:
-                pool, api, lock = self._connections[router_db.id]
-                return api
-            
-            # Crear nueva conexión persistente
-            connection = routeros_api.RouterOsApiPool(
-                router_db.ip_address,
-                username=router_db.username,
-                password=router_db.password,
-                port=router_db.port,
-                plaintext_login=True
+        if pool.connecting is None:
+            # Contexto vacío: el handshake es compartido y no pertenece a la petición que lo inicia
+            future = asyncio.create_task(self._establish(router_id, pool), context=contextvars.Context())
+            pool.connecting = future
+
+            def _done(fut: asyncio.Future):
+                if pool.connecting is fut:
+                    pool.connecting = None
+                if not fut.cancelled():
+                    fut.exception()  # marcar como recuperada si nadie la esperaba
+
+            future.add_done_callback(_done)
+        return await asyncio.shield(pool.connecting)
+
+    async def _establish(self, router_id: int, pool: RouterPool, attempts: int = ROUTER_CONNECT_ATTEMPTS) -> PooledSession:
+        """Conecta reintentando con backoff si el router rechaza o resetea la conexión.
+        El fallo definitivo cuenta para el circuit breaker del router."""
+        try:
+            session = await self._connect(pool, attempts)
+        except Exception:
+            if pool.breaker.record_failure():
+                logger.warning(f"Router {pool.fingerprint[0]}: circuito abierto, reintento en {pool.breaker.backoff:.0f}s ({pool.last_error})")
+                pool.breaker.probe_task = asyncio.create_task(self._probe(router_id, pool), context=contextvars.Context())
+            raise
+        pool.breaker.record_success()
+        return session
+
+    async def _connect(self, pool: RouterPool, attempts: int) -> PooledSession:
+        host, port, username, password = pool.fingerprint
+        delay = ROUTER_RECONNECT_BACKOFF
+        for attempt in range(attempts):
+            api = AsyncRouterOsApi(host, username=username, password=password, port=port, label=str(pool.router_id))
+            try:
+                await api.connect()
+            except asyncio.TimeoutError as e:
+                # Un timeout ya consumió el presupuesto del llamador: no se reintenta
+                pool.last_error = f"timeout: {e}"
+                raise
+            except (ConnectionError, RouterOsConnectionError) as e:
+                pool.last_error = str(e)
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, ROUTER_RECONNECT_BACKOFF_MAX)
+            except Exception as e:
+                pool.last_error = str(e)
+                raise
+            else:
+                if pool.lost:
+                    pool.reconnects += 1
+                    pool.lost = False
+                pool.last_error = None
+                session = PooledSession(api)
+                pool.sessions.append(session)
+                return session
+
+    async def _probe(self, router_id: int, pool: RouterPool):
+        """Sondeo en segundo plano: único intento de conexión que decide si el circuito se cierra."""
+        breaker = pool.breaker
+        while breaker.state == BREAKER_OPEN:
+            await asyncio.sleep(max(0.0, breaker.retry_at - time.monotonic()))
+            breaker.state = BREAKER_HALF_OPEN
+            try:
+                await self._connect(pool, attempts=1)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                breaker.record_failure()
+                logger.debug(f"Router {pool.fingerprint[0]}: sondeo fallido, reintento en {breaker.backoff:.0f}s")
+            else:
+                breaker.record_success()
+                logger.info(f"Router {pool.fingerprint[0]}: circuito cerrado, router disponible")
+        breaker.probe_task = None
+
+    async def _acquire(self, router_db: Router, pool: RouterPool) -> PooledSession:
+        """Elige la sesión viva con menos comandos en curso; abre otra si todas están ocupadas."""
+        now = time.monotonic()
+        for stale in pool.prune(now):
+            await stale.api.close()
+
+        session = min(pool.sessions, key=lambda s: s.in_flight, default=None)
+        if session is None and not pool.breaker.closed:
+            # Router caído conocido: fallar rápido sin esperar el timeout de conexión
+            raise RouterUnavailableError(
+                f"Router {router_db.name} no disponible (circuito {pool.breaker.state}): {pool.last_error}"
             )
-            api = connection.get_api()
-            lock = threading.RLock()
-            self._connections[router_db.id] = (connection, api, lock)
-            return api
-
-    @contextmanager
-    def get_locked_connection(self, router_db: Router):
-        """Context manager que devuelve una conexión API con bloqueo thread-safe.
-        
+        if session is None or (session.in_flight and len(pool.sessions) < ROUTER_POOL_SIZE and pool.breaker.closed):
+            try:
+                session = await self._open_session(router_db.id, pool)
+            except Exception:
+                if session is None or not session.api.connected:
+                    raise
+                # Sin sesión nueva: se comparte la ocupada (los comandos se multiplexan)
+        session.last_used = now
+        return session
+
+    async def get_connection(self, router_db: Router) -> AsyncRouterOsApi:
+        """Devuelve una sesión del pool del router (la crea si hace falta).
+
+        Las sesiones multiplexan comandos por `.tag`: varias coroutines pueden
+        usarlas a la vez y sus comandos viajan en paralelo, así que una consulta
+        corta no espera a un volcado largo. Úsela para lecturas.
+
         Uso:
-            with manager.get_locked_connection(router) as api:
-                api.get_resource('/queue/simple').get()
+            api = await manager.get_connection(router)
+            await api.get_resource('/system/identity').get()
         """
-        # Primero asegurarse de que la conexión existe
-        with self._init_lock:
-            if router_db.id not in self._connections:
-                connection = routeros_api.RouterOsApiPool(
-                    router_db.ip_address,
-                    username=router_db.username,
-                    password=router_db.password,
-                    port=router_db.port,
-                    plaintext_login=True
-                )
-                api = connection.get_api()
-                lock = threading.RLock()
-                self._connections[router_db.id] = (connection, api, lock)
-        
-        pool, api, lock = self._connections[router_db.id]
-        
-        # Adquirir el lock específico del router
-        lock.acquire()
-        try:
-            yield api
-        finally:
-            lock.release()
-
-    def disconnect(self, router_id: int):
-        """Cierra y elimina la conexión de un router específico."""
-        with self._init_lock:
-            if router_id in self._connections:
+        session = await self._acquire(router_db, self._pool_for(router_db))
+        return session.api
+
+    @asynccontextmanager
+    async def get_locked_connection(self, router_db: Router):
+        """Context manager para escrituras (leer-modificar-escribir).
+
+        Devuelve una sesión del pool, pero serializa a los escritores de un
+        router entre sí para que dos sincronizaciones no creen colas
+        duplicadas. Las lecturas hechas con get_connection() no esperan este lock.
+
+        Uso:
+            async with manager.get_locked_connection(router) as api:
+                await api.get_resource('/queue/simple').add(...)
+        """
+        pool = self._pool_for(router_db)
+
+        # Adquirir el lock de escritura del router
+        started = time.perf_counter()
+        async with pool.write_lock:
+            ROUTER_LOCK_WAIT.observe(time.perf_counter() - started)
+            session = await self._acquire(router_db, pool)
+            yield session.api
+
+    # --- Mantenimiento del pool ---
+
+    async def _check_session(self, pool: RouterPool, session: PooledSession, now: float):
+        if session.in_flight:
+            return
+        if now - session.last_used > ROUTER_IDLE_TIMEOUT or session.expired(now):
+            reason = "ociosa" if now - session.last_used > ROUTER_IDLE_TIMEOUT else "reciclada"
+        else:
+            try:
+                await session.api.talk(['/system/identity/print'], timeout=ROUTER_PING_TIMEOUT)
+                session.last_checked = time.monotonic()
+                return
+            except Exception as e:
+                reason = f"keepalive fallido: {e}"
+                pool.last_error = str(e)
+                pool.lost = True
+        if session in pool.sessions:
+            pool.sessions.remove(session)
+        logger.debug(f"Sesión API {session.api.host} cerrada ({reason})")
+        await session.api.close()
+
+    async def maintain(self):
+        """Una pasada de keepalive, desalojo por inactividad y reciclado por antigüedad."""
+        now = time.monotonic()
+        checks = []
+        for pool in self._pools.values():
+            for stale in pool.prune(now):
+                checks.append(stale.api.close())
+            checks.extend(self._check_session(pool, s, now) for s in list(pool.sessions))
+        if checks:
+            await asyncio.gather(*checks, return_exceptions=True)
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(ROUTER_KEEPALIVE_INTERVAL)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"Error en mantenimiento del pool de routers: {e}")
+
+    def start(self):
+        """Arranca la tarea de keepalive del pool."""
+        if self._maintenance_task is None or self._maintenance_task.done():
+            RouterConnectionManager._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    def stats(self) -> Dict[int, dict]:
+        """Estado del pool por router."""
+        return {
+            router_id: {
+                "sessions": len(pool.sessions),
+                "in_flight": sum(s.in_flight for s in pool.sessions),
+                "reconnects": pool.reconnects,
+                "last_error": pool.last_error,
+                "breaker": pool.breaker.state,
+            }
+            for router_id, pool in self._pools.items()
+        }
+
+    def breaker_status(self, router_id: int) -> dict:
+        """Estado del circuit breaker de un router (closed si nunca se conectó)."""
+        pool = self._pools.get(router_id)
+        status = pool.breaker.to_dict() if pool else CircuitBreaker().to_dict()
+        status["last_error"] = pool.last_error if pool else None
+        return status
+
+    async def disconnect(self, router_id: int):
+        """Cierra todas las sesiones de un router específico."""
+        pool = self._pools.get(router_id)
+        if pool:
+            sessions, pool.sessions = pool.sessions, []
+            for session in sessions:
                 try:
-                    pool, _, lock = self._connections[router_id]
-                    # Intentar adquirir el lock antes de desconectar
-                    with lock:
-                        pool.disconnect()
+                    await session.api.close()
                 except Exception:
                     pass
-                del self._connections[router_id]
 
-    def disconnect_all(self):
-        with self._init_lock:
-            for pool, _, lock in self._connections.values():
-                try:
-                    with lock:
-                        pool.disconnect()
-                except:
-                    pass
-            self._connections.clear()
+    async def disconnect_all(self):
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            RouterConnectionManager._maintenance_task = None
+        for router_id, pool in list(self._pools.items()):
+            if pool.breaker.probe_task:
+                pool.breaker.probe_task.cancel()
+            await self.disconnect(router_id)
 
 # Instancia global
 manager = RouterConnectionManager()
@@ -0,0 +1,98 @@
+"""
+Concurrent fan-out of per-router operations.
+
+Runs one coroutine per router with a bounded number in flight, a per-call
+timeout and an overall deadline, so the total latency depends on the slowest
+single router instead of the sum of all of them.
+
+Operations that write to the routers should pass deadline=None: the deadline
+cancels every router still pending at once, possibly in the middle of a plan.
+"""
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from modules.routers.models import Router
+from utils.logging import logger
+
+# Límites configurables por entorno
+ROUTER_FANOUT_CONCURRENCY = int(os.getenv("ROUTER_FANOUT_CONCURRENCY", "32"))
+ROUTER_PROBE_TIMEOUT = float(os.getenv("ROUTER_PROBE_TIMEOUT", "5"))
+ROUTER_FANOUT_DEADLINE = float(os.getenv("ROUTER_FANOUT_DEADLINE", "10"))
+# Las lecturas de /queue/simple son más pesadas que un probe de identidad
+ROUTER_STATS_TIMEOUT = float(os.getenv("ROUTER_STATS_TIMEOUT", "10"))
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+
+
+@dataclass
+class FanOutResult:
+    """Outcome of one router operation inside a fan-out."""
+    router: Router
+    status: str
+    value: Any = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == STATUS_OK
+
+
+async def fan_out(
+    routers: Iterable[Router],
+    operation: Callable[[Router], Awaitable[Any]],
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    deadline: Optional[float] = ROUTER_FANOUT_DEADLINE,
+) -> Dict[int, FanOutResult]:
+    """
+    Runs `operation(router)` for every router concurrently.
+
+    Args:
+        routers: Routers to process.
+        operation: Async callable receiving a Router.
+        concurrency: Max operations in flight (default ROUTER_FANOUT_CONCURRENCY).
+        timeout: Per-router timeout in seconds (default ROUTER_PROBE_TIMEOUT).
+        deadline: Overall deadline in seconds (default ROUTER_FANOUT_DEADLINE).
+            Routers still pending when it expires are cancelled and reported
+            as timed out. None waits for every router (each one still bounded
+            by `timeout`).
+
+    Returns:
+        A dict router_id -> FanOutResult, with one entry per router.
+    """
+    routers = list(routers)
+    if not routers:
+        return {}
+
+    semaphore = asyncio.Semaphore(concurrency or ROUTER_FANOUT_CONCURRENCY)
+    per_call_timeout = timeout or ROUTER_PROBE_TIMEOUT
+
+    async def run(router_obj: Router) -> FanOutResult:
+        async with semaphore:
+            try:
+                value = await asyncio.wait_for(operation(router_obj), per_call_timeout)
+                return FanOutResult(router_obj, STATUS_OK, value)
+            except asyncio.TimeoutError:
+                logger.warning(f"Router {router_obj.name}: sin respuesta en {per_call_timeout}s")
+                return FanOutResult(router_obj, STATUS_TIMEOUT, error="timeout")
+            except Exception as e:
+                logger.warning(f"Router {router_obj.name}: error en operación concurrente: {e}")
+                return FanOutResult(router_obj, STATUS_ERROR, error=str(e))
+
+    tasks = {router_obj.id: asyncio.create_task(run(router_obj)) for router_obj in routers}
+    await asyncio.wait(tasks.values(), timeout=deadline)
+
+    results: Dict[int, FanOutResult] = {}
+    for router_obj in routers:
+        task = tasks[router_obj.id]
+        if task.done():
+            results[router_obj.id] = task.result()
+        else:
+            # Resultado parcial: el deadline global expiró antes que este router
+            task.cancel()
+            results[router_obj.id] = FanOutResult(router_obj, STATUS_TIMEOUT, error="deadline")
+    return results
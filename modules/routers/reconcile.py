@@ -0,0 +1,223 @@
+"""
+Router reconciliation job.
+
+Compares the Client table with the live queues and address-list entries of
+every router in one bulk pass per router, producing a drift report:
+
+- missing: client without a simple queue on its router
+- extra: queue or address-list entry managed by SimpleISP with no client
+  (address-list entries only when the suspension method uses the list)
+- wrong_limit: queue max-limit differs from the client's plan/suspension speed
+- wrong_disabled: queue disabled, or address-list flag not matching the status
+
+Optionally repairs the drift with the same bulk reconciliation used by the
+suspension engine. Runs on a schedule and on demand from the admin API.
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlmodel import select
+
+from database import async_session_maker
+from modules.clients.models import Client
+from modules.clients.service import (
+    apply_router_plan,
+    client_queue_params,
+    dump_router_state,
+    is_disabled,
+    normalize_limit,
+    plan_router_sync,
+)
+from modules.clients.router_state import router_state
+from modules.routers.connection_manager import manager
+from modules.routers.fanout import fan_out
+from modules.routers.models import Router
+from modules.settings.service import get_system_settings
+from utils.logging import logger
+
+# 0 desactiva la ejecución programada
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "21600"))
+RECONCILE_AUTO_REPAIR = os.getenv("RECONCILE_AUTO_REPAIR", "false").lower() in ("1", "true", "yes")
+RECONCILE_TIMEOUT = float(os.getenv("RECONCILE_TIMEOUT", "50"))
+
+# Prefijos de comentario con los que SimpleISP marca sus colas
+MANAGED_QUEUE_PREFIXES = ("Cliente: ", "SUSPENDIDO - ")
+
+DRIFT_KINDS = ("missing", "extra", "wrong_limit", "wrong_disabled")
+
+# Último informe generado (programado o manual)
+last_report: Optional[Dict[str, Any]] = None
+
+
+def _strip_mask(target: str) -> str:
+    return target[:-3] if target.endswith('/32') else target
+
+
+def build_drift_report(
+    queues: List[Dict[str, Any]],
+    address_list: List[Dict[str, Any]],
+    clients: Iterable[Client],
+    settings: dict,
+) -> Dict[str, List[dict]]:
+    """Computes the drift between the router dump and the router's clients."""
+    method = settings.get("suspension_method", "queue")
+    list_name = settings.get("address_list_name", "clientes_activos")
+    use_address_list = method in ["address_list", "both"]
+
+    queues_by_name = {q.get('name'): q for q in queues}
+    queues_by_target = {}
+    for q in queues:
+        queues_by_target.setdefault(_strip_mask(q.get('target', '')), q)
+    address_by_ip = {
+        item.get('address'): item for item in address_list if item.get('list') == list_name
+    }
+
+    report: Dict[str, List[dict]] = {kind: [] for kind in DRIFT_KINDS}
+    matched_queue_ids = set()
+    client_ips = set()
+
+    for client in clients:
+        client_ips.add(client.ip_address)
+        suspended = client.status == 'suspended'
+        info = {"client_id": client.id, "name": client.name, "ip_address": client.ip_address}
+
+        queue = queues_by_name.get(client.name) or queues_by_target.get(client.ip_address)
+        if not queue:
+            report["missing"].append({**info, "kind": "queue"})
+        else:
+            matched_queue_ids.add(queue.get('id'))
+            expected_limit, _ = client_queue_params(client, suspended, settings)
+            if normalize_limit(queue.get('max-limit')) != normalize_limit(expected_limit):
+                report["wrong_limit"].append({
+                    **info, "expected": expected_limit, "actual": queue.get('max-limit')
+                })
+            if is_disabled(queue.get('disabled')):
+                report["wrong_disabled"].append({
+                    **info, "kind": "queue", "expected": False, "actual": True
+                })
+
+        if use_address_list:
+            item = address_by_ip.get(client.ip_address)
+            if not item:
+                report["missing"].append({**info, "kind": "address_list"})
+            elif is_disabled(item.get('disabled')) != suspended:
+                report["wrong_disabled"].append({
+                    **info, "kind": "address_list",
+                    "expected": suspended, "actual": is_disabled(item.get('disabled'))
+                })
+
+    for q in queues:
+        comment = q.get('comment', '')
+        if q.get('id') not in matched_queue_ids and comment.startswith(MANAGED_QUEUE_PREFIXES):
+            report["extra"].append({
+                "kind": "queue", "id": q.get('id'), "name": q.get('name'),
+                "ip_address": _strip_mask(q.get('target', ''))
+            })
+    if use_address_list:
+        # Las entradas de SimpleISP llevan como comentario el nombre del cliente, que
+        # es también el nombre de su cola gestionada: las demás son ajenas
+        managed_names = {
+            q.get('name') for q in queues if q.get('comment', '').startswith(MANAGED_QUEUE_PREFIXES)
+        }
+        for address, item in address_by_ip.items():
+            if address not in client_ips and item.get('comment', '') in managed_names:
+                report["extra"].append({
+                    "kind": "address_list", "id": item.get('id'), "name": item.get('comment', ''),
+                    "ip_address": address
+                })
+
+    return report
+
+
+async def audit_router(router_db: Router, clients: List[Client], settings: dict, repair: bool) -> dict:
+    """Dumps one router, builds its drift report and optionally repairs it."""
+    async with manager.get_locked_connection(router_db) as api:
+        queues, address_list = await dump_router_state(api)
+        # El volcado renueva también el índice usado por las altas/bajas individuales
+        state = router_state.store(router_db, queues, address_list)
+        drift = build_drift_report(queues, address_list, clients, settings)
+
+        repaired = 0
+        if repair and any(drift[kind] for kind in DRIFT_KINDS):
+            desired = [(c, c.status == 'suspended') for c in clients]
+            plan = plan_router_sync(state, desired, settings)
+            # Los sobrantes se borran por .id para no tocar colas manuales con la misma IP
+            for extra in drift["extra"]:
+                path = '/queue/simple' if extra["kind"] == "queue" else '/ip/firewall/address-list'
+                plan.add(path, 'remove', id=extra["id"])
+            try:
+                await apply_router_plan(api, plan, state)
+            except Exception:
+                router_state.invalidate(router_db.id)
+                raise
+            repaired = len(plan)
+
+    return {**drift, "queues": len(queues), "repaired": repaired}
+
+
+async def run_reconciliation(repair: bool = False, router_ids: Optional[List[int]] = None) -> dict:
+    """Audits every active router (or the given ones) in parallel and stores the report."""
+    global last_report
+    started = time.time()
+
+    async with async_session_maker() as session:
+        settings = await get_system_settings(session)
+        query = select(Router).where(Router.is_active == True)
+        if router_ids:
+            query = query.where(Router.id.in_(router_ids))
+        routers = (await session.execute(query)).scalars().all()
+        clients = (await session.execute(
+            select(Client).where(Client.router_id.in_([r.id for r in routers]))
+        )).scalars().all()
+
+    clients_by_router: Dict[int, List[Client]] = defaultdict(list)
+    for client in clients:
+        clients_by_router[client.router_id].append(client)
+
+    results = await fan_out(
+        routers,
+        lambda r: audit_router(r, clients_by_router[r.id], settings, repair),
+        timeout=RECONCILE_TIMEOUT,
+        # Reparar escribe en los routers: sin deadline global que lo corte a medias
+        deadline=None if repair else RECONCILE_TIMEOUT,
+    )
+
+    router_reports = []
+    totals = {kind: 0 for kind in DRIFT_KINDS}
+    totals["repaired"] = 0
+    for router_obj in routers:
+        outcome = results[router_obj.id]
+        entry = {"router_id": router_obj.id, "router_name": router_obj.name, "clients": len(clients_by_router[router_obj.id])}
+        if outcome.ok:
+            entry.update(status="ok", **outcome.value)
+            for kind in DRIFT_KINDS:
+                totals[kind] += len(outcome.value[kind])
+            totals["repaired"] += outcome.value["repaired"]
+        else:
+            entry.update(status=outcome.status, error=outcome.error)
+        router_reports.append(entry)
+
+    last_report = {
+        "started_at": started,
+        "duration": round(time.time() - started, 3),
+        "repair": repair,
+        "totals": totals,
+        "routers": router_reports,
+    }
+    logger.info(f"Reconciliación completada en {last_report['duration']}s: {totals}")
+    return last_report
+
+
+async def reconcile_scheduler():
+    """Tarea de fondo: auditoría periódica de todos los routers."""
+    if RECONCILE_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            await run_reconciliation(repair=RECONCILE_AUTO_REPAIR)
+        except Exception as e:
+            logger.error(f"Error en reconciliación programada: {e}")
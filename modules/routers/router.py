@@ -1,6 +1,5 @@
-import asyncio
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import get_session
@@ -10,6 +9,9 @@ from modules.auth.models import User
 from modules.routers.schemas import RouterCreate, RouterRead, RouterUpdate
 from modules.routers.service import router_service
 from modules.routers.utils import fetch_router_stats
+from modules.routers import reconcile
+from modules.monitor.telemetry import telemetry_poller
+from modules.routers.connection_manager import manager
 
 router = APIRouter(prefix="/api/routers", tags=["routers"])
 
@@ -19,6 +21,19 @@ async def get_routers(
 ):
     return await router_service.get_all(session)
 
+@router.post("/reconcile", dependencies=[Depends(get_current_admin_user)])
+async def reconcile_routers(repair: bool = False, router_id: Optional[List[int]] = Query(None)):
+    """Compares the Client table with the live router state and returns a drift report.
+    With repair=true the drift is fixed in the same pass."""
+    return await reconcile.run_reconciliation(repair=repair, router_ids=router_id)
+
+@router.get("/reconcile/last", dependencies=[Depends(get_current_admin_user)])
+async def last_reconcile_report():
+    """Returns the last drift report (scheduled or on demand)."""
+    if reconcile.last_report is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No reconciliation has run yet")
+    return reconcile.last_report
+
 @router.get("/{router_id}", response_model=RouterRead, dependencies=[Depends(current_active_user)])
 async def get_router(
     router_id: int,
@@ -39,9 +54,15 @@ async def get_router_stats(
     if not router_item:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Router not found")
     
-    # Run the blocking API call in a thread pool
-    stats = await asyncio.to_thread(fetch_router_stats, router_item)
-    return stats
+    breaker = manager.breaker_status(router_id)
+    # Served from the shared telemetry cache; query the router only if it was never polled
+    snapshot = telemetry_poller.get(router_id)
+    if snapshot is None or not snapshot.updated_at:
+        return {**await fetch_router_stats(router_item), "breaker": breaker}
+    
+    if not snapshot.online:
+        return {"online": False, "error": snapshot.error, "updated_at": snapshot.updated_at, "breaker": breaker}
+    return {**snapshot.system, "stale": snapshot.stale, "updated_at": snapshot.updated_at, "breaker": breaker}
 
 @router.post("", response_model=RouterRead, dependencies=[Depends(get_current_admin_user)])
 async def create_router(
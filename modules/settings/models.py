@@ -5,3 +5,8 @@ class Settings(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     key: str = Field(unique=True, index=True)
     value: str
+
+class SettingsVersion(SQLModel, table=True):
+    """Contador que se incrementa en cada escritura de configuración (invalida las cachés de otros workers)."""
+    id: int = Field(default=1, primary_key=True)
+    version: int = 0
@@ -5,7 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_session
 from modules.auth.config import current_active_user
 from modules.auth.models import User
-from modules.settings.service import set_setting, get_system_settings
+from modules.settings.service import set_settings, get_system_settings
 
 router = APIRouter(prefix="/api/settings", tags=["settings"])
 
@@ -22,6 +22,5 @@ async def save_settings(
     session: AsyncSession = Depends(get_session),
     user: User = Depends(current_active_user)
 ):
-    for key, value in data.items():
-        await set_setting(session, key, str(value))
+    await set_settings(session, {key: str(value) for key, value in data.items()})
     return {"message": "Configuración guardada"}
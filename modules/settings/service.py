@@ -1,39 +1,99 @@
+"""
+System settings with a process-wide cache.
+
+Every worker keeps the settings in memory (loaded at startup) and refreshes
+them after its own writes. Writes also bump SettingsVersion in the same
+transaction; other uvicorn workers compare that counter at most every
+SETTINGS_VERSION_CHECK seconds and reload when it changed, so a change made
+through one worker reaches the others within that interval.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional
 
 from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from modules.settings.models import Settings
+from database import upsert_insert
+from modules.settings.models import Settings, SettingsVersion
+
+# 0 compara la versión en cada lectura
+SETTINGS_VERSION_CHECK = float(os.getenv("SETTINGS_VERSION_CHECK", "5"))
+
+SETTINGS_DEFAULTS = {
+    "suspension_speed": "1k/1k",
+    "suspension_method": "queue",  # queue, address_list, both
+    "address_list_name": "clientes_activos",
+    "grace_days": "3",
+}
+
+
+class SettingsCache:
+    def __init__(self):
+        self.values: Optional[Dict[str, str]] = None
+        self.version = -1
+        self.checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _read_version(self, session: AsyncSession) -> int:
+        result = await session.execute(select(SettingsVersion.version).where(SettingsVersion.id == 1))
+        return result.scalar() or 0
+
+    async def load(self, session: AsyncSession):
+        """Lee todas las configuraciones y la versión actual."""
+        version = await self._read_version(session)
+        result = await session.execute(select(Settings))
+        self.values = {s.key: s.value for s in result.scalars().all()}
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    async def get(self, session: AsyncSession) -> Dict[str, str]:
+        """Configuraciones en caché; recarga si otro worker las cambió."""
+        if self.values is not None and time.monotonic() - self.checked_at < SETTINGS_VERSION_CHECK:
+            return self.values
+        async with self._lock:
+            if self.values is None:
+                await self.load(session)
+            elif time.monotonic() - self.checked_at >= SETTINGS_VERSION_CHECK:
+                if await self._read_version(session) != self.version:
+                    await self.load(session)
+                else:
+                    self.checked_at = time.monotonic()
+        return self.values
+
+    def invalidate(self):
+        self.values = None
+
 
 async def get_setting(session: AsyncSession, key: str, default: str = "") -> str:
     """Obtiene un valor de configuración individual."""
-    statement = select(Settings).where(Settings.key == key)
-    result = await session.execute(statement)
-    setting = result.scalars().first()
-    return setting.value if setting else default
+    values = await settings_cache.get(session)
+    return values.get(key, default)
+
+async def set_settings(session: AsyncSession, values: Dict[str, str]):
+    """Crea o actualiza varias configuraciones en una sola transacción."""
+    if not values:
+        return
+    stmt = upsert_insert(session, Settings).values([{"key": k, "value": v} for k, v in values.items()])
+    await session.execute(stmt.on_conflict_do_update(index_elements=["key"], set_={"value": stmt.excluded.value}))
+
+    # Nueva versión para que los demás workers recarguen
+    version_stmt = upsert_insert(session, SettingsVersion).values(id=1, version=1)
+    await session.execute(version_stmt.on_conflict_do_update(
+        index_elements=["id"], set_={"version": SettingsVersion.version + 1}
+    ))
+    await session.commit()
+    await settings_cache.load(session)
 
 async def set_setting(session: AsyncSession, key: str, value: str):
     """Crea o actualiza una configuración."""
-    statement = select(Settings).where(Settings.key == key)
-    result = await session.execute(statement)
-    setting = result.scalars().first()
-    
-    if setting:
-        setting.value = value
-    else:
-        setting = Settings(key=key, value=value)
-        session.add(setting)
-    
-    await session.commit()
-    return setting
+    await set_settings(session, {key: value})
 
 async def get_system_settings(session: AsyncSession) -> dict:
     """Devuelve un diccionario con todas las configuraciones clave y sus defaults."""
-    # Obtenemos todo de la DB para no hacer mil consultas
-    result = await session.execute(select(Settings))
-    all_settings = {s.key: s.value for s in result.scalars().all()}
-    
-    return {
-        "suspension_speed": all_settings.get("suspension_speed", "1k/1k"),
-        "suspension_method": all_settings.get("suspension_method", "queue"), # queue, address_list, both
-        "address_list_name": all_settings.get("address_list_name", "clientes_activos"),
-        "grace_days": all_settings.get("grace_days", "3")
-    }
+    values = await settings_cache.get(session)
+    return {key: values.get(key, default) for key, default in SETTINGS_DEFAULTS.items()}
+
+
+# Instancia global
+settings_cache = SettingsCache()
@@ -22,6 +22,7 @@ window.appData = function () {
 
         init() {
             this.loadClients();
+            this.searchPaymentClients();
             this.loadRouters();
             this.loadSettings();
             this.loadDashboardSummary();
@@ -31,12 +32,32 @@ window.appData = function () {
         connectWebSocket() {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
             const ws = new WebSocket(`${protocol}//${window.location.host}/ws/traffic`);
+            // router_id -> Set of target IPs received in that router's last snapshot
+            const routerQueues = {};
             ws.onmessage = (e) => {
-                const data = JSON.parse(e.data);
-                this.trafficData = data.queues || {};
-                this.systemStats = data.system || {};
+                const frame = JSON.parse(e.data);
+                this.applyTrafficFrame(frame, routerQueues);
+                this.systemStats = frame.system || {};
             };
             ws.onclose = () => setTimeout(() => this.connectWebSocket(), 3000);
+        },
+
+        // Applies a snapshot/delta frame from /ws/traffic to trafficData
+        applyTrafficFrame(frame, routerQueues) {
+            const known = routerQueues[frame.router_id] || new Set();
+            if (frame.type === 'snapshot') {
+                known.forEach(ip => delete this.trafficData[ip]);
+                known.clear();
+            }
+            for (const [ip, queue] of Object.entries(frame.queues || {})) {
+                this.trafficData[ip] = queue;
+                known.add(ip);
+            }
+            (frame.removed || []).forEach(ip => {
+                delete this.trafficData[ip];
+                known.delete(ip);
+            });
+            routerQueues[frame.router_id] = known;
         }
     };
 };
@@ -1,11 +1,53 @@
 export const clientsModule = {
     clients: [],
+    clientFilters: { q: '', status: '', router_id: '' },
+    clientSort: 'name',
+    clientOrder: 'asc',
+    clientsCursor: null,
+    clientsLoading: false,
+    clientsImporting: false,
     showAddClientModal: false,
     newClient: { name: '', ip_address: '', limit_max_upload: '5M', limit_max_download: '10M', billing_day: 1 },
 
-    async loadClients() {
-        const res = await fetch('/api/clients');
-        if (res.ok) this.clients = await res.json();
+    // Paginación por cursor: loadClients() recarga desde la primera página,
+    // loadClients(true) añade la siguiente
+    async loadClients(more = false) {
+        if (more && !this.clientsCursor) return;
+        const params = new URLSearchParams({ sort: this.clientSort, order: this.clientOrder, stats: 'raw' });
+        for (const [key, value] of Object.entries(this.clientFilters)) {
+            if (value !== '' && value !== null) params.set(key, value);
+        }
+        if (more) params.set('cursor', this.clientsCursor);
+
+        this.clientsLoading = true;
+        try {
+            const res = await fetch(`/api/clients?${params}`);
+            if (!res.ok) return;
+            const page = await res.json();
+            this.clients = more ? this.clients.concat(page) : page;
+            this.clientsCursor = res.headers.get('X-Next-Cursor');
+        } finally {
+            this.clientsLoading = false;
+        }
+    },
+
+    // Formato legible de los contadores numéricos (stats=raw)
+    formatBytes(value) {
+        let n = Number(value) || 0;
+        for (const unit of ['B', 'KB', 'MB', 'GB', 'TB']) {
+            if (n < 1024) return `${n.toFixed(1)} ${unit}`;
+            n /= 1024;
+        }
+        return `${n.toFixed(1)} PB`;
+    },
+
+    formatRate(value) {
+        let n = Number(value) || 0;
+        for (const unit of ['bps', 'Kbps', 'Mbps', 'Gbps']) {
+            if (n < 1000) return `${n.toFixed(1)} ${unit}`;
+            n /= 1000;
+        }
+        return `${n.toFixed(1)} Tbps`;
     },
 
     openCreateModal() {
@@ -29,6 +71,27 @@ export const clientsModule = {
         this.loadClients();
     },
 
+    // Importación masiva (CSV con cabecera o NDJSON); el archivo se envía tal cual
+    async importClients(file) {
+        if (!file) return;
+        const ndjson = /\.(nd)?jsonl?$/i.test(file.name);
+        this.clientsImporting = true;
+        try {
+            const res = await fetch(`/api/clients/import?format=${ndjson ? 'ndjson' : 'csv'}`, { method: 'POST', body: file });
+            const report = await res.json();
+            if (!res.ok && !report.errors) {
+                alert(report.detail || 'Error al importar');
+                return;
+            }
+            const lines = report.errors.slice(0, 10).map(e => `Fila ${e.row}${e.field ? ` (${e.field})` : ''}: ${e.error}`);
+            if (report.error_count > lines.length) lines.push(`... y ${report.error_count - lines.length} errores más`);
+            alert(`Importados ${report.imported} de ${report.rows} clientes.` + (lines.length ? `\n\n${lines.join('\n')}` : ''));
+            if (report.imported) this.loadClients();
+        } finally {
+            this.clientsImporting = false;
+        }
+    },
+
     async deleteClient(id) {
         if (!confirm("¿Borrar?")) return;
         await fetch(`/api/clients/${id}`, { method: 'DELETE' });
@@ -3,7 +3,7 @@
  */
 export const dashboardModule = {
     dashboardData: {
-        routers: { total: 0, online: 0, offline: 0, offline_list: [] },
+        routers: { total: 0, online: 0, offline: 0, unknown: 0, offline_list: [], unknown_list: [] },
         clients: { total: 0, active: 0, suspended: 0 }
     },
     clientsChart: null,
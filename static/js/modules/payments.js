@@ -2,6 +2,16 @@ export const paymentsModule = {
     newPayment: { client_id: '', month_paid: '', amount: 0 },
     paymentHistory: [],
     paymentMonths: [],
+    paymentClients: [],
+    paymentClientSearch: '',
+
+    // El selector de pagos busca en el servidor en lugar de usar la lista paginada de clientes
+    async searchPaymentClients() {
+        const params = new URLSearchParams({ limit: 50 });
+        if (this.paymentClientSearch) params.set('q', this.paymentClientSearch);
+        const res = await fetch(`/api/clients?${params}`);
+        if (res.ok) this.paymentClients = await res.json();
+    },
 
     async submitPayment() {
         if (!this.newPayment.month_paid) {
@@ -0,0 +1,79 @@
+"""Counter deltas and billing cycles used by the usage accounting (modules/billing/usage.py)."""
+from datetime import date
+
+import pytest
+
+from modules.billing.usage import cycle_end, cycle_start, reading_delta
+from modules.monitor.timeseries import counter_delta
+
+WRAP_32 = 2 ** 32
+
+
+def test_counter_delta_increase():
+    assert counter_delta(1000, 1500) == 500
+    assert counter_delta(1000, 1000) == 0
+
+
+def test_counter_delta_wrap():
+    assert counter_delta(WRAP_32 - 100, 50) == 150
+    assert counter_delta(2 ** 64 - 10, 5) == 15
+
+
+def test_counter_delta_reset():
+    # Reinicio del router o de la cola: el contador vuelve a empezar en 0
+    assert counter_delta(5_000_000, 1200) == 1200
+
+
+def test_reading_delta_without_baseline():
+    assert reading_delta(None, ("*1", 500, 900)) == (0, 0)
+
+
+def test_reading_delta_same_queue():
+    assert reading_delta(("*1", 100, 1000), ("*1", 300, 1500)) == (200, 500)
+    assert reading_delta(("*1", WRAP_32 - 10, 1000), ("*1", 20, 1000)) == (30, 0)
+
+
+def test_reading_delta_recreated_queue():
+    # Nuevo .id: todo lo leído es tráfico de la cola nueva, aunque supere la lectura anterior
+    assert reading_delta(("*1", 100, 1000), ("*2", 40, 5000)) == (40, 5000)
+
+
+@pytest.mark.parametrize("day, billing_day, expected", [
+    (date(2025, 3, 15), 10, date(2025, 3, 10)),
+    (date(2025, 3, 5), 10, date(2025, 2, 10)),
+    (date(2025, 1, 5), 10, date(2024, 12, 10)),
+    # Febrero sin día 29-31: el corte pasa al último día del mes
+    (date(2025, 2, 28), 29, date(2025, 2, 28)),
+    (date(2025, 2, 28), 30, date(2025, 2, 28)),
+    (date(2025, 2, 28), 31, date(2025, 2, 28)),
+    (date(2025, 2, 27), 30, date(2025, 1, 30)),
+    (date(2025, 3, 15), 31, date(2025, 2, 28)),
+    (date(2025, 3, 31), 31, date(2025, 3, 31)),
+    (date(2024, 2, 29), 29, date(2024, 2, 29)),
+    (date(2024, 2, 29), 31, date(2024, 2, 29)),
+    (date(2024, 2, 28), 29, date(2024, 1, 29)),
+])
+def test_cycle_start(day, billing_day, expected):
+    assert cycle_start(day, billing_day) == expected
+
+
+@pytest.mark.parametrize("start, billing_day, expected", [
+    (date(2025, 1, 31), 31, date(2025, 2, 28)),
+    (date(2025, 2, 28), 31, date(2025, 3, 31)),
+    (date(2025, 1, 29), 29, date(2025, 2, 28)),
+    (date(2024, 1, 30), 30, date(2024, 2, 29)),
+    (date(2024, 12, 15), 15, date(2025, 1, 15)),
+])
+def test_cycle_end(start, billing_day, expected):
+    assert cycle_end(start, billing_day) == expected
+
+
+@pytest.mark.parametrize("billing_day", [29, 30, 31])
+def test_cycles_cover_february(billing_day):
+    # Ciclos consecutivos sin huecos ni solapes alrededor de febrero
+    start = cycle_start(date(2025, 1, 31), billing_day)
+    for _ in range(3):
+        end = cycle_end(start, billing_day)
+        assert cycle_start(end, billing_day) == end
+        assert cycle_start(date.fromordinal(end.toordinal() - 1), billing_day) == start
+        start = end
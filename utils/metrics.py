@@ -0,0 +1,206 @@
+"""
+Minimal Prometheus-style metrics (counters, gauges, histograms) and the
+metrics shared by the whole application.
+
+Every metric keeps at most METRICS_MAX_SERIES label combinations; past that,
+new combinations are folded into a single series whose labels are all
+"other", so a fleet of hundreds of routers (or an unexpected label value)
+cannot blow up memory or the scrape size.
+
+Values that already live elsewhere (pool sizes, subscribers...) are exposed
+through collectors: callables run at scrape time that return samples.
+"""
+import bisect
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "1000"))
+
+OVERFLOW_LABEL = "other"
+
+# Latencias: de 1 ms a 1 min
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# (labels, value) de una muestra calculada por un collector
+Sample = Tuple[Dict[str, str], float]
+CollectorResult = Iterable[Tuple[str, str, str, Iterable[Sample]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 max_series: int = METRICS_MAX_SERIES):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[str]) -> Tuple[str, ...]:
+        key = tuple(str(v) for v in labels)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+        if key not in self._series and len(self._series) >= self.max_series:
+            return (OVERFLOW_LABEL,) * len(key)
+        return key
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._series.items())
+        for key, value in items:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key: Tuple[str, ...], value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, value: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, max_series: int = METRICS_MAX_SERIES):
+        super().__init__(name, documentation, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [conteos por bucket (no acumulados)..., +Inf, suma]
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _render_series(self, key: Tuple[str, ...], series) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], CollectorResult]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], CollectorResult]):
+        """`collector()` returns (name, type, help, samples) tuples, computed at scrape time."""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Optional[Sequence[float]] = None) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets or DEFAULT_BUCKETS))
+
+
+# --- Métricas de la aplicación ---
+
+# RouterOS API (modules/routers/async_api.py y connection_manager.py)
+ROUTER_CALL_SECONDS = histogram(
+    "simpleisp_router_call_duration_seconds", "RouterOS API command latency by command path", ["path"])
+ROUTER_CALLS = counter(
+    "simpleisp_router_calls_total", "RouterOS API commands sent per router", ["router"])
+ROUTER_CALL_TIME = counter(
+    "simpleisp_router_call_seconds_total", "Total time spent waiting for RouterOS API replies per router", ["router"])
+ROUTER_CALL_ERRORS = counter(
+    "simpleisp_router_call_errors_total", "RouterOS API command failures per router and kind (trap, connection, timeout)",
+    ["router", "kind"])
+ROUTER_LOCK_WAIT = histogram(
+    "simpleisp_router_lock_wait_seconds", "Time waiting for a router's write lock")
+
+# SQL (modules/monitor/metrics.py)
+SQL_QUERY_SECONDS = histogram("simpleisp_sql_query_duration_seconds", "SQL statement duration")
+HTTP_REQUEST_SECONDS = histogram(
+    "simpleisp_http_request_duration_seconds", "HTTP request duration by route", ["method", "route"])
+HTTP_REQUESTS = counter(
+    "simpleisp_http_requests_total", "HTTP requests by route and status class", ["method", "route", "status"])
+HTTP_REQUEST_SQL_QUERIES = histogram(
+    "simpleisp_http_request_sql_queries", "SQL statements executed per HTTP request", ["route"], COUNT_BUCKETS)
+HTTP_REQUEST_SQL_SECONDS = histogram(
+    "simpleisp_http_request_sql_seconds", "Time spent in SQL per HTTP request", ["route"])
+
+# WebSocket /ws/traffic (modules/monitor/hub.py)
+WS_FRAMES_SENT = counter("simpleisp_ws_frames_sent_total", "Traffic frames sent to WebSocket subscribers")
+WS_BYTES_SENT = counter("simpleisp_ws_bytes_sent_total", "Bytes sent to WebSocket subscribers")
+
+# Suspensiones (modules/billing/service.py)
+SUSPENSION_PASS_SECONDS = histogram(
+    "simpleisp_suspension_pass_duration_seconds", "Duration of a check_suspensions pass")
+SUSPENSION_CHANGES = counter(
+    "simpleisp_suspension_changes_total", "Clients suspended or reactivated by check_suspensions", ["kind"])
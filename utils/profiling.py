@@ -0,0 +1,64 @@
+"""
+Per-request timing breakdown shared by the instrumented layers.
+
+The profiling middleware (modules/monitor/profiling.py) puts a RequestProfile
+in `current_profile` for the duration of a request; the DB, RouterOS API and
+thread-pool layers add their time with record(). When profiling is disabled
+no profile is ever set and record() is a single ContextVar lookup.
+"""
+import asyncio
+import contextvars
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+# Categorías del desglose (también los nombres de Server-Timing)
+TIMING_DB = "db"
+TIMING_ROUTER = "router"
+TIMING_SERIALIZE = "serialize"
+TIMING_THREADPOOL = "threadpool"
+TIMINGS = (TIMING_DB, TIMING_ROUTER, TIMING_SERIALIZE, TIMING_THREADPOOL)
+
+
+class RequestProfile:
+    __slots__ = ('method', 'path', 'started', 'duration', 'timings', 'counts', 'samples', 'status')
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.duration = 0.0
+        self.timings: Dict[str, float] = dict.fromkeys(TIMINGS, 0.0)
+        self.counts: Dict[str, int] = dict.fromkeys(TIMINGS, 0)
+        # Pila plegada ("a;b;c") -> número de muestras
+        self.samples: Counter = Counter()
+        self.status = 0
+
+    def add(self, kind: str, seconds: float):
+        self.timings[kind] += seconds
+        self.counts[kind] += 1
+
+
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar(
+    "current_profile", default=None)
+
+
+def record(kind: str, seconds: float):
+    """Adds `seconds` of `kind` to the profile of the request in progress, if any."""
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(kind, seconds)
+
+
+async def to_thread(func, *args, **kwargs):
+    """asyncio.to_thread that records the time spent waiting for a free worker thread."""
+    profile = current_profile.get()
+    if profile is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    queued = time.perf_counter()
+
+    def run():
+        profile.add(TIMING_THREADPOOL, time.perf_counter() - queued)
+        return func(*args, **kwargs)
+
+    return await asyncio.to_thread(run)
@@ -0,0 +1,77 @@
+"""
+Default thread pool of the event loop (asyncio.to_thread, run_in_executor).
+
+install_thread_pool() replaces the loop's default executor at startup with a
+ThreadPoolExecutor that counts its own jobs, so the metrics can report how
+many are waiting for a thread and how many are running without reading the
+private state of asyncio's or concurrent.futures' pool.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+# Mismo tamaño por defecto que el pool de asyncio
+THREAD_POOL_WORKERS = int(os.getenv("THREAD_POOL_WORKERS", "0")) or min(32, (os.cpu_count() or 1) + 4)
+
+
+class CountingThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that tracks queued and running jobs."""
+
+    def __init__(self, max_workers: int = THREAD_POOL_WORKERS, **kwargs):
+        super().__init__(max_workers, **kwargs)
+        self.max_workers = max_workers
+        self.queued = 0
+        self.running = 0
+        self._counts_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        def run():
+            with self._counts_lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock:
+                    self.running -= 1
+
+        with self._counts_lock:
+            self.queued += 1
+        try:
+            future = super().submit(run)
+        except BaseException:
+            with self._counts_lock:
+                self.queued -= 1
+            raise
+        future.add_done_callback(self._discount_cancelled)
+        return future
+
+    def _discount_cancelled(self, future: Future):
+        # Un trabajo cancelado antes de empezar nunca pasa por run()
+        if future.cancelled():
+            with self._counts_lock:
+                self.queued -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._counts_lock:
+            return {"queued": self.queued, "running": self.running, "max_workers": self.max_workers}
+
+
+_executor: Optional[CountingThreadPoolExecutor] = None
+
+
+def install_thread_pool() -> CountingThreadPoolExecutor:
+    """Sets a new CountingThreadPoolExecutor as the running loop's default executor."""
+    global _executor
+    _executor = CountingThreadPoolExecutor(thread_name_prefix="asyncio")
+    asyncio.get_running_loop().set_default_executor(_executor)
+    return _executor
+
+
+def thread_pool_stats() -> Dict[str, int]:
+    """Counts of the installed pool (zeros before install_thread_pool())."""
+    if _executor is None:
+        return {"queued": 0, "running": 0, "max_workers": 0}
+    return _executor.stats()